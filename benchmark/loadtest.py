@@ -0,0 +1,494 @@
+"""ทดสอบโหลดบริการ FastAPI: ยิง /transcribe, /text-translate และ WebSocket หลาย session พร้อมกัน
+แล้วรายงาน latency (p50/p95/p99), throughput และอัตราความผิดพลาดแยกตาม stage
+
+ตัวอย่าง (เริ่ม backend จำลองและ service ให้เอง):
+    python benchmark/loadtest.py --start-stubs --spawn-service fastapi --ws-clients 30 --duration 60
+
+ก่อนและหลังการทดสอบจะอ่าน /metrics ของ service แล้วรายงานเวลาของแต่ละ stage ฝั่ง server
+(stt_stage_latency_seconds เช่น health_check, whisper_queue/upload/inference, translation) เฉพาะช่วงที่ทดสอบ
+ถ้า service รันหลาย worker ต้องตั้ง PROMETHEUS_MULTIPROC_DIR ไม่เช่นนั้นจะเห็นเฉพาะ worker ที่ตอบ /metrics
+
+บันทึก traffic ที่ส่งจริง (เวลาที่ส่งและผลที่ได้ของแต่ละเหตุการณ์) แล้วนำกลับมาเล่นซ้ำกับอีก build:
+    python benchmark/loadtest.py --start-stubs --spawn-service fastapi --record traffic.jsonl
+    python benchmark/loadtest.py --start-stubs --spawn-service fastapi --replay traffic.jsonl
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from stub_servers import add_stub_arguments, start_stubs
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ประโยคสั้นที่ซ้ำบ่อย เพื่อให้เห็นผลของ cache และ batching
+PHRASES = [
+    "สวัสดีครับ", "ขอบคุณครับ", "ยินดีต้อนรับ", "ห้องน้ำอยู่ที่ไหน", "ราคาเท่าไหร่",
+    "กรุณารอสักครู่", "ขอเมนูหน่อยครับ", "เช็คบิลด้วยครับ", "พบกันใหม่", "ไม่เป็นไรครับ",
+]
+
+
+class StageStats:
+    """สถิติของ stage หนึ่ง"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.bytes_sent = 0
+
+    def record(self, latency: Optional[float], ok: bool = True, bytes_sent: int = 0):
+        if latency is not None:
+            self.latencies.append(latency)
+        if not ok:
+            self.errors += 1
+        self.bytes_sent += bytes_sent
+
+    def summary(self, elapsed: float) -> dict:
+        values = sorted(self.latencies)
+        return {
+            "count": len(values),
+            "errors": self.errors,
+            "error_rate": round(self.errors / max(1, len(values) + self.errors), 4),
+            "throughput_per_s": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+            "p50_ms": percentile_ms(values, 50),
+            "p95_ms": percentile_ms(values, 95),
+            "p99_ms": percentile_ms(values, 99),
+            "max_ms": round(values[-1] * 1000, 1) if values else None,
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+def percentile_ms(values: List[float], pct: float) -> Optional[float]:
+    """percentile แบบ nearest-rank (values ต้องเรียงแล้ว)"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return round(values[index] * 1000, 1)
+
+
+# ---------------------------------------------------------------------------
+# สร้าง / บันทึก / โหลด traffic
+# ---------------------------------------------------------------------------
+
+def generate_traffic(args, audio: bytes) -> Tuple[List[dict], Dict[str, bytes]]:
+    """สร้างลำดับเหตุการณ์ (offset เป็นวินาทีจากเริ่มทดสอบ) แบบกำหนดผลได้ด้วย seed"""
+    rng = random.Random(args.seed)
+    sha = hashlib.sha256(audio).hexdigest()
+    blobs = {sha: audio}
+    events: List[dict] = []
+
+    for client in range(args.ws_clients):
+        start = args.ramp_up * client / max(1, args.ws_clients)
+        t = start
+        while t < args.duration:
+            events.append({
+                "t": round(t, 3), "kind": "ws_chunk", "session": f"bench-{client}",
+                "blob": sha, "source_lang": args.source_lang, "target_lang": args.target_lang,
+                "streaming": args.streaming,
+            })
+            t += args.chunk_interval
+
+    for kind, rate in (("transcribe", args.transcribe_rps), ("text_translate", args.translate_rps)):
+        if rate <= 0:
+            continue
+        t = rng.expovariate(rate)
+        while t < args.duration:
+            event = {"t": round(t, 3), "kind": kind, "source_lang": args.source_lang, "target_lang": args.target_lang}
+            if kind == "transcribe":
+                event["blob"] = sha
+            else:
+                event["text"] = rng.choice(PHRASES)
+            events.append(event)
+            t += rng.expovariate(rate)
+
+    events.sort(key=lambda e: e["t"])
+    return events, blobs
+
+
+def save_traffic(path: str, events: List[dict], blobs: Dict[str, bytes]):
+    """บันทึกเหตุการณ์ที่ส่งจริง (t = เวลาที่ส่งจริง, observed = ผลที่ได้) เล่นซ้ำได้ด้วย --replay"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"type": "header", "version": 2, "created": time.time(), "events": len(events)}) + "\n")
+        for sha, data in blobs.items():
+            f.write(json.dumps({"type": "blob", "sha": sha, "data": base64.b64encode(data).decode()}) + "\n")
+        for event in events:
+            f.write(json.dumps({"type": "event", **event}, ensure_ascii=False) + "\n")
+    print(f"Recorded {len(events)} events to {path}")
+
+
+def load_traffic(path: str) -> Tuple[List[dict], Dict[str, bytes]]:
+    events: List[dict] = []
+    blobs: Dict[str, bytes] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            kind = record.pop("type")
+            if kind == "blob":
+                blobs[record["sha"]] = base64.b64decode(record["data"])
+            elif kind == "event":
+                # ผลที่สังเกตได้จากรอบที่บันทึกไม่ใช้ในการเล่นซ้ำ
+                record.pop("observed", None)
+                events.append(record)
+    events.sort(key=lambda e: e["t"])
+    return events, blobs
+
+
+# ---------------------------------------------------------------------------
+# ยิง traffic
+# ---------------------------------------------------------------------------
+
+class LoadRunner:
+    def __init__(self, target: str, events: List[dict], blobs: Dict[str, bytes], drain_timeout: float):
+        self.target = target.rstrip("/")
+        self.ws_target = self.target.replace("http://", "ws://").replace("https://", "wss://")
+        self.events = events
+        self.blobs = blobs
+        self.drain_timeout = drain_timeout
+        self.stats: Dict[str, StageStats] = defaultdict(StageStats)
+        self.messages: Dict[str, int] = defaultdict(int)
+        # เหตุการณ์ที่ส่งจริงตามเวลาที่ส่งจริง พร้อมผลที่ได้ (ใช้กับ --record)
+        self.observed: List[dict] = []
+        self.started = 0.0
+
+    def _observe(self, event: dict, sent_at: float) -> dict:
+        record = {**event, "t": round(sent_at - self.started, 3), "observed": {}}
+        self.observed.append(record)
+        return record
+
+    async def _sleep_until(self, offset: float):
+        delay = self.started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def run(self) -> float:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as session:
+            sessions: Dict[str, List[dict]] = defaultdict(list)
+            tasks = []
+            self.started = time.perf_counter()
+            for event in self.events:
+                if event["kind"] == "ws_chunk":
+                    sessions[event["session"]].append(event)
+                else:
+                    tasks.append(asyncio.create_task(self._http_event(session, event)))
+            for session_id, session_events in sessions.items():
+                tasks.append(asyncio.create_task(self._ws_session(session, session_id, session_events)))
+            await asyncio.gather(*tasks)
+        return time.perf_counter() - self.started
+
+    async def _http_event(self, session: aiohttp.ClientSession, event: dict):
+        await self._sleep_until(event["t"])
+        params = {"source_lang": event["source_lang"], "target_lang": event["target_lang"]}
+        started = time.perf_counter()
+        observed = self._observe(event, started)["observed"]
+        try:
+            if event["kind"] == "transcribe":
+                data = self.blobs[event["blob"]]
+                form = aiohttp.FormData()
+                form.add_field("audio_file", data, filename="audio.webm", content_type="audio/webm")
+                async with session.post(f"{self.target}/transcribe", params=params, data=form) as response:
+                    body = await response.json(content_type=None)
+                    ok = response.status == 200 and "error" not in body
+                latency = time.perf_counter() - started
+                self.stats["transcribe"].record(latency, ok, len(data))
+            else:
+                params["text"] = event["text"]
+                async with session.post(f"{self.target}/text-translate", params=params) as response:
+                    body = await response.json(content_type=None)
+                    ok = response.status == 200 and "error" not in body
+                latency = time.perf_counter() - started
+                self.stats["text_translate"].record(latency, ok, len(event["text"].encode()))
+            observed.update({"status": response.status, "ok": ok, "latency_ms": round(latency * 1000, 1)})
+        except Exception as e:
+            self.stats[event["kind"]].record(None, False)
+            observed.update({"ok": False, "error": str(e) or type(e).__name__})
+
+    async def _ws_session(self, session: aiohttp.ClientSession, session_id: str, events: List[dict]):
+        await self._sleep_until(events[0]["t"])
+        started = time.perf_counter()
+        try:
+            ws = await session.ws_connect(f"{self.ws_target}/ws/{session_id}", heartbeat=None)
+        except Exception:
+            self.stats["ws_connect"].record(None, False)
+            return
+        self.stats["ws_connect"].record(time.perf_counter() - started)
+
+        sent_at: Dict[int, float] = {}
+        observed: Dict[int, dict] = {}
+        pending = set()
+        done = asyncio.Event()
+
+        async def receive():
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                message = json.loads(msg.data)
+                kind = message.get("type") or message.get("status") or ("error" if "error" in message else "result")
+                self.messages[kind] += 1
+                seq = message.get("seq")
+                # partial ของโหมด streaming จะตามด้วย final ใน seq เดียวกัน จึงนับ latency จาก partial
+                if seq is None or seq not in pending or kind == "final":
+                    continue
+                pending.discard(seq)
+                ok = "error" not in message and kind not in ("dropped", "busy", "slow_down")
+                latency = time.perf_counter() - sent_at[seq]
+                self.stats["ws_result"].record(latency, ok)
+                if kind == "slow_down":
+                    self.stats["ws_rejected"].record(None)
+                observed[seq].update({"kind": kind, "ok": ok, "latency_ms": round(latency * 1000, 1)})
+                if kind == "silence":
+                    self.stats["ws_silence"].record(None)
+                if done.is_set() and not pending:
+                    break
+
+        receiver = asyncio.create_task(receive())
+        settings = {"source_lang": events[0]["source_lang"], "target_lang": events[0]["target_lang"]}
+        if events[0].get("streaming"):
+            settings["streaming"] = True
+        await ws.send_str(json.dumps(settings))
+
+        # server ให้ seq ตามลำดับ chunk ที่ได้รับทุก chunk (รวมที่ถูกทิ้งหรือปฏิเสธ) และส่ง seq นั้นกลับมา
+        # ในทุกผลลัพธ์ ผลจึงจับคู่กับ chunk ที่ส่งได้ตรงตัวแม้ผลจะมาไม่ตามลำดับ
+        for seq, event in enumerate(events):
+            await self._sleep_until(event["t"])
+            data = self.blobs[event["blob"]]
+            sent_at[seq] = time.perf_counter()
+            observed[seq] = self._observe(event, sent_at[seq])["observed"]
+            observed[seq]["seq"] = seq
+            pending.add(seq)
+            try:
+                await ws.send_bytes(data)
+                self.stats["ws_send"].record(time.perf_counter() - sent_at[seq], True, len(data))
+            except Exception as e:
+                self.stats["ws_send"].record(None, False)
+                observed[seq].update({"ok": False, "error": str(e) or type(e).__name__})
+                pending.discard(seq)
+
+        done.set()
+        try:
+            await asyncio.wait_for(receiver, timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            receiver.cancel()
+        for seq in pending:
+            self.stats["ws_result"].record(None, False)
+            observed[seq].update({"ok": False, "error": "no result"})
+        await ws.close()
+
+
+# ---------------------------------------------------------------------------
+# เวลาของแต่ละ stage ฝั่ง server จาก /metrics
+# ---------------------------------------------------------------------------
+
+STAGE_METRIC = re.compile(r'^stt_stage_latency_seconds_(bucket|sum|count)\{([^}]*)\}\s+(\S+)')
+METRIC_LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+
+def parse_stage_latency(text: str) -> Dict[str, dict]:
+    """แยก histogram stt_stage_latency_seconds จากข้อความ /metrics คืน {stage: {"buckets": {le: count}, "sum", "count"}}"""
+    stages: Dict[str, dict] = defaultdict(lambda: {"buckets": {}, "sum": 0.0, "count": 0.0})
+    for line in text.splitlines():
+        match = STAGE_METRIC.match(line)
+        if not match:
+            continue
+        kind, labels, value = match.groups()
+        labels = dict(METRIC_LABEL.findall(labels))
+        stage = stages[labels.get("stage", "")]
+        if kind == "bucket":
+            stage["buckets"][float(labels["le"])] = float(value)
+        else:
+            stage[kind] = float(value)
+    return dict(stages)
+
+
+async def scrape_stage_latency(target: str) -> Optional[Dict[str, dict]]:
+    """อ่าน /metrics ของ service (คืน None ถ้าอ่านไม่ได้)"""
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            async with session.get(f"{target}/metrics") as response:
+                if response.status != 200:
+                    print(f"Cannot read {target}/metrics: HTTP {response.status}")
+                    return None
+                return parse_stage_latency(await response.text())
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Cannot read {target}/metrics: {e}")
+        return None
+
+
+def histogram_quantile(buckets: List[Tuple[float, float]], q: float) -> Optional[float]:
+    """ประมาณ quantile จาก bucket สะสม (วิธีเดียวกับ histogram_quantile ของ Prometheus)"""
+    total = buckets[-1][1] if buckets else 0
+    if total <= 0:
+        return None
+    rank = q * total
+    lower_bound, lower_count = 0.0, 0.0
+    for upper_bound, count in buckets:
+        if count >= rank:
+            if upper_bound == float("inf"):
+                return lower_bound
+            if count == lower_count:
+                return upper_bound
+            return lower_bound + (upper_bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = upper_bound, count
+    return lower_bound
+
+
+def stage_latency_delta(before: Dict[str, dict], after: Dict[str, dict]) -> Dict[str, dict]:
+    """เวลาของแต่ละ stage เฉพาะที่เกิดระหว่างการทดสอบ (after - before)"""
+    summary = {}
+    for stage, current in after.items():
+        previous = before.get(stage, {"buckets": {}, "sum": 0.0, "count": 0.0})
+        count = current["count"] - previous["count"]
+        if count <= 0:
+            continue
+        buckets = sorted(
+            (le, value - previous["buckets"].get(le, 0.0)) for le, value in current["buckets"].items()
+        )
+
+        def quantile_ms(q: float) -> Optional[float]:
+            value = histogram_quantile(buckets, q)
+            return round(value * 1000, 1) if value is not None else None
+
+        summary[stage] = {
+            "count": int(count),
+            "mean_ms": round((current["sum"] - previous["sum"]) / count * 1000, 1),
+            "p50_ms": quantile_ms(0.50),
+            "p95_ms": quantile_ms(0.95),
+            "p99_ms": quantile_ms(0.99),
+        }
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# เริ่ม service ที่จะทดสอบ
+# ---------------------------------------------------------------------------
+
+async def spawn_service(args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "WHISPER_SERVICE_URL": f"http://{args.stub_host}:{args.whisper_port}",
+        "TRANSLATION_SERVICE": "libre",
+        "LIBRETRANSLATE_URL": f"http://{args.stub_host}:{args.translate_port}/translate",
+    })
+    port = args.target.rstrip("/").rsplit(":", 1)[-1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", port, "--log-level", "warning"],
+        cwd=os.path.join(ROOT_DIR, args.spawn_service) if not os.path.isabs(args.spawn_service) else args.spawn_service,
+        env=env,
+    )
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"{args.target}/health") as response:
+                    if response.status == 200:
+                        return process
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Service did not become ready")
+
+
+def print_report(report: dict):
+    print(f"\nElapsed: {report['elapsed_s']}s")
+    header = f"{'stage':<16}{'count':>8}{'errors':>8}{'err%':>8}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    print(header)
+    print("-" * len(header))
+    for stage, s in sorted(report["stages"].items()):
+        if not s.get("count") and not s.get("errors"):
+            continue
+        print(
+            f"{stage:<16}{s['count']:>8}{s['errors']:>8}{s['error_rate'] * 100:>7.1f}%{s['throughput_per_s']:>9}"
+            f"{str(s['p50_ms']):>10}{str(s['p95_ms']):>10}{str(s['p99_ms']):>10}{str(s['max_ms']):>10}"
+        )
+    print(f"\nWebSocket messages by type: {dict(report['ws_messages'])}")
+
+    server_stages = report.get("server_stages")
+    if server_stages is None:
+        print("\nServer stage latency: not available (/metrics could not be read)")
+        return
+    # percentile ประมาณจาก bucket ของ histogram จึงละเอียดได้เท่าขนาด bucket
+    print("\nServer stage latency during the run (from /metrics, percentiles estimated from buckets)")
+    header = f"{'stage':<22}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}"
+    print(header)
+    print("-" * len(header))
+    for stage, s in sorted(server_stages.items()):
+        print(
+            f"{stage:<22}{s['count']:>8}{str(s['mean_ms']):>10}"
+            f"{str(s['p50_ms']):>10}{str(s['p95_ms']):>10}{str(s['p99_ms']):>10}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="URL ของ service ที่จะทดสอบ")
+    parser.add_argument("--audio", default=os.path.join(ROOT_DIR, "test_audio.webm"))
+    parser.add_argument("--duration", type=float, default=30.0, help="ระยะเวลาสร้าง traffic (วินาที)")
+    parser.add_argument("--ws-clients", type=int, default=10)
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="วินาทีที่ใช้ทยอยเปิด WebSocket session")
+    parser.add_argument("--chunk-interval", type=float, default=5.0, help="วินาทีระหว่าง chunk เสียงต่อ session")
+    parser.add_argument("--streaming", action="store_true", help="เปิดโหมด streaming ของ WebSocket")
+    parser.add_argument("--transcribe-rps", type=float, default=0.2)
+    parser.add_argument("--translate-rps", type=float, default=2.0)
+    parser.add_argument("--source-lang", default="th")
+    parser.add_argument("--target-lang", default="en")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="วินาทีที่รอผลที่ค้างหลังส่ง chunk สุดท้าย")
+    parser.add_argument("--record", help="บันทึก traffic ที่ส่งจริงและผลที่ได้ลงไฟล์ JSONL")
+    parser.add_argument("--replay", help="เล่น traffic จากไฟล์ที่บันทึกไว้แทนการสร้างใหม่")
+    parser.add_argument("--report-json", help="บันทึกผลลัพธ์เป็น JSON")
+    parser.add_argument("--start-stubs", action="store_true", help="เริ่ม Whisper/LibreTranslate จำลองใน process นี้")
+    parser.add_argument("--spawn-service", metavar="DIR", help="เริ่ม uvicorn main:app จากโฟลเดอร์นี้โดยชี้ไปที่ backend จำลอง")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    if args.replay:
+        events, blobs = load_traffic(args.replay)
+    else:
+        with open(args.audio, "rb") as f:
+            audio = f.read()
+        events, blobs = generate_traffic(args, audio)
+
+    runners = await start_stubs(args) if args.start_stubs else []
+    service = await spawn_service(args) if args.spawn_service else None
+    try:
+        print(f"Running {len(events)} events against {args.target}")
+        metrics_before = await scrape_stage_latency(args.target)
+        runner = LoadRunner(args.target, events, blobs, args.drain_timeout)
+        elapsed = await runner.run()
+        metrics_after = await scrape_stage_latency(args.target)
+        report = {
+            "elapsed_s": round(elapsed, 2),
+            "events": len(events),
+            "stages": {stage: stats.summary(elapsed) for stage, stats in runner.stats.items()},
+            "ws_messages": runner.messages,
+            "server_stages": (
+                stage_latency_delta(metrics_before, metrics_after)
+                if metrics_before is not None and metrics_after is not None else None
+            ),
+        }
+        print_report(report)
+        if args.record:
+            save_traffic(args.record, sorted(runner.observed, key=lambda e: e["t"]), blobs)
+        if args.report_json:
+            with open(args.report_json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+        for stub in runners:
+            await stub.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+"""Whisper, LibreTranslate และ Redis จำลองสำหรับทดสอบโหลด (ไม่ต้องใช้ GPU หรือ network)
+
+ตัวอย่าง:
+    python benchmark/stub_servers.py --whisper-port 9000 --translate-port 5000 \
+        --whisper-latency 0.8 --whisper-jitter 0.3 --whisper-error-rate 0.02 --redis-port 6379
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from typing import Dict, List, Optional, Set
+
+from aiohttp import web
+
+
+class StubBehavior:
+    """ค่าหน่วงเวลาและอัตราความผิดพลาดของ backend จำลอง"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 per_kb_latency: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.per_kb_latency = per_kb_latency
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    async def wait(self, payload_bytes: int = 0):
+        delay = self.latency + self.per_kb_latency * payload_bytes / 1024
+        if self.jitter:
+            delay += self.random.uniform(-self.jitter, self.jitter)
+        await asyncio.sleep(max(0.0, delay))
+
+    def should_fail(self) -> bool:
+        self.requests += 1
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+
+def create_whisper_app(behavior: StubBehavior) -> web.Application:
+    """แอปจำลอง openai-whisper-asr-webservice (/asr, /openapi.json, /health)"""
+
+    async def asr(request: web.Request) -> web.Response:
+        form = await request.post()
+        audio = form.get("audio_file")
+        data = audio.file.read() if audio is not None else b""
+        await behavior.wait(len(data))
+        if behavior.should_fail():
+            return web.json_response({"detail": "stub failure"}, status=500)
+
+        # ข้อความขึ้นกับเนื้อหาเสียง เพื่อให้ผลซ้ำได้และ cache ทำงานเหมือนของจริง
+        digest = hashlib.sha256(data).hexdigest()[:8]
+        duration = max(1.0, len(data) / 16000)
+        words: List[str] = [f"word{digest[i]}" for i in range(min(8, max(1, int(duration))))]
+        segments = [
+            {"id": i, "start": float(i), "end": float(i + 1), "text": f" {word}"}
+            for i, word in enumerate(words)
+        ]
+        return web.json_response({
+            "text": " ".join(words),
+            "segments": segments,
+            "language": request.query.get("language", "th")
+        })
+
+    async def ok(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post("/asr", asr)
+    app.router.add_get("/openapi.json", ok)
+    app.router.add_get("/health", ok)
+    return app
+
+
+def create_translate_app(behavior: StubBehavior) -> web.Application:
+    """แอปจำลอง LibreTranslate (/translate รองรับ q เป็น string หรือ list, /languages)"""
+
+    async def translate(request: web.Request) -> web.Response:
+        payload = await request.json()
+        q = payload.get("q", "")
+        texts = q if isinstance(q, list) else [q]
+        await behavior.wait(sum(len(t.encode()) for t in texts))
+        if behavior.should_fail():
+            return web.json_response({"error": "stub failure"}, status=500)
+
+        target = payload.get("target", "en")
+        translated = [f"[{target}] {text}" for text in texts]
+        return web.json_response({"translatedText": translated if isinstance(q, list) else translated[0]})
+
+    async def languages(request: web.Request) -> web.Response:
+        return web.json_response([{"code": "th", "name": "Thai"}, {"code": "en", "name": "English"}])
+
+    app = web.Application()
+    app.router.add_post("/translate", translate)
+    app.router.add_get("/languages", languages)
+    return app
+
+
+class StubRedis:
+    """Redis จำลอง (RESP2) เฉพาะคำสั่งที่ registry ใช้ สำหรับทดสอบหลาย worker โดยไม่ต้องติดตั้ง Redis"""
+
+    def __init__(self):
+        self.values: Dict[bytes, object] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.commands = 0
+
+    def _alive(self, key: bytes) -> bool:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.values
+
+    @staticmethod
+    def encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(StubRedis.encode(item) for item in value)
+        return b"+%s\r\n" % str(value).encode()
+
+    @staticmethod
+    async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:].strip())
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:].strip())
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def execute(self, args: List[bytes], writer: asyncio.StreamWriter) -> bytes:
+        self.commands += 1
+        command, args = args[0].upper(), args[1:]
+        if command in (b"PING", b"AUTH", b"SELECT"):
+            return self.encode("PONG" if command == b"PING" else "OK")
+        if command == b"GET":
+            value = self.values.get(args[0]) if self._alive(args[0]) else None
+            return self.encode(value if isinstance(value, bytes) else None)
+        if command == b"SET":
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            if b"NX" in options and self._alive(key):
+                return self.encode(None)
+            self.values[key] = value
+            self.expires.pop(key, None)
+            if b"PX" in options:
+                self.expires[key] = time.monotonic() + int(options[options.index(b"PX") + 1]) / 1000
+            return self.encode("OK")
+        if command == b"DEL":
+            removed = sum(1 for key in args if self._alive(key) and self.values.pop(key, None) is not None)
+            return self.encode(removed)
+        if command == b"HSET":
+            if not self._alive(args[0]):
+                self.values[args[0]] = {}
+            self.values[args[0]][args[1]] = args[2]
+            return self.encode(1)
+        if command == b"HDEL":
+            fields = self.values.get(args[0], {}) if self._alive(args[0]) else {}
+            removed = sum(1 for field in args[1:] if fields.pop(field, None) is not None)
+            if args[0] in self.values and not fields:
+                del self.values[args[0]]
+            return self.encode(removed)
+        if command == b"HGETALL":
+            fields = self.values.get(args[0], {}) if self._alive(args[0]) else {}
+            return self.encode([item for pair in fields.items() for item in pair])
+        if command == b"PUBLISH":
+            subscribers = self.channels.get(args[0], set())
+            for subscriber in subscribers:
+                subscriber.write(self.encode([b"message", args[0], args[1]]))
+            return self.encode(len(subscribers))
+        if command == b"SUBSCRIBE":
+            replies = []
+            for channel in args:
+                self.channels.setdefault(channel, set()).add(writer)
+                replies.append(self.encode([b"subscribe", channel, 1]))
+            return b"".join(replies)
+        return b"-ERR unknown command '%s'\r\n" % command
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                args = await self.read_command(reader)
+                if not args:
+                    break
+                writer.write(self.execute(args, writer))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for subscribers in self.channels.values():
+                subscribers.discard(writer)
+            writer.close()
+
+
+async def start_app(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--stub-host", default="127.0.0.1")
+    parser.add_argument("--whisper-port", type=int, default=9000)
+    parser.add_argument("--translate-port", type=int, default=5000)
+    parser.add_argument("--whisper-latency", type=float, default=0.5, help="วินาทีต่อ request")
+    parser.add_argument("--whisper-jitter", type=float, default=0.1)
+    parser.add_argument("--whisper-per-kb-latency", type=float, default=0.0, help="วินาทีเพิ่มต่อ KB ของเสียง")
+    parser.add_argument("--whisper-error-rate", type=float, default=0.0)
+    parser.add_argument("--translate-latency", type=float, default=0.05)
+    parser.add_argument("--translate-jitter", type=float, default=0.02)
+    parser.add_argument("--translate-error-rate", type=float, default=0.0)
+    parser.add_argument("--redis-port", type=int, default=0, help="เปิด Redis จำลองที่ port นี้ (0 = ไม่เปิด)")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+async def start_stubs(args) -> List[web.AppRunner]:
+    """เริ่ม backend จำลองตาม argument ที่ได้จาก add_stub_arguments"""
+    whisper = StubBehavior(args.whisper_latency, args.whisper_jitter, args.whisper_error_rate,
+                           args.whisper_per_kb_latency, args.seed)
+    translate = StubBehavior(args.translate_latency, args.translate_jitter, args.translate_error_rate,
+                             seed=args.seed + 1)
+    if args.redis_port:
+        # server ทำงานต่อจนกว่า event loop จะปิด
+        await asyncio.start_server(StubRedis().handle, args.stub_host, args.redis_port)
+    return [
+        await start_app(create_whisper_app(whisper), args.stub_host, args.whisper_port),
+        await start_app(create_translate_app(translate), args.stub_host, args.translate_port),
+    ]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    runners = await start_stubs(args)
+    print(f"Whisper stub: http://{args.stub_host}:{args.whisper_port}")
+    print(f"LibreTranslate stub: http://{args.stub_host}:{args.translate_port}/translate")
+    if args.redis_port:
+        print(f"Redis stub: redis://{args.stub_host}:{args.redis_port}/0")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
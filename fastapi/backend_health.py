@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from http_client import HttpClientManager
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Circuit breaker แบบง่าย: closed -> open เมื่อล้มเหลวติดกัน, open -> half_open เมื่อครบเวลารอ"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def is_blocking(self) -> bool:
+        """เปิดวงจรอยู่และยังไม่ถึงเวลาลองใหม่ (ตรวจได้โดยไม่เปลี่ยนสถานะ)"""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow_request(self) -> bool:
+        """คืน True ถ้าอนุญาตให้ส่ง request ไปยัง backend ได้"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        # half_open: ปล่อยให้ลองได้ทีละหนึ่ง request
+        if self._trial_in_flight:
+            return False
+        self._trial_in_flight = True
+        return True
+
+    def release_trial(self):
+        """คืนสิทธิ์ทดลองของ half_open โดยไม่นับเป็นผลสำเร็จหรือล้มเหลว (request ไม่ได้ไปถึง backend)"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Circuit closed after successful call")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit opened after {self.consecutive_failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class BackendStatus:
+    """สถานะล่าสุดของ backend หนึ่งตัว (cache ไว้ให้ endpoint อ่านได้ทันที)"""
+
+    def __init__(self, name: str, probe_url: Optional[str], breaker: CircuitBreaker, window: int = 50):
+        self.name = name
+        self.probe_url = probe_url
+        self.breaker = breaker
+        self.is_up: Optional[bool] = None  # None = ยังไม่เคยตรวจสอบ
+        self.last_checked: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_latency: Optional[float] = None
+        self.avg_latency: Optional[float] = None
+        self.total_calls = 0
+        self.total_failures = 0
+        self._outcomes = deque(maxlen=window)
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for ok in self._outcomes if not ok) / len(self._outcomes)
+
+    @property
+    def is_available(self) -> bool:
+        """พร้อมรับงานหรือไม่ (ยังไม่เคยตรวจถือว่าพร้อม เพื่อไม่ให้ request แรกถูกปฏิเสธ)"""
+        return self.is_up is not False and self.breaker.state != CircuitBreaker.OPEN
+
+    def record(self, ok: bool, latency: Optional[float] = None, error: Optional[str] = None):
+        self.total_calls += 1
+        self._outcomes.append(ok)
+        if latency is not None:
+            self.last_latency = latency
+            # ค่าเฉลี่ยแบบ EWMA เพื่อให้ตอบสนองต่อการเปลี่ยนแปลงล่าสุด
+            self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+        if ok:
+            self.is_up = True
+            self.last_error = None
+            self.breaker.record_success()
+        else:
+            self.total_failures += 1
+            self.last_error = error
+            self.breaker.record_failure()
+            if self.breaker.state == CircuitBreaker.OPEN:
+                self.is_up = False
+
+    def to_dict(self) -> dict:
+        return {
+            "status": "unknown" if self.is_up is None else ("up" if self.is_up else "down"),
+            "circuit": self.breaker.state,
+            "last_checked": self.last_checked,
+            "last_latency_ms": round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            "avg_latency_ms": round(self.avg_latency * 1000, 1) if self.avg_latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "total_calls": self.total_calls,
+            "total_failures": self.total_failures,
+            "last_error": self.last_error,
+        }
+
+
+StatusListener = Callable[[BackendStatus], Awaitable[None]]
+
+
+class BackendMonitor:
+    """ตรวจสอบสุขภาพของ backend เป็นระยะใน background task แทนการตรวจทุก request"""
+
+    def __init__(
+        self,
+        http_clients: HttpClientManager,
+        interval: float = 10.0,
+        probe_timeout: float = 5.0,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+    ):
+        self.http_clients = http_clients
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.backends: Dict[str, BackendStatus] = {}
+        self._listeners: List[StatusListener] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, probe_url: Optional[str] = None) -> BackendStatus:
+        """ลงทะเบียน backend (probe_url เป็น None = ติดตามจากผลของ request จริงเท่านั้น)"""
+        status = BackendStatus(name, probe_url, CircuitBreaker(self.failure_threshold, self.reset_timeout))
+        self.backends[name] = status
+        return status
+
+    def add_listener(self, listener: StatusListener):
+        """เพิ่ม callback ที่จะถูกเรียกเมื่อสถานะ up/down ของ backend เปลี่ยน"""
+        self._listeners.append(listener)
+
+    def get(self, name: str) -> BackendStatus:
+        return self.backends[name]
+
+    def allow_request(self, name: str) -> bool:
+        status = self.backends.get(name)
+        return status is None or status.breaker.allow_request()
+
+    def release_trial(self, name: str):
+        status = self.backends.get(name)
+        if status is not None:
+            status.breaker.release_trial()
+
+    async def record_result(self, name: str, ok: bool, latency: Optional[float] = None, error: Optional[str] = None):
+        """บันทึกผลของ request จริงเข้าสถิติและ circuit breaker"""
+        status = self.backends.get(name)
+        if status is None:
+            return
+        previous = status.is_up
+        status.record(ok, latency, error)
+        await self._notify_if_changed(status, previous)
+
+    async def check(self, name: str) -> BackendStatus:
+        """probe backend หนึ่งครั้ง"""
+        status = self.backends[name]
+        if not status.probe_url:
+            return status
+
+        previous = status.is_up
+        started = time.perf_counter()
+        try:
+            response = await self.http_clients.get(name, status.probe_url, timeout=self.probe_timeout)
+            ok = response.status_code == 200
+            error = None if ok else f"HTTP {response.status_code}"
+        except Exception as e:
+            ok = False
+            error = str(e) or type(e).__name__
+        latency = time.perf_counter() - started
+
+        status.last_checked = time.time()
+        status.record(ok, latency, error)
+        # ผลจาก probe เป็นสถานะที่แท้จริงของ backend ณ ตอนนี้
+        status.is_up = ok
+        if not ok:
+            logger.warning(f"Health probe failed for {name}: {error}")
+        await self._notify_if_changed(status, previous)
+        return status
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(name) for name in self.backends))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error(f"Error in backend monitor: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def _notify_if_changed(self, status: BackendStatus, previous: Optional[bool]):
+        if previous == status.is_up:
+            return
+        logger.info(f"Backend {status.name} is now {'up' if status.is_up else 'down'}")
+        for listener in self._listeners:
+            try:
+                await listener(status)
+            except Exception as e:
+                logger.error(f"Error in backend status listener: {str(e)}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict:
+        return {name: status.to_dict() for name, status in self.backends.items()}
@@ -0,0 +1,537 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from registry import Registry
+from streaming import parse_segments
+from vad import VoiceActivityDetector, decode_file_to_pcm, encode_wav
+from whisper_scheduler import SchedulerBusy
+
+logger = logging.getLogger(__name__)
+
+TranscribeFunc = Callable[[bytes, str, str], Awaitable[Optional[dict]]]
+TranslateFunc = Callable[[str, str, str], Awaitable[Optional[str]]]
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def frame_energy_db(pcm: np.ndarray, frame_length: int, block_frames: int = 8192) -> np.ndarray:
+    """พลังงาน (dBFS) ต่อเฟรม คำนวณทีละก้อนเพื่อไม่ให้ไฟล์ยาวใช้หน่วยความจำมาก"""
+    frame_count = len(pcm) // frame_length
+    energy = np.empty(frame_count, dtype=np.float32)
+    for first in range(0, frame_count, block_frames):
+        last = min(frame_count, first + block_frames)
+        frames = np.asarray(pcm[first * frame_length:last * frame_length], dtype=np.float32)
+        frames = frames.reshape(last - first, frame_length) / 32768.0
+        energy[first:last] = 20.0 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10)
+    return energy
+
+
+def split_at_silence(
+    pcm: np.ndarray,
+    sample_rate: int = 16000,
+    frame_ms: float = 30.0,
+    min_seconds: float = 10.0,
+    max_seconds: float = 30.0,
+    smooth_ms: float = 300.0,
+) -> List[Tuple[int, int]]:
+    """แบ่งเสียงยาวเป็นช่วง (sample เริ่ม, sample จบ) โดยตัดที่จุดเงียบที่สุดระหว่าง min_seconds ถึง max_seconds"""
+    frame_length = max(1, int(sample_rate * frame_ms / 1000))
+    energy = frame_energy_db(pcm, frame_length)
+    if len(energy) == 0:
+        return [(0, len(pcm))] if len(pcm) else []
+
+    # เฉลี่ยพลังงานของเฟรมข้างเคียง เพื่อเลือกช่วงเงียบจริงแทนที่จะเป็นเฟรมเงียบเฟรมเดียวกลางคำ
+    window = max(1, int(smooth_ms / frame_ms))
+    smoothed = np.convolve(energy, np.ones(window, dtype=np.float32) / window, mode="same")
+
+    min_frames = max(1, int(min_seconds * 1000 / frame_ms))
+    max_frames = max(min_frames + 1, int(max_seconds * 1000 / frame_ms))
+    boundaries = []
+    start = 0
+    while len(energy) - start > max_frames:
+        search = smoothed[start + min_frames:start + max_frames]
+        # ตัดกลางช่วงเงียบที่ต่อเนื่องกัน ไม่ใช่ขอบ เพื่อไม่ให้ตัดหัวหรือท้ายคำ
+        lowest = int(np.argmin(search))
+        quiet = search <= search[lowest] + 1.0
+        left = lowest
+        while left > 0 and quiet[left - 1]:
+            left -= 1
+        right = lowest
+        while right < len(search) - 1 and quiet[right + 1]:
+            right += 1
+        cut = start + min_frames + (left + right) // 2
+        boundaries.append((start * frame_length, cut * frame_length))
+        start = cut
+    boundaries.append((start * frame_length, len(pcm)))
+    return boundaries
+
+
+class BatchSegment:
+    """ช่วงเสียงหนึ่งช่วงของงาน (ตำแหน่งเป็น sample ในไฟล์ PCM)"""
+
+    def __init__(self, index: int, start: int, end: int):
+        self.index = index
+        self.start = start
+        self.end = end
+
+    def to_dict(self) -> dict:
+        return {"index": self.index, "start": self.start, "end": self.end}
+
+
+class BatchJob:
+    """งานถอดเสียงไฟล์ยาวหนึ่งงาน เก็บ PCM และผลที่เสร็จแล้วไว้บนดิสก์เพื่อให้ทำต่อได้"""
+
+    def __init__(self, job_id: str, directory: str, source_lang: str, target_lang: str,
+                 sample_rate: int, duration: float, segments: List[BatchSegment],
+                 skipped_seconds: float = 0.0, created_at: Optional[float] = None):
+        self.job_id = job_id
+        self.directory = directory
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.sample_rate = sample_rate
+        self.duration = duration
+        self.segments = segments
+        self.skipped_seconds = skipped_seconds
+        self.created_at = created_at or time.time()
+        self.results: Dict[int, dict] = {}
+        self.failed = 0
+        self.task: Optional[asyncio.Task] = None
+        self.listeners: List[asyncio.Queue] = []
+        self._pcm: Optional[np.ndarray] = None
+
+    @property
+    def pcm_path(self) -> str:
+        return os.path.join(self.directory, "audio.pcm")
+
+    @property
+    def results_path(self) -> str:
+        return os.path.join(self.directory, "results.jsonl")
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def pending(self) -> List[BatchSegment]:
+        return [segment for segment in self.segments if segment.index not in self.results]
+
+    def pcm(self) -> np.ndarray:
+        if self._pcm is None:
+            self._pcm = np.memmap(self.pcm_path, dtype=np.int16, mode="r")
+        return self._pcm
+
+    def header(self) -> dict:
+        return {
+            "type": "job",
+            "job_id": self.job_id,
+            "source_lang": self.source_lang,
+            "target_lang": self.target_lang,
+            "duration": round(self.duration, 2),
+            "segments": len(self.segments),
+            "completed": len(self.results),
+            "skipped_seconds": round(self.skipped_seconds, 2),
+        }
+
+    def done_message(self) -> dict:
+        return {
+            "type": "done",
+            "job_id": self.job_id,
+            "segments": len(self.segments),
+            "completed": len(self.results),
+            "failed": len(self.segments) - len(self.results),
+        }
+
+    def publish(self, message: dict):
+        for queue in self.listeners:
+            queue.put_nowait(message)
+
+    def save(self):
+        metadata = {
+            "job_id": self.job_id,
+            "source_lang": self.source_lang,
+            "target_lang": self.target_lang,
+            "sample_rate": self.sample_rate,
+            "duration": self.duration,
+            "skipped_seconds": self.skipped_seconds,
+            "created_at": self.created_at,
+            "segments": [segment.to_dict() for segment in self.segments],
+        }
+        with open(os.path.join(self.directory, "job.json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+
+    def append_result(self, result: dict):
+        self.results[result["index"]] = result
+        with open(self.results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    def read_results(self, position: int = 0) -> Tuple[List[dict], int]:
+        """อ่านผลที่เขียนต่อท้ายไฟล์ตั้งแต่ byte ที่ position คืน (ผลใหม่, ตำแหน่งถัดไป)
+        บรรทัดที่ยังไม่มี newline (กำลังเขียนหรือเขียนไม่ครบเพราะ process ถูกหยุด) จะยังไม่ถูกอ่าน"""
+        if not os.path.exists(self.results_path):
+            return [], position
+        with open(self.results_path, "rb") as f:
+            f.seek(position)
+            data = f.read()
+        complete = data.rfind(b"\n") + 1
+        results = []
+        for line in data[:complete].decode("utf-8", errors="replace").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                # บรรทัดที่เขียนไม่ครบแล้วถูกเขียนต่อท้ายในรอบถัดไป ช่วงนั้นจะถูกถอดเสียงใหม่
+                continue
+        return results, position + complete
+
+    @classmethod
+    def load(cls, directory: str) -> "BatchJob":
+        with open(os.path.join(directory, "job.json"), encoding="utf-8") as f:
+            metadata = json.load(f)
+        job = cls(
+            metadata["job_id"],
+            directory,
+            metadata["source_lang"],
+            metadata["target_lang"],
+            metadata["sample_rate"],
+            metadata["duration"],
+            [BatchSegment(s["index"], s["start"], s["end"]) for s in metadata["segments"]],
+            metadata.get("skipped_seconds", 0.0),
+            metadata.get("created_at"),
+        )
+        # บรรทัดสุดท้ายอาจเขียนไม่ครบถ้า process ถูกหยุดกลางคัน
+        for result in job.read_results()[0]:
+            job.results[result["index"]] = result
+        return job
+
+
+class BatchJobManager:
+    """สร้างและรันงานถอดเสียงไฟล์ยาว: แบ่งเสียงที่จุดเงียบ ถอดเสียงและแปลหลายช่วงพร้อมกันแบบจำกัดจำนวน
+    แล้วส่งผลของแต่ละช่วงทันทีที่เสร็จ งานที่ค้างอยู่ทำต่อได้ด้วย job_id (รวมถึงหลัง restart)
+    ถ้าให้ registry มา งานหนึ่งจะรันได้ทีละ worker (lease ใน registry) worker อื่นส่งผลโดยอ่านจากไฟล์ผลแทน"""
+
+    def __init__(
+        self,
+        base_dir: str,
+        transcribe: TranscribeFunc,
+        translate: TranslateFunc,
+        detector: Optional[VoiceActivityDetector] = None,
+        sample_rate: int = 16000,
+        max_concurrency: int = 2,
+        min_segment_seconds: float = 10.0,
+        max_segment_seconds: float = 30.0,
+        max_retries: int = 3,
+        job_ttl: float = 86400.0,
+        registry: Optional[Registry] = None,
+        worker_id: str = "",
+        lease_ttl: float = 30.0,
+        poll_interval: float = 1.0,
+    ):
+        self.base_dir = base_dir
+        self.transcribe = transcribe
+        self.translate = translate
+        self.detector = detector
+        self.sample_rate = sample_rate
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_segment_seconds = min_segment_seconds
+        self.max_segment_seconds = max_segment_seconds
+        self.max_retries = max_retries
+        self.job_ttl = job_ttl
+        self.registry = registry
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.jobs: Dict[str, BatchJob] = {}
+        self.jobs_created = 0
+        self.segments_completed = 0
+        self.segments_failed = 0
+
+    async def create_job(self, upload: BinaryIO, source_lang: str, target_lang: str) -> BatchJob:
+        """บันทึกไฟล์อัปโหลด ถอดรหัสเป็น PCM และแบ่งช่วง (ถ้าถอดรหัสไม่ได้จะ raise ValueError)"""
+        await asyncio.to_thread(self.cleanup_expired)
+        job_id = uuid.uuid4().hex
+        directory = os.path.join(self.base_dir, job_id)
+        await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+        try:
+            input_path = os.path.join(directory, "input")
+            await asyncio.to_thread(self._save_upload, upload, input_path)
+            pcm_path = os.path.join(directory, "audio.pcm")
+            if not await decode_file_to_pcm(input_path, pcm_path, self.sample_rate):
+                raise ValueError("ไม่สามารถถอดรหัสไฟล์เสียงได้")
+            # ไม่ต้องเก็บไฟล์ต้นฉบับอีกเมื่อได้ PCM แล้ว
+            await asyncio.to_thread(os.remove, input_path)
+
+            segments, skipped_seconds = await asyncio.to_thread(self._plan_segments, pcm_path)
+            duration = os.path.getsize(pcm_path) / 2 / self.sample_rate
+            job = BatchJob(job_id, directory, source_lang, target_lang, self.sample_rate,
+                           duration, segments, skipped_seconds)
+            await asyncio.to_thread(job.save)
+        except BaseException:
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+            raise
+
+        self.jobs[job_id] = job
+        self.jobs_created += 1
+        logger.info(f"Created batch job {job_id}: {duration:.1f}s audio, {len(segments)} segments")
+        return job
+
+    @staticmethod
+    def _save_upload(upload: BinaryIO, path: str):
+        with open(path, "wb") as f:
+            shutil.copyfileobj(upload, f, 1024 * 1024)
+
+    def _plan_segments(self, pcm_path: str) -> Tuple[List[BatchSegment], float]:
+        pcm = np.memmap(pcm_path, dtype=np.int16, mode="r") if os.path.getsize(pcm_path) else np.zeros(0, np.int16)
+        boundaries = split_at_silence(
+            pcm,
+            self.sample_rate,
+            min_seconds=self.min_segment_seconds,
+            max_seconds=self.max_segment_seconds,
+        )
+        segments = []
+        skipped = 0.0
+        for start, end in boundaries:
+            # ข้ามช่วงที่ไม่มีเสียงพูดเลย ไม่ต้องส่งไป Whisper
+            if self.detector is not None and not self.detector.analyze(np.asarray(pcm[start:end])).has_speech:
+                skipped += (end - start) / self.sample_rate
+                continue
+            segments.append(BatchSegment(len(segments), start, end))
+        return segments, skipped
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        """คืนงานจากหน่วยความจำ หรือโหลดจากดิสก์ (เช่นหลัง restart)"""
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        directory = os.path.join(self.base_dir, job_id)
+        if not os.path.exists(os.path.join(directory, "job.json")):
+            return None
+        try:
+            job = BatchJob.load(directory)
+        except Exception as e:
+            logger.error(f"Error loading batch job {job_id}: {str(e)}")
+            return None
+        self.jobs[job_id] = job
+        return job
+
+    @staticmethod
+    def _lease_key(job: BatchJob) -> str:
+        return f"batch:{job.job_id}"
+
+    async def _acquire_lease(self, job: BatchJob) -> bool:
+        """จองสิทธิ์รันงาน (registry ใช้ไม่ได้ = รันใน worker นี้ตามเดิม)"""
+        if self.registry is None:
+            return True
+        try:
+            return await self.registry.set(self._lease_key(job), self.worker_id, self.lease_ttl, nx=True)
+        except Exception as e:
+            logger.error(f"Error acquiring lease of batch job {job.job_id}: {str(e)}")
+            return True
+
+    async def _lease_held_elsewhere(self, job: BatchJob) -> bool:
+        try:
+            owner = await self.registry.get(self._lease_key(job))
+        except Exception as e:
+            logger.error(f"Error reading lease of batch job {job.job_id}: {str(e)}")
+            return False
+        return owner is not None and owner != self.worker_id
+
+    async def _renew_lease(self, job: BatchJob):
+        """ต่ออายุ lease ระหว่างที่งานยังรันอยู่ ถ้า worker นี้หยุดไป lease จะหมดอายุและ worker อื่นทำต่อได้"""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                if await self.registry.get(self._lease_key(job)) == self.worker_id:
+                    await self.registry.set(self._lease_key(job), self.worker_id, self.lease_ttl)
+                else:
+                    logger.warning(f"Lost lease of batch job {job.job_id}")
+            except Exception as e:
+                logger.error(f"Error renewing lease of batch job {job.job_id}: {str(e)}")
+
+    async def _release_lease(self, job: BatchJob):
+        try:
+            if await self.registry.get(self._lease_key(job)) == self.worker_id:
+                await self.registry.delete(self._lease_key(job))
+        except Exception as e:
+            logger.error(f"Error releasing lease of batch job {job.job_id}: {str(e)}")
+
+    async def ensure_running(self, job: BatchJob) -> bool:
+        """เริ่มประมวลผลช่วงที่ยังไม่เสร็จ (รวมถึงช่วงที่ล้มเหลวในรอบก่อน)
+        คืน True ถ้างานกำลังรันอยู่ใน worker นี้ (False = ไม่มีช่วงค้าง หรือ worker อื่นถือ lease อยู่)"""
+        if job.running:
+            return True
+        if not job.pending or not await self._acquire_lease(job):
+            return False
+        if self.registry is not None:
+            # worker อื่นอาจทำบางช่วงเสร็จไปแล้วหลังจากที่ worker นี้โหลดงาน
+            for result in (await asyncio.to_thread(job.read_results))[0]:
+                job.results[result["index"]] = result
+            if not job.pending:
+                await self._release_lease(job)
+                return False
+        job.task = asyncio.create_task(self._run(job))
+        return True
+
+    async def _follow(self, job: BatchJob) -> AsyncIterator[dict]:
+        """ส่งผลของงานที่ worker อื่นกำลังรัน โดยอ่านบรรทัดใหม่จากไฟล์ผล จนกว่าจะครบหรือ lease หมดไป"""
+        position = 0
+        while True:
+            results, position = await asyncio.to_thread(job.read_results, position)
+            for result in results:
+                job.results[result["index"]] = result
+                yield result
+            if not job.pending or not await self._lease_held_elsewhere(job):
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def stream(self, job: BatchJob) -> AsyncIterator[str]:
+        """ส่งผลเป็น NDJSON: หัวงาน, ผลที่เสร็จแล้ว, ผลใหม่ทันทีที่เสร็จ และบรรทัด done
+        client ที่หลุดกลางทางไม่ทำให้งานหยุด เรียกซ้ำด้วย job_id เดิมเพื่อรับผลต่อได้"""
+        queue: asyncio.Queue = asyncio.Queue()
+        job.listeners.append(queue)
+        try:
+            # ลงทะเบียนรับผลก่อนอ่านผลที่มีอยู่ (ไม่มี await คั่น) จึงไม่มีผลตกหล่นหรือซ้ำ
+            existing = [job.results[index] for index in sorted(job.results)]
+            sent = set(job.results)
+            yield json.dumps(job.header(), ensure_ascii=False) + "\n"
+            for result in existing:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+            while True:
+                if await self.ensure_running(job):
+                    while True:
+                        message = await queue.get()
+                        if message.get("index") in sent and "error" not in message:
+                            continue
+                        yield json.dumps(message, ensure_ascii=False) + "\n"
+                        if message["type"] == "done":
+                            return
+                if not job.pending or self.registry is None:
+                    break
+                # worker อื่นกำลังรันงานนี้ ส่งผลจากไฟล์จนกว่าจะครบ หรือ worker นั้นหยุดไปแล้วจึงรับงานมาทำต่อ
+                async for result in self._follow(job):
+                    if result["index"] not in sent:
+                        sent.add(result["index"])
+                        yield json.dumps(result, ensure_ascii=False) + "\n"
+                if not job.pending:
+                    break
+            yield json.dumps(job.done_message(), ensure_ascii=False) + "\n"
+        finally:
+            job.listeners.remove(queue)
+
+    async def _run(self, job: BatchJob):
+        renewer = asyncio.create_task(self._renew_lease(job)) if self.registry is not None else None
+        pending: asyncio.Queue = asyncio.Queue()
+        for segment in job.pending:
+            pending.put_nowait(segment)
+
+        async def worker():
+            while not pending.empty():
+                segment = pending.get_nowait()
+                message = await self._process_segment(job, segment)
+                if "error" in message:
+                    self.segments_failed += 1
+                else:
+                    self.segments_completed += 1
+                    await asyncio.to_thread(job.append_result, message)
+                job.publish(message)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, pending.qsize()))))
+        except Exception as e:
+            logger.error(f"Error in batch job {job.job_id}: {str(e)}")
+        finally:
+            if renewer is not None:
+                renewer.cancel()
+                await asyncio.gather(renewer, return_exceptions=True)
+                await self._release_lease(job)
+            job.publish(job.done_message())
+            logger.info(f"Batch job {job.job_id} finished: {len(job.results)}/{len(job.segments)} segments")
+
+    async def _process_segment(self, job: BatchJob, segment: BatchSegment) -> dict:
+        offset = segment.start / job.sample_rate
+        message = {
+            "type": "segment",
+            "job_id": job.job_id,
+            "index": segment.index,
+            "start": round(offset, 2),
+            "end": round(segment.end / job.sample_rate, 2),
+        }
+        try:
+            wav_data = encode_wav(np.asarray(job.pcm()[segment.start:segment.end]), job.sample_rate)
+            result = None
+            for attempt in range(self.max_retries + 1):
+                try:
+                    # client_id ต่องาน เพื่อให้ scheduler สลับคิวกับงานอื่นอย่างยุติธรรม
+                    result = await self.transcribe(wav_data, job.source_lang, f"batch:{job.job_id}")
+                    break
+                except SchedulerBusy as e:
+                    if attempt == self.max_retries:
+                        raise
+                    logger.warning(f"Whisper busy for batch job {job.job_id}, retry after {e.retry_after}s")
+                    await asyncio.sleep(e.retry_after)
+            if result is None:
+                return {**message, "error": "ไม่สามารถถอดเสียงช่วงนี้ได้"}
+
+            duration = (segment.end - segment.start) / job.sample_rate
+            text = result.get("text", "").strip()
+            translated_text = text
+            if text and job.source_lang != job.target_lang:
+                translated_text = await self.translate(text, job.source_lang, job.target_lang) or "การแปลล้มเหลว"
+            return {
+                **message,
+                "text": text,
+                "translated_text": translated_text,
+                "segments": [
+                    {"start": round(offset + s.start, 2), "end": round(offset + s.end, 2), "text": s.text}
+                    for s in parse_segments(result, duration)
+                ],
+            }
+        except Exception as e:
+            logger.error(f"Error processing segment {segment.index} of batch job {job.job_id}: {str(e)}")
+            return {**message, "error": f"เกิดข้อผิดพลาด: {str(e)}"}
+
+    async def close(self):
+        """หยุดงานที่กำลังทำ (ผลที่เสร็จแล้วอยู่บนดิสก์ ทำต่อได้เมื่อเริ่มแอปใหม่)"""
+        tasks = [job.task for job in self.jobs.values() if job.running]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def cleanup_expired(self):
+        """ลบงานที่เก่ากว่า job_ttl และไม่ได้ทำงานอยู่ ออกจากดิสก์และหน่วยความจำ"""
+        if not os.path.isdir(self.base_dir):
+            return
+        cutoff = time.time() - self.job_ttl
+        for job_id in os.listdir(self.base_dir):
+            directory = os.path.join(self.base_dir, job_id)
+            job = self.jobs.get(job_id)
+            if job is not None and job.running:
+                continue
+            try:
+                if os.path.getmtime(directory) < cutoff:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    self.jobs.pop(job_id, None)
+            except OSError:
+                continue
+
+    def stats(self) -> dict:
+        return {
+            "jobs_created": self.jobs_created,
+            "jobs_loaded": len(self.jobs),
+            "jobs_running": sum(1 for job in self.jobs.values() if job.running),
+            "segments_completed": self.segments_completed,
+            "segments_failed": self.segments_failed,
+        }
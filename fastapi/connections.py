@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+
+from ws_pipeline import ClientPipeline
+
+logger = logging.getLogger(__name__)
+
+SendFunc = Callable[[dict], Awaitable[None]]
+
+# close code ของ WebSocket
+CLOSE_GOING_AWAY = 1001  # ถูกปิดเพราะ idle/ไม่ตอบ heartbeat หรือ server กำลังปิด
+CLOSE_TRY_AGAIN_LATER = 1013  # จำนวนการเชื่อมต่อเต็ม
+CLOSE_REPLACED = 4000  # client เดียวกันเชื่อมต่อเข้ามาใหม่
+
+
+class ClientConnection:
+    """WebSocket หนึ่งเส้นพร้อมเวลาที่มีกิจกรรมล่าสุดและ heartbeat"""
+
+    def __init__(self, client_id: str, websocket: WebSocket):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.pipeline: Optional[ClientPipeline] = None
+        self.connected_at = time.time()
+        now = time.monotonic()
+        self.last_activity = now
+        self.last_pong: Optional[float] = None
+        self.ping_sent_at: Optional[float] = None
+        self.ping_task: Optional[asyncio.Task] = None
+        self.closing = False
+
+    async def send(self, message: dict, timeout: Optional[float] = None):
+        # ส่งผ่าน pipeline ถ้ามี เพื่อไม่ให้แทรกกลางข้อความที่ pipeline กำลังส่ง
+        # (timeout นับเฉพาะเวลาเขียนลง socket ไม่นับเวลารอคิวส่งของ pipeline)
+        if self.pipeline is not None:
+            await self.pipeline.send_message(message, timeout)
+        elif self.websocket.client_state == WebSocketState.CONNECTED:
+            await asyncio.wait_for(self.websocket.send_json(message), timeout)
+
+    @property
+    def in_flight_bytes(self) -> int:
+        return self.pipeline.in_flight_bytes if self.pipeline is not None else 0
+
+
+class ConnectionManager:
+    """ดูแลวงจรชีวิตของ WebSocket ทุกเส้น: จำกัดจำนวน, heartbeat (ping/pong แบบ JSON),
+    ปิดการเชื่อมต่อที่ idle หรือไม่ตอบ และลบสถานะทุกครั้งที่การเชื่อมต่อจบ"""
+
+    def __init__(
+        self,
+        max_connections: int = 0,
+        idle_timeout: float = 300.0,
+        heartbeat_interval: float = 20.0,
+        heartbeat_timeout: float = 60.0,
+    ):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.connections: Dict[str, ClientConnection] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.rejected = 0
+        self.replaced = 0
+        self.evicted_idle = 0
+        self.evicted_dead = 0
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    async def connect(self, client_id: str, websocket: WebSocket) -> Optional[ClientConnection]:
+        """รับการเชื่อมต่อใหม่ คืน None ถ้าจำนวนการเชื่อมต่อเต็ม (ปิด socket ให้แล้ว)"""
+        await websocket.accept()
+        previous = self.connections.get(client_id)
+        if self.max_connections and previous is None and len(self.connections) >= self.max_connections:
+            self.rejected += 1
+            logger.warning(f"Rejected client {client_id}: {len(self.connections)} connections open")
+            try:
+                await websocket.send_json({"status": "server_full", "error": "Server has too many connections"})
+                await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            except Exception:
+                pass
+            return None
+
+        connection = ClientConnection(client_id, websocket)
+        self.connections[client_id] = connection
+        self.accepted += 1
+        if previous is not None:
+            # reconnect ก่อนที่ server จะรู้ว่าการเชื่อมต่อเดิมหลุด: ปิดเส้นเดิมแทนที่จะมีสองเส้น
+            self.replaced += 1
+            logger.info(f"Client {client_id} reconnected, closing previous connection")
+            await self._close(previous, CLOSE_REPLACED, "Replaced by a new connection")
+        return connection
+
+    def touch(self, connection: ClientConnection):
+        connection.last_activity = time.monotonic()
+
+    def pong(self, connection: ClientConnection):
+        connection.last_pong = time.monotonic()
+        connection.ping_sent_at = None
+
+    def disconnect(self, connection: ClientConnection):
+        """ลบการเชื่อมต่อออก (เฉพาะถ้ายังเป็นเส้นปัจจุบันของ client นั้น) และยกเลิก ping ที่ยังรอส่ง"""
+        if self.connections.get(connection.client_id) is connection:
+            del self.connections[connection.client_id]
+        if connection.ping_task is not None and connection.ping_task is not asyncio.current_task():
+            connection.ping_task.cancel()
+
+    async def broadcast(self, message: dict):
+        for connection in list(self.connections.values()):
+            try:
+                await connection.send(message)
+            except Exception as e:
+                logger.error(f"Error sending to {connection.client_id}: {str(e)}")
+
+    def start(self):
+        if self._task is None and self.heartbeat_interval > 0:
+            self._task = asyncio.create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            for connection in list(self.connections.values()):
+                try:
+                    await self._check(connection)
+                except Exception as e:
+                    logger.error(f"Heartbeat check failed for {connection.client_id}: {str(e)}")
+
+    async def _check(self, connection: ClientConnection):
+        now = time.monotonic()
+        if self.idle_timeout and now - connection.last_activity > self.idle_timeout:
+            self.evicted_idle += 1
+            logger.info(f"Closing idle connection {connection.client_id}")
+            await self._close(connection, CLOSE_GOING_AWAY, "Idle timeout")
+            return
+        # ตัดสินว่าไม่ตอบเฉพาะ client ที่เคยตอบ pong แล้ว (client รุ่นเก่าที่ไม่รู้จัก ping ดูจาก idle แทน)
+        # นับจากเวลาที่ ping ถูกเขียนลง socket จริง ไม่ใช่เวลาที่เข้าคิวส่ง
+        if (connection.last_pong is not None and connection.ping_sent_at is not None
+                and now - connection.ping_sent_at > self.heartbeat_timeout):
+            self.evicted_dead += 1
+            logger.info(f"Closing unresponsive connection {connection.client_id}")
+            await self._close(connection, CLOSE_GOING_AWAY, "Heartbeat timeout")
+            return
+        if connection.ping_task is not None and not connection.ping_task.done():
+            # ping รอบก่อนยังรอ pipeline ส่งผลลัพธ์ก่อนหน้าอยู่ (client ช้าแต่ยังรับข้อมูล) ไม่ต้องส่งซ้ำ
+            return
+        # ส่งแยกเป็น task: client ที่คิวส่งยาวไม่ถ่วง heartbeat ของ client อื่น
+        connection.ping_task = asyncio.create_task(self._ping(connection))
+
+    async def _ping(self, connection: ClientConnection):
+        try:
+            await connection.send({"type": "ping", "ts": time.time()}, self.heartbeat_interval)
+        except Exception:
+            # เขียนลง socket ไม่ได้หรือไม่เสร็จภายในเวลา = socket ตายแล้ว
+            if connection.closing:
+                return
+            self.evicted_dead += 1
+            logger.info(f"Closing dead connection {connection.client_id}")
+            await self._close(connection, CLOSE_GOING_AWAY, "Heartbeat failed")
+            return
+        if connection.ping_sent_at is None:
+            connection.ping_sent_at = time.monotonic()
+
+    async def _close(self, connection: ClientConnection, code: int, reason: str):
+        """ปิด socket (endpoint จะได้รับ disconnect แล้วล้างสถานะของตัวเองใน finally)"""
+        connection.closing = True
+        self.disconnect(connection)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code, reason=reason), 5)
+        except Exception:
+            pass
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for connection in list(self.connections.values()):
+            await self._close(connection, CLOSE_GOING_AWAY, "Server shutting down")
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "max_connections": self.max_connections,
+            "in_flight_bytes": sum(connection.in_flight_bytes for connection in self.connections.values()),
+            "queued_chunks": sum(
+                connection.pipeline.queue_depth for connection in self.connections.values() if connection.pipeline
+            ),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "replaced": self.replaced,
+            "evicted_idle": self.evicted_idle,
+            "evicted_dead": self.evicted_dead,
+        }
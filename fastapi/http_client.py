@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class BackendResponse:
+    """ผลลัพธ์จาก backend ที่อ่าน body มาแล้ว (ใช้แทน requests.Response)"""
+
+    def __init__(self, status_code: int, text: str, elapsed: float, url: str = "",
+                 timings: Optional[Dict[str, float]] = None):
+        self.status_code = status_code
+        self.text = text
+        self.elapsed = elapsed
+        self.url = url
+        # เวลาแยกช่วง: upload (ส่ง body), wait (รอ backend ประมวลผล), download (อ่าน body)
+        self.timings = timings or {}
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+def _create_trace_config() -> aiohttp.TraceConfig:
+    """บันทึกเวลาที่ส่ง body เสร็จและเวลาที่ได้ header ตอบกลับ ลงใน trace_request_ctx ของแต่ละ request"""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx["start"] = time.perf_counter()
+
+    async def on_request_chunk_sent(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx["sent"] = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx["headers"] = time.perf_counter()
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+class HttpClientManager:
+    """จัดการ aiohttp.ClientSession แยกตาม backend เพื่อใช้ connection pool แบบ keep-alive ร่วมกัน"""
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        keepalive_timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        default_timeout: float = 30.0,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.default_timeout = default_timeout
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._lock = asyncio.Lock()
+
+    async def get_session(self, backend: str) -> aiohttp.ClientSession:
+        """คืน session ของ backend ที่ระบุ (สร้างใหม่ถ้ายังไม่มีหรือถูกปิดไปแล้ว)"""
+        session = self._sessions.get(backend)
+        if session is not None and not session.closed:
+            return session
+
+        async with self._lock:
+            session = self._sessions.get(backend)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                )
+                timeout = aiohttp.ClientTimeout(
+                    total=self.default_timeout,
+                    sock_connect=self.connect_timeout,
+                )
+                session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=timeout,
+                    trace_configs=[_create_trace_config()],
+                )
+                self._sessions[backend] = session
+                logger.info(f"Created HTTP connection pool for backend: {backend}")
+            return session
+
+    async def request(
+        self,
+        backend: str,
+        method: str,
+        url: str,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> BackendResponse:
+        """ส่ง request ผ่าน pool ของ backend และอ่าน body ให้เสร็จก่อนคืน connection กลับ pool"""
+        session = await self.get_session(backend)
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout, sock_connect=self.connect_timeout)
+
+        trace: Dict[str, float] = {}
+        started = time.perf_counter()
+        async with session.request(method, url, trace_request_ctx=trace, **kwargs) as response:
+            text = await response.text()
+            finished = time.perf_counter()
+
+        timings = {}
+        if "headers" in trace:
+            sent = trace.get("sent", trace.get("start", started))
+            timings = {
+                "upload": sent - trace.get("start", started),
+                "wait": trace["headers"] - sent,
+                "download": finished - trace["headers"],
+            }
+        return BackendResponse(response.status, text, finished - started, str(response.url), timings)
+
+    async def get(self, backend: str, url: str, **kwargs) -> BackendResponse:
+        return await self.request(backend, "GET", url, **kwargs)
+
+    async def post(self, backend: str, url: str, **kwargs) -> BackendResponse:
+        return await self.request(backend, "POST", url, **kwargs)
+
+    async def close(self):
+        """ปิดทุก session ตอน shutdown"""
+        for backend, session in list(self._sessions.items()):
+            if not session.closed:
+                await session.close()
+                logger.info(f"Closed HTTP connection pool for backend: {backend}")
+        self._sessions.clear()
+
+
+def build_audio_form(
+    audio_data,
+    field_name: str = "audio_file",
+    filename: str = "audio.webm",
+    content_type: str = "audio/webm",
+) -> aiohttp.FormData:
+    """สร้าง multipart body สำหรับไฟล์เสียง (ถ้าเป็น file object aiohttp จะ stream เป็นช่วงๆ โดยไม่โหลดทั้งไฟล์)"""
+    form = aiohttp.FormData()
+    form.add_field(field_name, audio_data, filename=filename, content_type=content_type)
+    return form
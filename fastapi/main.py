@@ -1,20 +1,406 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, status, UploadFile
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, status, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import aiohttp
 import logging
 import os
 import asyncio
+from contextlib import asynccontextmanager
 from urllib.parse import urljoin
-from typing import Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
+from starlette.formparsers import MultiPartParser
 from starlette.websockets import WebSocketState
 import json
-import html
+import shutil
+import socket
+import tempfile
+import time
 
-# ตั้งค่า logging
-logging.basicConfig(level=logging.DEBUG)
+from backend_health import BackendMonitor, BackendStatus
+from batch_jobs import BatchJobManager
+from connections import ConnectionManager
+from http_client import BackendResponse, HttpClientManager, build_audio_form
+from metrics import (
+    ACTIVE_WEBSOCKETS,
+    BACKEND_REQUESTS,
+    MULTIPROCESS,
+    PREPROCESS_BYTES,
+    QUEUE_DEPTH,
+    REJECTED_UPLOADS,
+    REQUEST_AUDIO_BUFFER_BYTES,
+    REQUEST_PEAK_RSS_GROWTH,
+    STAGE_PAYLOAD_BYTES,
+    TRANSLATIONS,
+    account_buffer,
+    format_server_timing,
+    gauge_function,
+    mark_process_dead,
+    observe_stage,
+    process_peak_rss,
+    refresh_gauges_forever,
+    render_metrics,
+    stage_timer,
+    start_buffer_accounting,
+    start_request_timing,
+    status_label,
+)
+from preprocess import SAMPLE_RATE, AudioPreprocessor
+from registry import SessionRegistry, create_registry
+from rooms import ROLE_LISTENER, Room, RoomManager
+from streaming import StreamingTranscriber
+from transcription_cache import TranscriptionCache
+from translation_batcher import TranslationBatcher
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory, parse_records
+from translation_providers import PROVIDER_TYPES, TranslationProvider, TranslationRouter
+from vad import VoiceActivityDetector, measure_duration
+from whisper_pool import WhisperPool, WhisperReplica
+from whisper_scheduler import PRIORITY_BATCH, PRIORITY_LIVE, SchedulerBusy, WhisperScheduler
+from ws_pipeline import ClientPipeline, TranscriptFunc
+
+# ตั้งค่า logging (DEBUG จะ log เนื้อหา response ของ Whisper บางส่วนด้วย)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO))
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# ตั้งค่า Whisper และ Translation
+WHISPER_URL = os.getenv("WHISPER_SERVICE_URL", "http://localhost:9000")  # หลาย replica คั่นด้วย ,
+WHISPER_URLS = [url.strip() for url in WHISPER_URL.split(",") if url.strip()]
+WHISPER_ASR_ENDPOINT = os.getenv("WHISPER_ASR_ENDPOINT", "/asr")
+
+# ตั้งค่า Translation Service
+# ใช้ LibreTranslate ซึ่งเป็น open-source และฟรี หรือสามารถเลือก Google Translate, DeepL ได้
+TRANSLATION_SERVICE = os.getenv("TRANSLATION_SERVICE", "libre")  # libre, google, deepl
+LIBRETRANSLATE_URL = os.getenv("LIBRETRANSLATE_URL", "https://libretranslate.com/translate")
+LIBRETRANSLATE_API_KEY = os.getenv("LIBRETRANSLATE_API_KEY", "")  # ถ้าต้องการใช้ LibreTranslate API
+
+GOOGLE_TRANSLATE_API_KEY = os.getenv("GOOGLE_TRANSLATE_API_KEY", "")  # สำหรับ Google Translate
+DEEPL_API_KEY = os.getenv("DEEPL_API_KEY", "")  # สำหรับ DeepL
+DEEPL_API_URL = os.getenv("DEEPL_API_URL", "https://api-free.deepl.com/v2/translate")  # บัญชีเสียเงินใช้ api.deepl.com
+
+# ลำดับ provider ที่ใช้แปล (ตัวแรกเป็นหลัก ที่เหลือใช้เมื่อตัวก่อนหน้าล้มเหลวหรือช้าเกิน) เช่น "libre,google"
+TRANSLATION_PROVIDERS = [
+    name.strip() for name in os.getenv("TRANSLATION_PROVIDERS", TRANSLATION_SERVICE).split(",") if name.strip()
+]
+TRANSLATION_LATENCY_BUDGET = float(os.getenv("TRANSLATION_LATENCY_BUDGET", "10"))  # วินาทีก่อนย้ายไป provider ถัดไป
+# ตั้งค่าเฉพาะ provider ได้ด้วย TRANSLATION_<NAME>_RATE_LIMIT (ครั้ง/วินาที, 0 = ไม่จำกัด), _BURST,
+# _LATENCY_BUDGET, _MAX_BATCH_SIZE, _MAX_CHARS และ _LANGUAGES (คั่นด้วย ,) เช่น TRANSLATION_GOOGLE_RATE_LIMIT=5
+TRANSLATION_PROVIDER_CREDENTIALS = {
+    "libre": {"url": LIBRETRANSLATE_URL, "api_key": LIBRETRANSLATE_API_KEY},
+    "google": {"api_key": GOOGLE_TRANSLATE_API_KEY},
+    "deepl": {"url": DEEPL_API_URL, "api_key": DEEPL_API_KEY},
+}
+
+# ตั้งค่า HTTP connection pool สำหรับเรียก backend
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))  # จำนวน connection สูงสุดต่อ backend
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+WHISPER_TIMEOUT = float(os.getenv("WHISPER_TIMEOUT", "30"))
+TRANSLATION_TIMEOUT = float(os.getenv("TRANSLATION_TIMEOUT", "30"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "5"))
+
+# ตั้งค่าการตรวจสอบสุขภาพ backend แบบ background และ circuit breaker
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "10"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))  # ล้มเหลวติดกันกี่ครั้งจึงตัดวงจร
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))  # วินาทีก่อนลองใหม่ (half-open)
+
+# ตั้งค่า cache ผลการแปล
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "10000"))  # 0 = ปิด cache
+TRANSLATION_CACHE_TTL = float(os.getenv("TRANSLATION_CACHE_TTL", "86400"))  # วินาที
+TRANSLATION_CACHE_DB = os.getenv("TRANSLATION_CACHE_DB", "")  # path ไฟล์ SQLite ถ้าต้องการเก็บถาวร
+TRANSLATION_CACHE_DB_MAX_ROWS = int(os.getenv("TRANSLATION_CACHE_DB_MAX_ROWS", "100000"))
+
+# ตั้งค่า translation memory (ใช้คำแปลของประโยคที่คล้ายกันซ้ำ และ glossary ที่ import เข้ามา)
+TRANSLATION_MEMORY_SIZE = int(os.getenv("TRANSLATION_MEMORY_SIZE", "50000"))  # 0 = ปิด
+TRANSLATION_MEMORY_THRESHOLD = float(os.getenv("TRANSLATION_MEMORY_THRESHOLD", "0.9"))  # ความคล้ายขั้นต่ำ (0-1]
+TRANSLATION_MEMORY_SUBSTITUTE_NUMBERS = os.getenv("TRANSLATION_MEMORY_SUBSTITUTE_NUMBERS", "true").lower() == "true"
+TRANSLATION_MEMORY_FUZZY = os.getenv("TRANSLATION_MEMORY_FUZZY", "false").lower() == "true"  # ใช้คำแปลของประโยคที่คล้ายกัน (ไม่ใช่แค่ตรงกัน)
+# ไฟล์ NDJSON ที่โหลดตอนเริ่มและบันทึกตอนปิด (หลาย worker: glossary ที่ import ถูกส่งให้ทุก worker ผ่าน registry
+# แต่คำแปลที่เรียนรู้เองต่างกันในแต่ละ worker และไฟล์จะเป็นของ worker ที่ปิดทีหลังสุด)
+TRANSLATION_MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH", "")
+
+# ตั้งค่า cache ผลถอดเสียงตาม hash ของข้อมูลเสียง
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv("TRANSCRIPTION_CACHE_SIZE", "1000"))  # 0 = ปิด cache
+TRANSCRIPTION_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPTION_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# ตั้งค่าการรวมคำขอแปลหลายรายการเป็น request เดียว
+TRANSLATION_BATCH_WINDOW_MS = float(os.getenv("TRANSLATION_BATCH_WINDOW_MS", "20"))  # เวลารอรวมคำขอ
+TRANSLATION_BATCH_MAX_SIZE = int(os.getenv("TRANSLATION_BATCH_MAX_SIZE", "16"))  # จำนวนข้อความสูงสุดต่อ request
+
+# ตั้งค่าการตรวจจับเสียงพูด (VAD) เพื่อข้าม chunk ที่เงียบก่อนส่งไป Whisper
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() == "true"
+VAD_ENERGY_THRESHOLD_DB = float(os.getenv("VAD_ENERGY_THRESHOLD_DB", "-45"))  # ระดับพลังงานขั้นต่ำ (dBFS)
+VAD_NOISE_MARGIN_DB = float(os.getenv("VAD_NOISE_MARGIN_DB", "10"))  # ต้องดังกว่า noise floor อย่างน้อยเท่านี้
+VAD_ZCR_MAX = float(os.getenv("VAD_ZCR_MAX", "0.25"))  # zero-crossing rate สูงสุดของเฟรมเสียงพูด
+VAD_MIN_SPEECH_MS = float(os.getenv("VAD_MIN_SPEECH_MS", "250"))  # ความยาวเสียงพูดขั้นต่ำต่อ chunk
+VAD_TRIM = os.getenv("VAD_TRIM", "false").lower() == "true"  # ตัดช่วงเงียบหัวท้ายแล้วส่งเป็น WAV
+VAD_TRIM_PADDING_MS = float(os.getenv("VAD_TRIM_PADDING_MS", "200"))
+
+# ตั้งค่าการเตรียมเสียงก่อนส่งไป Whisper (16 kHz mono, ปรับความดัง, ตัดช่วงเงียบ)
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "false").lower() == "true"
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "opus")  # opus (เล็กสุด), flac, wav (Whisper ถอดรหัสเร็วสุด)
+PREPROCESS_BITRATE = os.getenv("PREPROCESS_BITRATE", "24k")  # bitrate ของ opus
+PREPROCESS_TARGET_DBFS = float(os.getenv("PREPROCESS_TARGET_DBFS", "-20"))  # ความดังเป้าหมายของช่วงที่มีเสียงพูด
+PREPROCESS_MAX_GAIN_DB = float(os.getenv("PREPROCESS_MAX_GAIN_DB", "20"))  # ขยาย/ลดเสียงได้ไม่เกินเท่านี้
+PREPROCESS_TRIM = os.getenv("PREPROCESS_TRIM", "true").lower() == "true"  # ตัดช่วงเงียบหัวท้าย (ใช้เกณฑ์และ padding เดียวกับ VAD)
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2"))  # จำนวน process ที่ใช้ normalize
+
+# ตั้งค่าโหมด streaming (ถอดเสียงต่อเนื่องจาก buffer และส่งผล partial/final)
+STREAMING_STABLE_MARGIN = float(os.getenv("STREAMING_STABLE_MARGIN", "1.0"))  # วินาทีท้าย buffer ที่ยังไม่ยืนยัน
+STREAMING_MAX_BUFFER_SECONDS = float(os.getenv("STREAMING_MAX_BUFFER_SECONDS", "20"))  # บังคับยืนยันเมื่อ buffer ยาวเกิน
+
+# ตั้งค่าขีดจำกัดไฟล์อัปโหลด (0 = ไม่จำกัด)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))  # ขนาดไฟล์สูงสุดของ /transcribe
+MAX_UPLOAD_DURATION = float(os.getenv("MAX_UPLOAD_DURATION", "600"))  # ความยาวเสียงสูงสุด (วินาที) ของ /transcribe
+BATCH_MAX_UPLOAD_BYTES = int(os.getenv("BATCH_MAX_UPLOAD_BYTES", str(1024 * 1024 * 1024)))  # ขนาดไฟล์สูงสุดของ /batch-transcribe
+UPLOAD_CHUNK_SIZE = 64 * 1024  # ขนาดช่วงที่อ่านจากไฟล์ตอน stream (aiohttp ใช้ขนาดเดียวกัน)
+
+# ตั้งค่างานถอดเสียงไฟล์ยาว (แบ่งช่วงที่จุดเงียบแล้วประมวลผลพร้อมกัน)
+BATCH_JOB_DIR = os.getenv("BATCH_JOB_DIR", os.path.join(tempfile.gettempdir(), "stt_batch_jobs"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "2"))  # ช่วงที่ประมวลผลพร้อมกันต่องาน
+BATCH_MIN_SEGMENT_SECONDS = float(os.getenv("BATCH_MIN_SEGMENT_SECONDS", "10"))
+BATCH_MAX_SEGMENT_SECONDS = float(os.getenv("BATCH_MAX_SEGMENT_SECONDS", "30"))  # Whisper ทำงานเป็นหน้าต่าง 30 วินาที
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "3"))  # ลองใหม่เมื่อคิว Whisper เต็ม
+BATCH_JOB_TTL = float(os.getenv("BATCH_JOB_TTL", "86400"))  # วินาทีที่เก็บงานไว้ให้ทำต่อได้
+# งานหนึ่งรันได้ทีละ worker (lease ใน registry) ถ้า worker นั้นหยุดไป worker อื่นทำต่อได้หลังจาก lease หมดอายุ
+# worker ที่ไม่ได้ถือ lease ส่งผลจากไฟล์ใน BATCH_JOB_DIR จึงต้องใช้โฟลเดอร์เดียวกันทุก worker
+BATCH_JOB_LEASE_TTL = float(os.getenv("BATCH_JOB_LEASE_TTL", "30"))
+
+# ตั้งค่าการส่งซ้ำ (hedging) ไปยัง Whisper replica อื่นเมื่อ replica แรกตอบช้า
+WHISPER_HEDGE = os.getenv("WHISPER_HEDGE", "false").lower() == "true"
+WHISPER_HEDGE_PERCENTILE = float(os.getenv("WHISPER_HEDGE_PERCENTILE", "95"))  # ส่งซ้ำเมื่อช้ากว่า percentile นี้
+WHISPER_HEDGE_MIN_DELAY = float(os.getenv("WHISPER_HEDGE_MIN_DELAY", "0.5"))  # วินาทีขั้นต่ำก่อนส่งซ้ำ
+
+# ตั้งค่าการจัดคิวงานไปยัง Whisper ทั้งระบบ
+WHISPER_MAX_CONCURRENCY = int(os.getenv("WHISPER_MAX_CONCURRENCY", "2"))  # งานที่ส่งไป Whisper พร้อมกันได้ (ทุก replica รวมกัน)
+WHISPER_MAX_QUEUE = int(os.getenv("WHISPER_MAX_QUEUE", "100"))  # งานที่รอคิวได้สูงสุด
+WHISPER_LIVE_DEADLINE = float(os.getenv("WHISPER_LIVE_DEADLINE", "10"))  # วินาทีที่เสียงสดรอคิวได้ก่อนถูกทิ้ง
+WHISPER_BATCH_DEADLINE = float(os.getenv("WHISPER_BATCH_DEADLINE", "120"))  # วินาทีที่ไฟล์อัปโหลดรอคิวได้
+
+# ตั้งค่าการประมวลผลเสียงต่อ WebSocket client
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "4"))  # จำนวน chunk ที่รอในคิวได้สูงสุด
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "2"))  # จำนวน chunk ที่ประมวลผลพร้อมกันได้
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")  # drop_oldest, reject
+WS_TWO_PHASE = os.getenv("WS_TWO_PHASE", "false").lower() == "true"  # ค่าเริ่มต้นของการส่งข้อความต้นฉบับก่อนคำแปล (client เปิด/ปิดเองได้)
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "1000"))  # จำนวน WebSocket สูงสุดต่อ worker (0 = ไม่จำกัด)
+WS_MAX_IN_FLIGHT_BYTES = int(os.getenv("WS_MAX_IN_FLIGHT_BYTES", str(8 * 1024 * 1024)))  # เสียงที่รอประมวลผลได้ต่อ client (0 = ไม่จำกัด)
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))  # ปิดการเชื่อมต่อที่ไม่มีข้อมูลรับ/ส่งนานเกินนี้ (0 = ไม่ปิด)
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))  # ส่ง {"type": "ping"} ทุกกี่วินาที (0 = ปิด heartbeat)
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "60"))  # ปิดการเชื่อมต่อที่ไม่ตอบ pong ภายในเวลานี้
+
+# ตั้งค่าห้อง (ผู้พูดหนึ่งคน ผู้ฟังหลายคนหลายภาษา)
+ROOM_LISTENER_QUEUE = int(os.getenv("ROOM_LISTENER_QUEUE", "32"))  # ข้อความที่ค้างส่งได้ต่อผู้ฟัง (เกินแล้วทิ้งเก่าสุด)
+ROOM_MAX_LISTENERS = int(os.getenv("ROOM_MAX_LISTENERS", "0"))  # 0 = ไม่จำกัด
+
+# ตั้งค่า registry ที่ใช้ร่วมกันระหว่าง worker/เครื่อง (session, การตั้งค่า, ห้อง, cache)
+REGISTRY_URL = os.getenv("REGISTRY_URL", "memory://")  # memory:// (worker เดียว) หรือ redis://[:password@]host:6379/0
+REGISTRY_PREFIX = os.getenv("REGISTRY_PREFIX", "stt:")  # prefix ของ key ใน Redis (ใช้ Redis ร่วมกับระบบอื่นได้)
+SESSION_SETTINGS_TTL = float(os.getenv("SESSION_SETTINGS_TTL", "86400"))  # เก็บการตั้งค่าของ client ไว้หลังหลุด (วินาที)
+SHARED_CACHE_TTL = float(os.getenv("SHARED_CACHE_TTL", "3600"))  # อายุของผลถอดเสียงใน cache ร่วม (วินาที)
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+
+# HTTP client ที่ใช้ร่วมกันทั้งแอป (แยก pool ตาม backend)
+http_clients = HttpClientManager(
+    limit=HTTP_POOL_LIMIT,
+    limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+    keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    default_timeout=WHISPER_TIMEOUT,
+)
+
+# ตรวจสอบสุขภาพ Whisper และ Translation service เป็นระยะ
+backend_monitor = BackendMonitor(
+    http_clients,
+    interval=HEALTH_CHECK_INTERVAL,
+    probe_timeout=HEALTH_CHECK_TIMEOUT,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_RESET_TIMEOUT,
+)
+# Whisper แต่ละ replica ถูกลงทะเบียนกับ monitor แยกกัน
+whisper_pool = WhisperPool(
+    backend_monitor,
+    WHISPER_URLS,
+    hedge=WHISPER_HEDGE,
+    hedge_percentile=WHISPER_HEDGE_PERCENTILE,
+    hedge_min_delay=WHISPER_HEDGE_MIN_DELAY,
+)
+
+def create_translation_provider(name: str, backend: str) -> Optional[TranslationProvider]:
+    """สร้าง provider จากชื่อและค่าตั้งค่า TRANSLATION_<NAME>_*"""
+    provider_type = PROVIDER_TYPES.get(name)
+    if provider_type is None:
+        logger.error(f"Unsupported translation service: {name}")
+        return None
+
+    def option(key: str, default: str) -> str:
+        return os.getenv(f"TRANSLATION_{name.upper()}_{key}", default)
+
+    provider = provider_type(
+        http_clients,
+        backend,
+        **TRANSLATION_PROVIDER_CREDENTIALS.get(name, {}),
+        languages=[code.strip() for code in option("LANGUAGES", "").split(",") if code.strip()],
+        max_batch_size=int(option("MAX_BATCH_SIZE", "0")),
+        max_chars=int(option("MAX_CHARS", "0")),
+        rate_limit=float(option("RATE_LIMIT", "0")),
+        burst=float(option("BURST", "0")),
+        latency_budget=float(option("LATENCY_BUDGET", str(TRANSLATION_LATENCY_BUDGET))),
+        timeout=TRANSLATION_TIMEOUT,
+    )
+    if not provider.is_configured():
+        logger.error(f"Translation provider {name} is not configured (missing API key)")
+        return None
+    return provider
+
+# provider เดียวใช้ชื่อ backend "translation" ตามเดิม เพื่อไม่ให้ชื่อใน health/metrics เปลี่ยน
+translation_router = TranslationRouter(backend_monitor, [
+    provider for provider in (
+        create_translation_provider(
+            name, "translation" if len(TRANSLATION_PROVIDERS) == 1 else f"translation-{name}"
+        )
+        for name in TRANSLATION_PROVIDERS
+    ) if provider is not None
+])
+
+# สถานะที่ใช้ร่วมกันระหว่าง worker (cache ร่วมใช้เฉพาะ registry ภายนอก ในหน่วยความจำจะซ้ำกับ cache ของ worker)
+registry = create_registry(REGISTRY_URL, REGISTRY_PREFIX)
+shared_registry = registry if registry.backend != "memory" else None
+sessions = SessionRegistry(registry, WORKER_ID, settings_ttl=SESSION_SETTINGS_TTL)
+
+# cache ผลการแปลที่ใช้ร่วมกันทุก endpoint
+translation_cache = TranslationCache(
+    max_entries=TRANSLATION_CACHE_SIZE,
+    ttl=TRANSLATION_CACHE_TTL,
+    db_path=TRANSLATION_CACHE_DB,
+    db_max_rows=TRANSLATION_CACHE_DB_MAX_ROWS,
+    shared=shared_registry,
+) if TRANSLATION_CACHE_SIZE > 0 else None
+
+# คำแปลของประโยคที่เคยแปลแล้ว ค้นแบบคล้ายกัน (ต่างแค่ตัวเลข/วรรคตอน/สะกดเล็กน้อย)
+translation_memory = TranslationMemory(
+    max_entries=TRANSLATION_MEMORY_SIZE,
+    threshold=TRANSLATION_MEMORY_THRESHOLD,
+    substitute_numbers=TRANSLATION_MEMORY_SUBSTITUTE_NUMBERS,
+    fuzzy=TRANSLATION_MEMORY_FUZZY,
+    path=TRANSLATION_MEMORY_PATH,
+) if TRANSLATION_MEMORY_SIZE > 0 else None
+
+# channel ที่ใช้ส่งรายการที่ import ผ่าน /translation-memory/import ให้ worker อื่น
+TRANSLATION_MEMORY_CHANNEL = "translation-memory"
+
+def apply_translation_memory_import(payload: str):
+    """เพิ่มรายการที่ worker อื่น import เข้ามาลง translation memory ของ worker นี้"""
+    message = json.loads(payload)
+    if message["worker"] == WORKER_ID:
+        return
+    imported, skipped = translation_memory.import_entries(
+        message["records"], message["source_lang"], message["target_lang"]
+    )
+    logger.info(f"Imported {imported} translation memory entries from worker {message['worker']} ({skipped} skipped)")
+
+if translation_memory is not None:
+    registry.subscribe(TRANSLATION_MEMORY_CHANNEL, apply_translation_memory_import)
+
+# cache ผลถอดเสียงของเสียงที่ซ้ำกัน (เช่น client ส่งซ้ำหลัง reconnect หรือประกาศที่เล่นซ้ำ)
+transcription_cache = TranscriptionCache(
+    max_entries=TRANSCRIPTION_CACHE_SIZE,
+    max_bytes=TRANSCRIPTION_CACHE_MAX_BYTES,
+    shared=shared_registry,
+    shared_ttl=SHARED_CACHE_TTL,
+) if TRANSCRIPTION_CACHE_SIZE > 0 else None
+
+# รวมคำขอแปลจากหลาย client (ส่งผ่าน send_translation_batch)
+translation_batcher = TranslationBatcher(
+    lambda texts, source_lang, target_lang: send_translation_batch(texts, source_lang, target_lang),
+    window=TRANSLATION_BATCH_WINDOW_MS / 1000,
+    max_batch_size=TRANSLATION_BATCH_MAX_SIZE,
+)
+
+# ตัวตรวจจับเสียงพูด
+voice_detector = VoiceActivityDetector(
+    energy_threshold_db=VAD_ENERGY_THRESHOLD_DB,
+    noise_margin_db=VAD_NOISE_MARGIN_DB,
+    zcr_max=VAD_ZCR_MAX,
+    min_speech_ms=VAD_MIN_SPEECH_MS,
+    trim=VAD_TRIM,
+    trim_padding_ms=VAD_TRIM_PADDING_MS,
+) if VAD_ENABLED else None
+
+# เตรียมเสียงใน process pool ก่อนส่งไป Whisper
+audio_preprocessor = AudioPreprocessor(
+    output_format=PREPROCESS_FORMAT,
+    bitrate=PREPROCESS_BITRATE,
+    target_dbfs=PREPROCESS_TARGET_DBFS,
+    max_gain_db=PREPROCESS_MAX_GAIN_DB,
+    trim=PREPROCESS_TRIM,
+    threshold_db=VAD_ENERGY_THRESHOLD_DB,
+    padding_ms=VAD_TRIM_PADDING_MS,
+    workers=PREPROCESS_WORKERS,
+) if PREPROCESS_ENABLED else None
+
+# คิวกลางสำหรับงานถอดเสียง (เสียงสดได้ก่อนไฟล์อัปโหลด และสลับกันระหว่าง client)
+whisper_scheduler = WhisperScheduler(
+    max_concurrency=WHISPER_MAX_CONCURRENCY,
+    max_queue=WHISPER_MAX_QUEUE,
+    deadlines={PRIORITY_LIVE: WHISPER_LIVE_DEADLINE, PRIORITY_BATCH: WHISPER_BATCH_DEADLINE},
+)
+
+# งานถอดเสียงไฟล์ยาวที่ทำต่อได้ด้วย job_id
+batch_jobs = BatchJobManager(
+    BATCH_JOB_DIR,
+    lambda wav_data, source_lang, client_id: transcribe_batch_segment(wav_data, source_lang, client_id),
+    lambda text, source_lang, target_lang: translate_text(text, source_lang, target_lang),
+    detector=voice_detector,
+    max_concurrency=BATCH_MAX_CONCURRENCY,
+    min_segment_seconds=BATCH_MIN_SEGMENT_SECONDS,
+    max_segment_seconds=BATCH_MAX_SEGMENT_SECONDS,
+    max_retries=BATCH_MAX_RETRIES,
+    job_ttl=BATCH_JOB_TTL,
+    registry=registry,
+    worker_id=WORKER_ID,
+    lease_ttl=BATCH_JOB_LEASE_TTL,
+)
+
+# ห้องถ่ายทอดคำแปลจากผู้พูดไปยังผู้ฟัง
+room_manager = RoomManager(
+    lambda text, source_lang, target_lang: translate_text(text, source_lang, target_lang),
+    sessions,
+    max_listener_queue=ROOM_LISTENER_QUEUE,
+    max_listeners=ROOM_MAX_LISTENERS,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """จัดการทรัพยากรตลอดอายุของแอป"""
+    backend_monitor.add_listener(broadcast_whisper_status)
+    backend_monitor.start()
+    await registry.start()
+    sessions.start()
+    connection_manager.start()
+    # โหมด multiprocess: เขียนค่า gauge ของ worker นี้ลงไฟล์เป็นระยะ
+    gauge_refresher = asyncio.create_task(refresh_gauges_forever()) if MULTIPROCESS else None
+    yield
+    if gauge_refresher is not None:
+        gauge_refresher.cancel()
+        await asyncio.gather(gauge_refresher, return_exceptions=True)
+    mark_process_dead()
+    await connection_manager.close()
+    await batch_jobs.close()
+    await room_manager.close()
+    await translation_batcher.close()
+    await sessions.stop()
+    await registry.close()
+    if audio_preprocessor is not None:
+        audio_preprocessor.close()
+    await backend_monitor.stop()
+    await http_clients.close()
+    if translation_cache is not None:
+        translation_cache.close()
+    if translation_memory is not None:
+        await asyncio.to_thread(translation_memory.close)
+
+app = FastAPI(lifespan=lifespan)
 
 # ตั้งค่า CORS (เพิ่มเพื่อให้ frontend เข้าถึงได้)
 app.add_middleware(
@@ -25,73 +411,186 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ตั้งค่า Whisper และ Translation
-WHISPER_URL = os.getenv("WHISPER_SERVICE_URL", "http://localhost:9000")
-WHISPER_ASR_ENDPOINT = os.getenv("WHISPER_ASR_ENDPOINT", "/asr")
+# เก็บ active connections (จำกัดจำนวน, heartbeat และปิดการเชื่อมต่อที่ idle)
+connection_manager = ConnectionManager(
+    max_connections=WS_MAX_CONNECTIONS,
+    idle_timeout=WS_IDLE_TIMEOUT,
+    heartbeat_interval=WS_HEARTBEAT_INTERVAL,
+    heartbeat_timeout=WS_HEARTBEAT_TIMEOUT,
+)
+active_pipelines: Dict[str, ClientPipeline] = {}
 
-# ตั้งค่า Translation Service
-# ใช้ LibreTranslate ซึ่งเป็น open-source และฟรี หรือสามารถเลือก Google Translate, DeepL ได้
-TRANSLATION_SERVICE = os.getenv("TRANSLATION_SERVICE", "libre")  # libre, google, deepl
-LIBRETRANSLATE_URL = os.getenv("LIBRETRANSLATE_URL", "https://libretranslate.com/translate")
-LIBRETRANSLATE_API_KEY = os.getenv("LIBRETRANSLATE_API_KEY", "")  # ถ้าต้องการใช้ LibreTranslate API
+gauge_function(ACTIVE_WEBSOCKETS, lambda: len(connection_manager))
 
-GOOGLE_TRANSLATE_API_KEY = os.getenv("GOOGLE_TRANSLATE_API_KEY", "")  # สำหรับ Google Translate
-DEEPL_API_KEY = os.getenv("DEEPL_API_KEY", "")  # สำหรับ DeepL
+gauge_function(QUEUE_DEPTH.labels("whisper_scheduler"), lambda: whisper_scheduler.waiting)
+gauge_function(QUEUE_DEPTH.labels("websocket"), lambda: sum(p.queue_depth for p in active_pipelines.values()))
+gauge_function(QUEUE_DEPTH.labels("room_listeners"), lambda: room_manager.queue_depth)
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    """เพิ่ม header Server-Timing ที่บอกเวลาของแต่ละ stage ใน request นี้"""
+    timings = start_request_timing()
+    started = time.perf_counter()
+    response = await call_next(request)
+    response.headers["Server-Timing"] = format_server_timing(timings, time.perf_counter() - started)
+    return response
+
+# ขีดจำกัดขนาดของแต่ละ endpoint ที่รับไฟล์
+UPLOAD_LIMITS = {"/transcribe": MAX_UPLOAD_BYTES, "/batch-transcribe": BATCH_MAX_UPLOAD_BYTES}
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """ปฏิเสธไฟล์ที่ใหญ่เกินจาก Content-Length ก่อนเริ่มอ่าน body"""
+    limit = UPLOAD_LIMITS.get(request.url.path)
+    content_length = request.headers.get("content-length", "")
+    if limit and content_length.isdigit() and int(content_length) > limit:
+        REJECTED_UPLOADS.labels("size").inc()
+        return upload_too_large(limit)
+    return await call_next(request)
+
+def upload_too_large(limit: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+        content={"error": f"ไฟล์มีขนาดใหญ่เกินกำหนด (สูงสุด {limit / (1024 * 1024):.0f} MB)"}
+    )
 
-# เก็บ active connections
-active_connections: Dict[str, WebSocket] = {}
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
 
-async def process_audio(audio_data, source_lang="th") -> Optional[requests.Response]:
+def audio_file_info(audio_data) -> dict:
+    """ชื่อไฟล์และ content type ของข้อมูลเสียง (WAV/Ogg/FLAC จาก VAD หรือการเตรียมเสียง, webm จาก browser)"""
+    if isinstance(audio_data, bytes):
+        header = audio_data[:4]
+    else:
+        header = audio_data.read(4)
+        audio_data.seek(0)
+    if header == b"RIFF":
+        return {"filename": "audio.wav", "content_type": "audio/wav"}
+    if header == b"OggS":
+        return {"filename": "audio.ogg", "content_type": "audio/ogg"}
+    if header == b"fLaC":
+        return {"filename": "audio.flac", "content_type": "audio/flac"}
+    return {"filename": "audio.webm", "content_type": "audio/webm"}
+
+def audio_data_size(audio_data) -> int:
+    """ขนาดของข้อมูลเสียง ทั้งแบบ bytes และ file object (ไม่อ่านเนื้อไฟล์)"""
+    if isinstance(audio_data, bytes):
+        return len(audio_data)
+    position = audio_data.tell()
+    size = audio_data.seek(0, os.SEEK_END)
+    audio_data.seek(position)
+    return size
+
+async def process_audio(
+    audio_data,
+    source_lang="th",
+    client_id: str = "anonymous",
+    priority: int = PRIORITY_LIVE,
+    use_cache: bool = True
+) -> Optional[BackendResponse]:
     """ฟังก์ชันสำหรับส่งข้อมูลเสียงไปยัง Whisper API (เฉพาะถอดเสียง)"""
+    if use_cache and transcription_cache is not None and isinstance(audio_data, bytes):
+        return await transcription_cache.get_or_fetch(
+            audio_data,
+            source_lang,
+            lambda: request_transcription(audio_data, source_lang, client_id, priority)
+        )
+    return await request_transcription(audio_data, source_lang, client_id, priority)
+
+async def request_transcription(
+    audio_data,
+    source_lang: str,
+    client_id: str,
+    priority: int
+) -> Optional[BackendResponse]:
+    """ส่งข้อมูลเสียงไปยัง Whisper replica ที่เลือกผ่านคิวกลาง"""
     try:
-        files = {
-            'audio_file': ('audio.webm', audio_data, 'audio/webm')
-        }
-        url = urljoin(WHISPER_URL, WHISPER_ASR_ENDPOINT)
-        
-        # ตรวจสอบการเชื่อมต่อกับ Whisper
-        try:
-            health_url = urljoin(WHISPER_URL, "/openapi.json")
-            health_response = await asyncio.to_thread(
-                requests.get,
-                health_url,
-                timeout=5
-            )
-            logger.info(f"Whisper health check status: {health_response.status_code}")
-            if health_response.status_code != 200:
-                logger.error("Whisper service is not healthy")
-                return None
-        except Exception as e:
-            logger.error(f"Cannot connect to Whisper service: {str(e)}")
+        # อ่านสถานะจาก circuit breaker แทนการ probe ทุก request
+        with stage_timer("health_check"):
+            whisper_allowed = whisper_pool.accepting()
+        if not whisper_allowed:
+            logger.error("Whisper service is not healthy (circuit open)")
+            BACKEND_REQUESTS.labels("whisper", "circuit_open").inc()
             return None
 
-        logger.info(f"Sending request to Whisper ASR: {url} with language: {source_lang}")
-        logger.info(f"Audio data size: {len(audio_data)} bytes")
-        
-        # ใช้ asyncio.to_thread เพื่อไม่ให้ block event loop
-        response = await asyncio.to_thread(
-            requests.post,
-            url,
-            files=files,
-            params={
-                "task": "transcribe",
-                "language": source_lang,
-                "output": "json"
-            },
-            timeout=30
-        )
+        logger.info(f"Sending request to Whisper ASR with language: {source_lang}")
+        audio_size = audio_data_size(audio_data)
+        logger.info(f"Audio data size: {audio_size} bytes")
+
+        async def send_to_replica(replica: WhisperReplica) -> BackendResponse:
+            if not isinstance(audio_data, bytes):
+                audio_data.seek(0)
+            try:
+                response = await http_clients.post(
+                    replica.name,
+                    urljoin(replica.url, WHISPER_ASR_ENDPOINT),
+                    data=build_audio_form(audio_data, **audio_file_info(audio_data)),
+                    params={
+                        "task": "transcribe",
+                        "language": source_lang,
+                        "output": "json"
+                    },
+                    timeout=WHISPER_TIMEOUT
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                BACKEND_REQUESTS.labels(replica.name, "error").inc()
+                raise
+            BACKEND_REQUESTS.labels(replica.name, status_label(response.status_code)).inc()
+            return response
+
+        # รอคิวกลางก่อน แล้วส่งผ่าน connection pool แบบ async (multipart ถูก stream ออกไปโดย aiohttp)
+        # file object จะถูกอ่านทีละช่วง จึงถือหน่วยความจำเพียงขนาดของช่วงเดียว
+        in_memory = audio_size if isinstance(audio_data, bytes) else UPLOAD_CHUNK_SIZE
+        queued_at = time.perf_counter()
+        async with whisper_scheduler.slot(client_id, priority):
+            observe_stage("whisper_queue", time.perf_counter() - queued_at)
+            with account_buffer(in_memory):
+                # file object อ่านพร้อมกันสองทางไม่ได้ จึงส่งซ้ำได้เฉพาะข้อมูลที่เป็น bytes
+                # request ที่ส่งซ้ำใช้ slot ของตัวเอง (ส่งซ้ำเฉพาะเมื่อ scheduler ว่างและไม่มีงานรอคิว)
+                response = await whisper_pool.request(
+                    send_to_replica,
+                    allow_hedge=isinstance(audio_data, bytes),
+                    scheduler=whisper_scheduler
+                )
+        if response is None:
+            logger.error("No Whisper replica is accepting requests (circuit open)")
+            BACKEND_REQUESTS.labels("whisper", "circuit_open").inc()
+            return None
+        observe_stage("whisper_upload", response.timings.get("upload", 0.0), audio_size)
+        observe_stage("whisper_inference", response.timings.get("wait", response.elapsed), len(response.text))
         
         logger.debug(f"Whisper response status: {response.status_code}")
-        logger.debug(f"Whisper response content: {response.text}")
+        logger.debug(f"Whisper response content: {response.text[:200]}")
         return response
         
-    except requests.exceptions.RequestException as e:
+    except SchedulerBusy:
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Request error: {str(e)}")
         return None
     except Exception as e:
-        logger.error(f"Unexpected error in process_audio: {str(e)}")
+        logger.error(f"Unexpected error in request_transcription: {str(e)}")
+        return None
+
+async def send_translation_batch(texts: List[str], source_lang: str, target_lang: str) -> Optional[List[Tuple[str, str]]]:
+    """ส่ง batch คำขอแปลหนึ่งรอบผ่าน provider ตามลำดับ fallback คืน (คำแปล, provider ที่แปล) ของแต่ละข้อความ"""
+    # fail fast ถ้า circuit ของทุก provider เปิดอยู่
+    if not translation_router.accepting():
+        logger.error("Translation service is not healthy (circuit open)")
         return None
 
+    with stage_timer("translation_request", sum(len(t.encode()) for t in texts)):
+        served = await translation_router.translate(texts, source_lang, target_lang)
+    if served is None:
+        return None
+    results, provider_name = served
+    return [(result, provider_name) for result in results]
+
 async def translate_text(text: str, source_lang: str, target_lang: str) -> Optional[str]:
     """ฟังก์ชันสำหรับแปลข้อความโดยใช้บริการแปลภาษาต่างๆ"""
     try:
@@ -106,114 +605,128 @@ async def translate_text(text: str, source_lang: str, target_lang: str) -> Optio
         if source_lang == target_lang:
             return text
             
-        # LibreTranslate (Free and Open Source)
-        if TRANSLATION_SERVICE == "libre":
-            payload = {
-                "q": text,
-                "source": source_lang,
-                "target": target_lang,
-                "format": "text"
-            }
-            
-            if LIBRETRANSLATE_API_KEY:
-                payload["api_key"] = LIBRETRANSLATE_API_KEY
-                
-            response = await asyncio.to_thread(
-                requests.post,
-                LIBRETRANSLATE_URL,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get("translatedText", "")
-            else:
-                logger.error(f"LibreTranslate API error: {response.status_code}, {response.text}")
-                return None
-        
-        # Google Translate
-        elif TRANSLATION_SERVICE == "google":
-            if not GOOGLE_TRANSLATE_API_KEY:
-                logger.error("Google Translate API key is not set")
-                return None
-                
-            url = f"https://translation.googleapis.com/language/translate/v2?key={GOOGLE_TRANSLATE_API_KEY}"
-            payload = {
-                "q": text,
-                "source": source_lang,
-                "target": target_lang,
-                "format": "text"
-            }
-            
-            response = await asyncio.to_thread(
-                requests.post,
-                url,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                translations = result.get("data", {}).get("translations", [])
-                if translations:
-                    return html.unescape(translations[0].get("translatedText", ""))
-                else:
-                    return None
-            else:
-                logger.error(f"Google Translate API error: {response.status_code}, {response.text}")
-                return None
-        
-        # DeepL
-        elif TRANSLATION_SERVICE == "deepl":
-            if not DEEPL_API_KEY:
-                logger.error("DeepL API key is not set")
-                return None
-                
-            url = "https://api-free.deepl.com/v2/translate"  # ใช้ API ฟรีของ DeepL
-            headers = {
-                "Authorization": f"DeepL-Auth-Key {DEEPL_API_KEY}"
-            }
-            payload = {
-                "text": [text],
-                "source_lang": source_lang.upper(),
-                "target_lang": target_lang.upper()
-            }
-            
-            response = await asyncio.to_thread(
-                requests.post,
-                url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                translations = result.get("translations", [])
-                if translations:
-                    return translations[0].get("text", "")
-                else:
-                    return None
-            else:
-                logger.error(f"DeepL API error: {response.status_code}, {response.text}")
-                return None
-                
-        # ใช้บริการแปลภาษาอื่นๆ เพิ่มเติมได้
-        else:
-            logger.error(f"Unsupported translation service: {TRANSLATION_SERVICE}")
-            return None
+        # glossary มาก่อน cache: คำแปลที่ import เข้ามาใหม่ใช้ได้ทันทีแทนผลเดิมของ provider ที่อยู่ใน cache
+        if translation_memory is not None:
+            match = await asyncio.to_thread(translation_memory.lookup, text, source_lang, target_lang, True)
+            if match is not None:
+                logger.info(f"Glossary {match.kind} match")
+                TRANSLATIONS.labels(source_lang, target_lang, "memory_hit").inc()
+                return match.target
+
+        # ใช้ผลการแปลจาก cache ถ้ามี (key ตาม provider ที่จะได้รับงานตอนนี้ ผลของ provider สำรอง
+        # จึงไม่ถูกใช้ต่อหลัง provider หลักกลับมา)
+        if translation_cache is not None:
+            provider_name = translation_router.preferred_provider(source_lang, target_lang) or TRANSLATION_SERVICE
+            cached = await translation_cache.get(text, source_lang, target_lang, provider_name)
+            if cached is not None:
+                logger.info("Translation cache hit")
+                TRANSLATIONS.labels(source_lang, target_lang, "cache_hit").inc()
+                return cached
+
+        # ใช้คำแปลของประโยคเดียวกัน (ตัวเลขต่างกันได้) หรือที่คล้ายกันที่เคยแปลไว้
+        if translation_memory is not None:
+            match = await asyncio.to_thread(translation_memory.lookup, text, source_lang, target_lang, False)
+            if match is not None:
+                logger.info(f"Translation memory {match.kind} match ({match.score:.2f})")
+                TRANSLATIONS.labels(source_lang, target_lang, "memory_hit").inc()
+                return match.target
+
+        # รวมกับคำขอแปลอื่นที่มีคู่ภาษาเดียวกันแล้วส่งเป็น request เดียว
+        with stage_timer("translation", len(text.encode())):
+            served = await translation_batcher.translate(text, source_lang, target_lang)
+        translated_text, provider_name = served if served is not None else (None, None)
+        TRANSLATIONS.labels(source_lang, target_lang, "ok" if translated_text else "failed").inc()
+        if translated_text and translation_cache is not None:
+            await translation_cache.set(text, source_lang, target_lang, provider_name, translated_text)
+        if translated_text and translation_memory is not None:
+            await asyncio.to_thread(translation_memory.add, text, translated_text, source_lang, target_lang)
+        return translated_text
             
     except Exception as e:
         logger.error(f"Error in translate_text: {str(e)}")
         return None
 
-async def process_audio_and_translate(audio_data, source_lang="th", target_lang="en") -> Optional[dict]:
-    """ฟังก์ชันรวมสำหรับถอดเสียงและแปลภาษา"""
+class SilentAudio:
+    """ผลของเสียงที่ VAD ไม่พบเสียงพูด (ไม่ได้ส่งไป Whisper)"""
+
+    def __init__(self, duration: float):
+        self.duration = duration
+
+async def prepare_audio(audio_data, client_id: str) -> Tuple[Any, Optional[float]]:
+    """กรองด้วย VAD แล้วเตรียมเสียง (16 kHz mono ปรับความดัง ตัดช่วงเงียบ) ก่อนส่งไป Whisper
+    คืน (เสียงที่จะส่ง, ความยาวของเสียงถ้าไม่มีเสียงพูดเลย)"""
+    original_audio = audio_data
+    pcm = None
+    # ข้าม chunk ที่ไม่มีเสียงพูดโดยไม่ต้องส่งไป Whisper
+    # (ไฟล์อัปโหลดที่เป็น file object ไม่ผ่าน VAD เพื่อไม่ต้องโหลดทั้งไฟล์เข้าหน่วยความจำ)
+    if voice_detector is not None and isinstance(audio_data, bytes):
+        with stage_timer("vad", len(audio_data)):
+            vad_result = await voice_detector.filter(audio_data)
+        if vad_result.skip:
+            return audio_data, vad_result.duration
+        audio_data = vad_result.audio_data
+        if voice_detector.sample_rate == SAMPLE_RATE:
+            pcm = vad_result.pcm
+
+    # แปลงเป็น 16 kHz mono ปรับความดังและตัดช่วงเงียบ (ใช้ PCM จาก VAD ถ้ามี,
+    # ไฟล์อัปโหลดถูก stream เข้า ffmpeg จึงถือเพียง PCM 16 kHz ไม่ใช่ทั้งไฟล์)
+    if audio_preprocessor is not None:
+        with stage_timer("preprocess", audio_data_size(original_audio)):
+            prepared = await audio_preprocessor.process(original_audio, pcm)
+        if prepared is not None:
+            audio_data = prepared.audio_data
+            PREPROCESS_BYTES.labels("in").inc(prepared.bytes_in)
+            PREPROCESS_BYTES.labels("out").inc(prepared.bytes_out)
+            logger.info(
+                f"Preprocessed audio for {client_id}: {prepared.bytes_in} -> {prepared.bytes_out} bytes "
+                f"(saved {prepared.bytes_saved}), {prepared.duration:.2f}s -> {prepared.output_duration:.2f}s "
+                f"in {prepared.seconds * 1000:.1f} ms"
+            )
+    return audio_data, None
+
+async def process_audio_and_translate(
+    audio_data,
+    source_lang="th",
+    target_lang="en",
+    client_id: str = "anonymous",
+    priority: int = PRIORITY_LIVE,
+    on_transcript: Optional[TranscriptFunc] = None
+) -> Optional[dict]:
+    """ฟังก์ชันรวมสำหรับถอดเสียงและแปลภาษา (on_transcript ถูกเรียกทันทีที่ได้ข้อความต้นฉบับ ก่อนเริ่มแปล)"""
     try:
+        async def transcribe() -> Union[BackendResponse, SilentAudio, None]:
+            prepared_audio, silence = await prepare_audio(audio_data, client_id)
+            if silence is not None:
+                return SilentAudio(silence)
+            return await request_transcription(prepared_audio, source_lang, client_id, priority)
+
         # ถอดเสียงเป็นข้อความในภาษาต้นทาง
         logger.info(f"Transcribing audio in source language: {source_lang}")
-        transcription_response = await process_audio(audio_data, source_lang)
+        try:
+            if transcription_cache is not None and isinstance(audio_data, bytes):
+                # ค้น cache ด้วยเสียงดิบก่อน VAD และ preprocess เสียงที่ซ้ำจึงไม่ต้องถอดรหัสและ normalize ใหม่
+                # (ผู้ที่รอเสียงเดียวกันพร้อมกันได้ผลเดียวกัน รวมถึงผลว่าไม่มีเสียงพูด)
+                transcription_response = await transcription_cache.get_or_fetch(audio_data, source_lang, transcribe)
+            else:
+                transcription_response = await transcribe()
+        except SchedulerBusy as e:
+            logger.warning(f"Whisper busy for {client_id} ({e.reason}), retry after {e.retry_after}s")
+            return {
+                "error": f"ระบบถอดเสียงมีงานค้างมาก กรุณาลองใหม่ในอีก {e.retry_after} วินาที",
+                "busy": True,
+                "retry_after": e.retry_after,
+                "source_lang": source_lang,
+                "target_lang": target_lang
+            }
+
+        if isinstance(transcription_response, SilentAudio):
+            return {
+                "error": "ไม่พบข้อความในเสียง",
+                "silence": True,
+                "duration": round(transcription_response.duration, 2),
+                "source_lang": source_lang,
+                "target_lang": target_lang
+            }
         
         original_text = ""
         if transcription_response and transcription_response.status_code == 200:
@@ -245,7 +758,10 @@ async def process_audio_and_translate(audio_data, source_lang="th", target_lang=
                 "source_lang": source_lang,
                 "target_lang": target_lang
             }
-            
+
+        if on_transcript is not None:
+            await on_transcript(original_text)
+
         # แปลข้อความโดยใช้ Translation Service
         translated_text = await translate_text(original_text, source_lang, target_lang)
         
@@ -275,6 +791,92 @@ async def process_audio_and_translate(audio_data, source_lang="th", target_lang=
             "target_lang": target_lang
         }
 
+def whisper_capabilities(whisper_available: bool) -> dict:
+    """สร้างข้อมูลความสามารถของ Whisper ตามสถานะที่ระบุ"""
+    return {
+        "use_whisper_translation": True,
+        "supports_translation": True,
+        "can_transcribe": whisper_available,
+        "can_translate": whisper_available,
+        "whisper_status": "ready" if whisper_available else "unavailable",
+        "error": None if whisper_available else "Cannot connect to Whisper service"
+    }
+
+async def broadcast_whisper_status(backend: BackendStatus):
+    """แจ้งสถานะ Whisper ที่เปลี่ยนไปให้ทุก client ทาง WebSocket (แทนการให้ browser poll)"""
+    # แจ้งเมื่อสถานะรวมของทุก replica เปลี่ยน (replica หนึ่งล่มแต่ยังมีตัวอื่นอยู่ ไม่ต้องแจ้ง)
+    if backend.name not in whisper_pool.replicas or not whisper_pool.availability_changed():
+        return
+    whisper_available = whisper_pool.is_available
+    message = {
+        "status": "whisper_status",
+        "is_ready": whisper_available,
+        "can_transcribe": whisper_available,
+        "can_translate": whisper_available
+    }
+    await connection_manager.broadcast(message)
+
+def create_streaming_session(client_id: str) -> StreamingTranscriber:
+    """สร้าง session ถอดเสียงแบบต่อเนื่องของ client"""
+    async def transcribe_window(wav_data: bytes, source_lang: str) -> Optional[dict]:
+        try:
+            # buffer ของแต่ละรอบไม่ซ้ำกัน จึงไม่ต้องเก็บลง cache
+            response = await process_audio(wav_data, source_lang, client_id, PRIORITY_LIVE, use_cache=False)
+        except SchedulerBusy as e:
+            # เสียงยังอยู่ใน buffer จะถูกถอดเสียงพร้อม chunk ถัดไป
+            logger.warning(f"Whisper busy for streaming client {client_id}, retry after {e.retry_after}s")
+            return None
+        if response and response.status_code == 200:
+            return response.json()
+        return None
+
+    async def translate_final(text: str, source_lang: str, target_lang: str) -> Optional[str]:
+        # ผู้พูดในห้อง: ข้อความที่ยืนยันแล้วถูกแปลและกระจายให้ผู้ฟังทุกภาษา (partial ไม่ถูกกระจาย)
+        room = room_manager.speaker_room(client_id)
+        if room is None:
+            return await translate_text(text, source_lang, target_lang)
+        translations = await room_manager.broadcast(room, text, source_lang, [target_lang])
+        return translations.get(target_lang)
+
+    return StreamingTranscriber(
+        transcribe_window,
+        translate_final,
+        detector=voice_detector,
+        stable_margin=STREAMING_STABLE_MARGIN,
+        max_buffer_seconds=STREAMING_MAX_BUFFER_SECONDS,
+    )
+
+async def transcribe_batch_segment(wav_data: bytes, source_lang: str, client_id: str) -> Optional[dict]:
+    """ถอดเสียงหนึ่งช่วงของงานไฟล์ยาว (SchedulerBusy ส่งต่อให้ BatchJobManager รอแล้วลองใหม่)"""
+    response = await process_audio(wav_data, source_lang, client_id, PRIORITY_BATCH)
+    if response and response.status_code == 200:
+        return response.json()
+    return None
+
+async def process_room_chunk(
+    room: Room,
+    audio_data: bytes,
+    source_lang: str,
+    target_lang: str,
+    client_id: str,
+    on_transcript: Optional[TranscriptFunc] = None
+) -> Optional[dict]:
+    """ถอดเสียงของผู้พูดครั้งเดียว แล้วแปลและกระจายให้ผู้ฟังในห้องทุกภาษาพร้อมกัน"""
+    # ภาษาปลายทางเท่ากับต้นทาง = ถอดเสียงอย่างเดียว การแปลทำใน broadcast ครั้งเดียวต่อภาษา
+    result = await process_audio_and_translate(audio_data, source_lang, source_lang, client_id, PRIORITY_LIVE)
+    if not result or "error" in result:
+        return {**result, "target_lang": target_lang} if result else result
+    if on_transcript is not None:
+        await on_transcript(result["original_text"])
+
+    translations = await room_manager.broadcast(room, result["original_text"], source_lang, [target_lang])
+    return {
+        "original_text": result["original_text"],
+        "translated_text": translations.get(target_lang) or "การแปลล้มเหลว",
+        "source_lang": source_lang,
+        "target_lang": target_lang
+    }
+
 async def send_error_message(websocket: WebSocket, message: str, details: str = None):
     """ฟังก์ชันสำหรับส่งข้อความ error"""
     try:
@@ -289,21 +891,85 @@ async def send_error_message(websocket: WebSocket, message: str, details: str =
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     """WebSocket endpoint หลัก"""
+    pipeline = None
+    # รับ connection ใหม่ (ถูกปฏิเสธถ้าจำนวนการเชื่อมต่อเต็ม)
+    connection = await connection_manager.connect(client_id, websocket)
+    if connection is None:
+        return
     try:
-        # รับ connection ใหม่
-        await websocket.accept()
-        active_connections[client_id] = websocket
+        await sessions.register(client_id)
         logger.info(f"New client connected: {client_id}")
 
-        # ตั้งค่าเริ่มต้นสำหรับภาษา
-        source_lang = "th"
-        target_lang = "en"
+        # ตั้งค่าภาษา (ใช้ค่าที่ client ตั้งไว้ก่อนหลุด ถึงจะ reconnect มาที่ worker อื่น)
+        settings = await sessions.load_settings(client_id)
+        source_lang = settings.get("source_lang", "th")
+        target_lang = settings.get("target_lang", "en")
+
+        # โหมด streaming (เปิดได้ด้วยข้อความ {"streaming": true})
+        stream_session: Optional[StreamingTranscriber] = None
+
+        # ส่งข้อความต้นฉบับ (type "transcript") ทันทีที่ถอดเสียงเสร็จ แล้วตามด้วยคำแปล (type "translation")
+        # ด้วย segment_id เดียวกัน เปิด/ปิดได้ด้วยข้อความ {"two_phase": true}
+        two_phase = settings.get("two_phase", WS_TWO_PHASE)
+
+        async def process_chunk(audio_data, chunk_source_lang, chunk_target_lang, on_transcript):
+            if not two_phase:
+                on_transcript = None
+            if stream_session is not None:
+                # ถ้าเป็นผู้พูดในห้อง ข้อความที่ยืนยันแล้วจะถูกกระจายให้ผู้ฟังใน translate_final
+                return await stream_session.process(audio_data, chunk_source_lang, chunk_target_lang)
+            room = room_manager.speaker_room(client_id)
+            if room is not None:
+                return await process_room_chunk(
+                    room, audio_data, chunk_source_lang, chunk_target_lang, client_id, on_transcript
+                )
+            return await process_audio_and_translate(
+                audio_data,
+                chunk_source_lang,
+                chunk_target_lang,
+                client_id=client_id,
+                priority=PRIORITY_LIVE,
+                on_transcript=on_transcript
+            )
+
+        async def send_result(message: dict):
+            with stage_timer("send"):
+                await websocket.send_json(message)
+            if message.get("type") != "ping":
+                connection_manager.touch(connection)
+
+        # คิวประมวลผลของ client นี้
+        pipeline = ClientPipeline(
+            client_id,
+            process_chunk,
+            send_result,
+            max_queue=WS_MAX_QUEUE,
+            max_in_flight=WS_MAX_IN_FLIGHT,
+            overflow_policy=WS_OVERFLOW_POLICY,
+            max_in_flight_bytes=WS_MAX_IN_FLIGHT_BYTES,
+        )
+        pipeline.start()
+        active_pipelines[client_id] = pipeline
+        connection.pipeline = pipeline
+
+        # กลับเข้าห้องเดิมหลัง reconnect (ออกจากห้องที่ผูกกับการเชื่อมต่อเส้นเดิมก่อน ถ้ามี)
+        await room_manager.leave(client_id)
+        if settings.get("room"):
+            try:
+                await room_manager.join(
+                    settings["room"], client_id, settings.get("role", ROLE_LISTENER), target_lang, pipeline.send_message
+                )
+            except ValueError as e:
+                await pipeline.send_message({"error": str(e)})
 
         while True:
             try:
                 # รับข้อมูลจาก client
                 data = await websocket.receive()
-                
+                if data["type"] == "websocket.disconnect":
+                    logger.info(f"Client disconnected normally: {client_id}")
+                    break
+
                 # ตรวจสอบว่าเป็นข้อความหรือข้อมูล binary
                 if data["type"] == "websocket.receive":
                     if "bytes" in data:
@@ -314,61 +980,94 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                             logger.warning("Received empty audio data")
                             continue
 
+                        connection_manager.touch(connection)
                         logger.info(f"Received audio data: {len(audio_data)} bytes")
+                        STAGE_PAYLOAD_BYTES.labels("receive").observe(len(audio_data))
                         
-                        # ใช้ฟังก์ชันรวมสำหรับถอดเสียงและแปลภาษา
-                        result = await process_audio_and_translate(audio_data, source_lang, target_lang)
-                        
-                        if result:
-                            if "error" in result:
-                                # ส่งข้อความแจ้งข้อผิดพลาด
-                                await websocket.send_json({
-                                    "error": result["error"],
-                                    "source_lang": result["source_lang"],
-                                    "target_lang": result["target_lang"]
-                                })
-                            else:
-                                # ส่งข้อความต้นฉบับและข้อความที่แปลแล้ว
-                                await websocket.send_json({
-                                    "text": result["original_text"],
-                                    "translated_text": result["translated_text"],
-                                    "source_lang": result["source_lang"],
-                                    "target_lang": result["target_lang"]
-                                })
-                        else:
-                            # กรณีไม่มีผลลัพธ์
-                            await websocket.send_json({
-                                "error": "ไม่สามารถประมวลผลเสียงได้",
-                                "source_lang": source_lang,
-                                "target_lang": target_lang
-                            })
+                        # ส่งเข้าคิวแล้วกลับไปรับข้อมูลต่อทันที ผลลัพธ์จะถูกส่งกลับตามลำดับ seq
+                        await pipeline.submit(audio_data, source_lang, target_lang)
                     
                     elif "text" in data:
                         # เป็นข้อความ JSON - ตรวจสอบว่าเป็นการตั้งค่าภาษาหรือไม่
                         try:
                             message = json.loads(data["text"])
+                            if message.get("type") == "pong":
+                                # ตอบ heartbeat ไม่นับเป็นกิจกรรม (client ที่เปิดค้างไว้เฉยๆ ยังถูกปิดเมื่อ idle)
+                                connection_manager.pong(connection)
+                                continue
+                            connection_manager.touch(connection)
                             if "source_lang" in message:
                                 source_lang = message["source_lang"]
                                 logger.info(f"Client {client_id} set source language to: {source_lang}")
                             if "target_lang" in message:
                                 target_lang = message["target_lang"]
+                                await room_manager.set_target_lang(client_id, target_lang)
                                 logger.info(f"Client {client_id} set target language to: {target_lang}")
+                            if "two_phase" in message:
+                                two_phase = bool(message["two_phase"])
+                            if "room" in message:
+                                # เข้าห้อง {"room": "id", "role": "speaker" | "listener"} หรือออกด้วย {"room": null}
+                                if message["room"]:
+                                    try:
+                                        await room_manager.join(
+                                            str(message["room"]),
+                                            client_id,
+                                            message.get("role", ROLE_LISTENER),
+                                            target_lang,
+                                            pipeline.send_message
+                                        )
+                                    except ValueError as e:
+                                        await pipeline.send_message({"error": str(e)})
+                                else:
+                                    await room_manager.leave(client_id)
+                            if "streaming" in message:
+                                if message["streaming"] and stream_session is None:
+                                    if shutil.which("ffmpeg") is None:
+                                        await pipeline.send_message({"error": "Streaming mode requires ffmpeg on the server"})
+                                    else:
+                                        stream_session = create_streaming_session(client_id)
+                                        logger.info(f"Client {client_id} enabled streaming mode")
+                                elif not message["streaming"] and stream_session is not None:
+                                    # ยืนยันข้อความที่ค้างอยู่ก่อนกลับไปโหมดปกติ
+                                    final = await stream_session.flush(target_lang)
+                                    stream_session = None
+                                    logger.info(f"Client {client_id} disabled streaming mode")
+                                    if final:
+                                        await pipeline.send_message({
+                                            "type": "final",
+                                            **final,
+                                            "source_lang": source_lang,
+                                            "target_lang": target_lang
+                                        })
                                 
-                            # ส่งการยืนยันกลับไป
-                            await websocket.send_json({
+                            # บันทึกการตั้งค่าให้ทุก worker เห็น แล้วส่งการยืนยันกลับไป
+                            room = room_manager.room_of(client_id)
+                            settings = {
+                                "source_lang": source_lang,
+                                "target_lang": target_lang,
+                                "two_phase": two_phase,
+                                "room": room.room_id if room is not None else None,
+                                "role": None if room is None else (
+                                    "speaker" if room.speaker_id == client_id else "listener"
+                                )
+                            }
+                            await sessions.save_settings(client_id, settings)
+                            await pipeline.send_message({
                                 "status": "ok",
                                 "message": "Language settings updated",
-                                "source_lang": source_lang,
-                                "target_lang": target_lang
+                                "streaming": stream_session is not None,
+                                **settings
                             })
                         except json.JSONDecodeError:
                             logger.error("Received invalid JSON message")
-                            await websocket.send_json({"error": "Invalid JSON message"})
+                            await pipeline.send_message({"error": "Invalid JSON message"})
 
             except WebSocketDisconnect:
                 logger.info(f"Client disconnected normally: {client_id}")
                 break
             except Exception as e:
+                if connection.closing or websocket.client_state != WebSocketState.CONNECTED:
+                    break
                 logger.error(f"Error processing message: {str(e)}")
                 try:
                     await websocket.send_json({"error": f"เกิดข้อผิดพลาด: {str(e)}"})
@@ -377,34 +1076,33 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
 
     except Exception as e:
         logger.error(f"WebSocket connection error: {str(e)}")
-        if client_id in active_connections:
-            del active_connections[client_id]
+    finally:
+        # ล้างสถานะของการเชื่อมต่อนี้ทุกกรณี (หลุดปกติ, error, ถูกปิดเพราะ idle/heartbeat)
+        connection_manager.disconnect(connection)
+        # ถ้า client เชื่อมต่อเส้นใหม่แล้ว สถานะที่ผูกกับ client_id (ห้อง, session) เป็นของเส้นใหม่
+        if client_id not in connection_manager.connections:
+            await room_manager.leave(client_id)
+            await sessions.unregister(client_id)
+        if pipeline is not None:
+            if active_pipelines.get(client_id) is pipeline:
+                del active_pipelines[client_id]
+            await pipeline.close()
         
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    try:
-        # ทดสอบการเชื่อมต่อกับ Whisper service
-        url = urljoin(WHISPER_URL, "/health")
-        response = requests.get(url, timeout=5)
-        whisper_status = "up" if response.status_code == 200 else "down"
-    except:
-        whisper_status = "down"
-
-    # ทดสอบการเชื่อมต่อกับ Translation service
-    translation_status = "up"
-    try:
-        if TRANSLATION_SERVICE == "libre":
-            test_response = requests.get(LIBRETRANSLATE_URL.replace("/translate", "/languages"), timeout=5)
-            translation_status = "up" if test_response.status_code == 200 else "down"
-    except:
-        translation_status = "down"
-
+    """Health check endpoint (อ่านสถานะที่ background monitor เก็บไว้ ไม่มี network I/O)"""
     return {
         "status": "healthy",
-        "whisper_service": whisper_status,
+        "whisper_service": "up" if whisper_pool.is_available else "down",
         "translation_service": TRANSLATION_SERVICE,
-        "translation_status": translation_status
+        "translation_status": "up" if translation_router.is_available else "down",
+        "backends": backend_monitor.snapshot(),
+        "whisper_pool": whisper_pool.stats(),
+        "whisper_scheduler": whisper_scheduler.stats(),
+        "vad": voice_detector.stats() if voice_detector is not None else {"enabled": False},
+        "preprocess": audio_preprocessor.stats() if audio_preprocessor is not None else {"enabled": False},
+        "batch_jobs": batch_jobs.stats(),
+        "connections": connection_manager.stats()
     }
 
 @app.get("/")
@@ -450,18 +1148,40 @@ def get_supported_languages():
 
 @app.post("/transcribe")
 async def transcribe_audio(
+    request: Request,
     audio_file: UploadFile,
     source_lang: str = "th",
     target_lang: str = "en"
 ):
+    usage = start_buffer_accounting()
+    rss_before = process_peak_rss()
     try:
-        # อ่านข้อมูลจากไฟล์
-        audio_data = await audio_file.read()
-        
-        # ใช้ฟังก์ชันรวมสำหรับถอดเสียงและแปลภาษา
-        result = await process_audio_and_translate(audio_data, source_lang, target_lang)
+        # ไม่อ่านไฟล์เข้า bytes: ส่ง temp file ที่ spool ไว้แล้ว (ไฟล์ใหญ่อยู่บนดิสก์) ต่อไปเป็น file object
+        audio_size = audio_data_size(audio_file.file)
+        if MAX_UPLOAD_BYTES and audio_size > MAX_UPLOAD_BYTES:
+            # request แบบ chunked ไม่มี Content-Length จึงตรวจซ้ำหลังรับไฟล์
+            REJECTED_UPLOADS.labels("size").inc()
+            return upload_too_large(MAX_UPLOAD_BYTES)
+
+        with account_buffer(min(audio_size, MultiPartParser.spool_max_size)):
+            if MAX_UPLOAD_DURATION:
+                rejection = await check_upload_duration(audio_file.file)
+                if rejection is not None:
+                    return rejection
+
+            # ใช้ฟังก์ชันรวมสำหรับถอดเสียงและแปลภาษา (ไฟล์อัปโหลดมีลำดับความสำคัญรองจากเสียงสด)
+            client_id = f"upload:{request.client.host if request.client else 'unknown'}"
+            result = await process_audio_and_translate(
+                audio_file.file, source_lang, target_lang, client_id=client_id, priority=PRIORITY_BATCH
+            )
         
         if result:
+            if result.get("busy"):
+                return JSONResponse(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    content={"error": result["error"], "retry_after": result["retry_after"]},
+                    headers={"Retry-After": str(result["retry_after"])}
+                )
             if "error" in result:
                 return {"error": result["error"]}
             else:
@@ -477,20 +1197,158 @@ async def transcribe_audio(
     except Exception as e:
         logger.error(f"Error in transcribe_audio: {str(e)}")
         return {"error": f"เกิดข้อผิดพลาด: {str(e)}"}
+    finally:
+        REQUEST_AUDIO_BUFFER_BYTES.labels("transcribe").observe(usage[1])
+        REQUEST_PEAK_RSS_GROWTH.labels("transcribe").observe(process_peak_rss() - rss_before)
+
+async def check_upload_duration(audio_file) -> Optional[JSONResponse]:
+    """ตรวจความยาวเสียงของไฟล์อัปโหลด คืน response ปฏิเสธถ้ายาวเกินกำหนดหรือถอดรหัสไม่ได้"""
+    try:
+        with stage_timer("duration_check"), account_buffer(2 * UPLOAD_CHUNK_SIZE):
+            duration = await measure_duration(audio_file, MAX_UPLOAD_DURATION, chunk_size=UPLOAD_CHUNK_SIZE)
+    except FileNotFoundError:
+        logger.warning("ffmpeg not found, skipping upload duration check")
+        return None
+
+    if duration is None:
+        REJECTED_UPLOADS.labels("decode").inc()
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"error": "ไม่สามารถอ่านไฟล์เสียงได้"}
+        )
+    if duration > MAX_UPLOAD_DURATION:
+        REJECTED_UPLOADS.labels("duration").inc()
+        logger.warning(f"Rejected upload longer than {MAX_UPLOAD_DURATION:.0f}s")
+        return JSONResponse(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            content={"error": f"เสียงยาวเกินกำหนด (สูงสุด {MAX_UPLOAD_DURATION:.0f} วินาที)"}
+        )
+    return None
+
+@app.post("/batch-transcribe")
+async def batch_transcribe(
+    audio_file: UploadFile,
+    source_lang: str = "th",
+    target_lang: str = "en"
+):
+    """ถอดเสียงและแปลไฟล์ยาว ส่งผลแต่ละช่วงเป็น NDJSON ทันทีที่เสร็จ (บรรทัดแรกมี job_id สำหรับทำต่อ)"""
+    if BATCH_MAX_UPLOAD_BYTES and audio_data_size(audio_file.file) > BATCH_MAX_UPLOAD_BYTES:
+        REJECTED_UPLOADS.labels("size").inc()
+        return upload_too_large(BATCH_MAX_UPLOAD_BYTES)
+    try:
+        job = await batch_jobs.create_job(audio_file.file, source_lang, target_lang)
+    except FileNotFoundError:
+        logger.error("ffmpeg not found, batch transcription unavailable")
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"error": "ไม่พบ ffmpeg บนเซิร์ฟเวอร์"}
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": str(e)})
+    except Exception as e:
+        logger.error(f"Error in batch_transcribe: {str(e)}")
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={"error": f"เกิดข้อผิดพลาด: {str(e)}"}
+        )
+    return StreamingResponse(batch_jobs.stream(job), media_type="application/x-ndjson")
+
+@app.get("/batch-transcribe/{job_id}")
+async def resume_batch_transcribe(job_id: str):
+    """รับผลของงานเดิมต่อ: ส่งผลที่เสร็จแล้วก่อน แล้วประมวลผลช่วงที่เหลือหรือที่ล้มเหลวต่อ"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"error": "ไม่พบงานนี้"})
+    return StreamingResponse(batch_jobs.stream(job), media_type="application/x-ndjson")
+
+@app.get("/rooms")
+async def get_rooms():
+    """ห้องที่เปิดอยู่ (ทุก worker) ผู้พูด จำนวนผู้ฟังแยกตามภาษา และข้อความที่ค้าง/ถูกทิ้งใน worker นี้"""
+    return await room_manager.stats()
+
+@app.get("/sessions")
+async def get_sessions():
+    """จำนวนการเชื่อมต่อรวมทุก worker และสถานะของ registry"""
+    return await sessions.stats()
 
 @app.get("/translation-services")
 def get_translation_services():
     """ข้อมูลเกี่ยวกับบริการแปลภาษาที่รองรับ"""
     return {
-        "current_service": TRANSLATION_SERVICE,
-        "supported_services": ["libre", "google", "deepl"],
+        "current_service": TRANSLATION_PROVIDERS[0] if TRANSLATION_PROVIDERS else None,
+        "supported_services": sorted(PROVIDER_TYPES),
         "notes": {
             "libre": "บริการแปลภาษาโอเพนซอร์ส ฟรี แต่อาจมีข้อจำกัดในการใช้งาน",
             "google": "Google Translate API ต้องการ API key และมีค่าใช้จ่าย",
             "deepl": "DeepL API มีทั้งแบบฟรีและแบบเสียเงิน ให้ผลลัพธ์ที่แม่นยำสูง"
-        }
+        },
+        **translation_router.stats()
     }
 
+@app.get("/translation-cache")
+def get_translation_cache_stats():
+    """สถิติของ cache ผลการแปล"""
+    if translation_cache is None:
+        return {"enabled": False, "batching": translation_batcher.stats()}
+    return {"enabled": True, **translation_cache.stats(), "batching": translation_batcher.stats()}
+
+@app.get("/translation-memory")
+def get_translation_memory_stats():
+    """สถิติของ translation memory"""
+    if translation_memory is None:
+        return {"enabled": False}
+    return {"enabled": True, **translation_memory.stats()}
+
+@app.post("/translation-memory/import")
+async def import_translation_memory(request: Request, source_lang: str = "", target_lang: str = ""):
+    """เพิ่ม glossary/คำแปลจาก NDJSON หรือ JSON array ของ {source, target, source_lang, target_lang}
+    (source_lang/target_lang ใน query ใช้กับรายการที่ไม่ได้ระบุ) ตัวแปร {name} ใน source จะถูกแทนใน target"""
+    if translation_memory is None:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"error": "ไม่ได้เปิดใช้ translation memory"})
+    body = (await request.body()).decode("utf-8", errors="replace")
+    try:
+        if body.lstrip().startswith("["):
+            records = json.loads(body)
+            if not all(isinstance(record, dict) for record in records):
+                raise ValueError("Every item must be a JSON object")
+        else:
+            records = list(parse_records(body.splitlines()))
+    except ValueError as e:
+        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": f"รูปแบบข้อมูลไม่ถูกต้อง: {str(e)}"})
+    imported, skipped = await asyncio.to_thread(
+        translation_memory.import_entries, records, source_lang, target_lang
+    )
+    logger.info(f"Imported {imported} translation memory entries ({skipped} skipped)")
+    # request ไปถึง worker เดียว ส่งต่อให้ worker อื่นผ่าน registry
+    try:
+        await registry.publish(TRANSLATION_MEMORY_CHANNEL, json.dumps({
+            "worker": WORKER_ID,
+            "records": records,
+            "source_lang": source_lang,
+            "target_lang": target_lang,
+        }, ensure_ascii=False))
+    except Exception as e:
+        logger.error(f"Error publishing translation memory import to other workers: {str(e)}")
+    return {"imported": imported, "skipped": skipped, "entries": len(translation_memory)}
+
+@app.get("/translation-memory/export")
+def export_translation_memory(source_lang: str = "", target_lang: str = ""):
+    """ส่งออกรายการทั้งหมด (กรองตามคู่ภาษาได้) เป็น NDJSON ที่ import กลับได้"""
+    if translation_memory is None:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"error": "ไม่ได้เปิดใช้ translation memory"})
+    lines = (
+        json.dumps(record, ensure_ascii=False) + "\n"
+        for record in translation_memory.export_entries(source_lang, target_lang)
+    )
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+@app.get("/transcription-cache")
+def get_transcription_cache_stats():
+    """สถิติของ cache ผลถอดเสียง"""
+    if transcription_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **transcription_cache.stats()}
+
 @app.post("/text-translate")
 async def text_translate(
     text: str,
@@ -517,33 +1375,5 @@ async def text_translate(
     
 @app.get("/whisper-capabilities")
 async def get_whisper_capabilities():
-    """ตรวจสอบความสามารถของ Whisper service ที่มีอยู่จริง"""
-    try:
-        # ตรวจสอบการเชื่อมต่อกับ Whisper
-        health_url = urljoin(WHISPER_URL, "/openapi.json")
-        health_response = await asyncio.to_thread(
-            requests.get,
-            health_url,
-            timeout=5
-        )
-        
-        whisper_available = health_response.status_code == 200
-        
-        return {
-            "use_whisper_translation": True,
-            "supports_translation": True,
-            "can_transcribe": whisper_available,
-            "can_translate": whisper_available,
-            "whisper_status": "ready" if whisper_available else "unavailable",
-            "error": None if whisper_available else "Cannot connect to Whisper service"
-        }
-    except Exception as e:
-        logger.error(f"Error checking Whisper capabilities: {str(e)}")
-        return {
-            "use_whisper_translation": True,
-            "supports_translation": True,
-            "can_transcribe": False,
-            "can_translate": False,
-            "whisper_status": "error",
-            "error": str(e)
-        }
\ No newline at end of file
+    """ตรวจสอบความสามารถของ Whisper service จากสถานะล่าสุดที่ cache ไว้"""
+    return whisper_capabilities(whisper_pool.is_available)
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+import resource
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+logger = logging.getLogger(__name__)
+
+# เมื่อรันหลาย worker (uvicorn --workers N) ต้องตั้ง PROMETHEUS_MULTIPROC_DIR เป็นโฟลเดอร์ว่างก่อนเริ่ม process
+# ทุก worker เขียนค่าลงไฟล์ในโฟลเดอร์นี้และ /metrics รวมค่าจากทุก worker (ไม่ตั้ง = เห็นเฉพาะ worker ที่ตอบ request)
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# ช่วงเวลาของ histogram (วินาที) ครอบคลุมตั้งแต่ cache hit ไปจนถึง Whisper บน CPU
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+STAGE_LATENCY = Histogram(
+    "stt_stage_latency_seconds", "Latency of each processing stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_PAYLOAD_BYTES = Histogram(
+    "stt_stage_payload_bytes", "Payload size handled by each stage", ["stage"], buckets=BYTES_BUCKETS
+)
+BACKEND_REQUESTS = Counter(
+    "stt_backend_requests_total", "Requests sent to backends", ["backend", "status"]
+)
+TRANSLATIONS = Counter(
+    "stt_translations_total", "Translation requests by language pair", ["source_lang", "target_lang", "status"]
+)
+TRANSLATION_FALLBACKS = Counter(
+    "stt_translation_fallbacks_total", "Translation provider attempts that fell through", ["provider", "reason"]
+)
+# gauge รวมค่าของ worker ที่ยังทำงานอยู่ (multiprocess_mode มีผลเฉพาะเมื่อตั้ง PROMETHEUS_MULTIPROC_DIR)
+ACTIVE_WEBSOCKETS = Gauge("stt_active_websockets", "Open WebSocket connections", multiprocess_mode="livesum")
+QUEUE_DEPTH = Gauge("stt_queue_depth", "Items waiting in internal queues", ["queue"], multiprocess_mode="livesum")
+# ค่าประมาณจากขนาด buffer เสียงที่โค้ดนับเอง ไม่ใช่หน่วยความจำที่วัดจริง (ค่าที่วัดจริงดู stt_process_peak_rss_bytes)
+REQUEST_AUDIO_BUFFER_BYTES = Histogram(
+    "stt_request_audio_buffer_bytes",
+    "Estimated peak size of audio buffers held at once by a request (accounted, not measured)",
+    ["endpoint"],
+    buckets=BYTES_BUCKETS
+)
+PREPROCESS_BYTES = Counter(
+    "stt_preprocess_bytes_total", "Audio bytes before and after preprocessing", ["direction"]
+)
+REJECTED_UPLOADS = Counter("stt_rejected_uploads_total", "Uploads rejected by size or duration limits", ["reason"])
+PROCESS_PEAK_RSS = Gauge(
+    "stt_process_peak_rss_bytes", "Peak resident memory of this process", multiprocess_mode="liveall"
+)
+# วัดจริงจาก ru_maxrss: peak RSS ของ process ที่เพิ่มขึ้นระหว่าง request (request ที่ทำงานพร้อมกันจะเห็นค่าเดียวกัน)
+REQUEST_PEAK_RSS_GROWTH = Histogram(
+    "stt_request_peak_rss_growth_bytes",
+    "Measured growth of process peak RSS while a request was running",
+    ["endpoint"],
+    buckets=BYTES_BUCKETS
+)
+
+# gauge ที่คำนวณค่าจากฟังก์ชัน ในโหมด multiprocess ต้องเขียนค่าลงไฟล์เองเป็นระยะ
+_gauge_functions: List[Tuple[Gauge, Callable[[], float]]] = []
+
+# เวลาของแต่ละ stage ใน request ปัจจุบัน สำหรับ header Server-Timing
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+# ขนาด buffer เสียงที่ request ปัจจุบันถืออยู่ (ค่าประมาณ) [ปัจจุบัน, สูงสุด]
+_request_buffers: ContextVar[Optional[List[int]]] = ContextVar("request_buffers", default=None)
+
+
+def observe_stage(stage: str, seconds: float, payload_bytes: Optional[int] = None):
+    """บันทึกเวลา (และขนาดข้อมูล) ของ stage"""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    if payload_bytes is not None:
+        STAGE_PAYLOAD_BYTES.labels(stage).observe(payload_bytes)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def stage_timer(stage: str, payload_bytes: Optional[int] = None):
+    """จับเวลา stage ด้วย with"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, payload_bytes)
+
+
+def status_label(status_code: Optional[int]) -> str:
+    """จัดกลุ่ม status code เป็น 2xx/4xx/5xx (หรือ error ถ้าไม่มี response)"""
+    return f"{status_code // 100}xx" if status_code else "error"
+
+
+def start_request_timing() -> List[Tuple[str, float]]:
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def format_server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    """สร้างค่า header Server-Timing (stage ที่เกิดซ้ำจะถูกรวมเวลา)"""
+    merged = {}
+    for stage, seconds in timings:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in merged.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def process_peak_rss() -> int:
+    """peak RSS ของ process เป็น byte (ru_maxrss บน Linux มีหน่วยเป็น KB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def gauge_function(gauge: Gauge, f: Callable[[], float]):
+    """ให้ค่าของ gauge มาจาก f (ในโหมด multiprocess ค่าจะถูกเขียนลงไฟล์โดย refresh_gauges)"""
+    if MULTIPROCESS:
+        _gauge_functions.append((gauge, f))
+    else:
+        gauge.set_function(f)
+
+
+def refresh_gauges():
+    for gauge, f in _gauge_functions:
+        try:
+            gauge.set(f())
+        except Exception as e:
+            logger.warning(f"Error refreshing gauge {gauge._name}: {str(e)}")
+
+
+async def refresh_gauges_forever(interval: float = 5.0):
+    """เขียนค่า gauge ของ worker นี้ลงไฟล์เป็นระยะ worker อื่นที่ตอบ /metrics จึงเห็นค่าล่าสุด"""
+    while True:
+        refresh_gauges()
+        await asyncio.sleep(interval)
+
+
+def mark_process_dead():
+    """ลบค่า gauge แบบ live ของ worker นี้ออกจากผลรวมเมื่อ process หยุด"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+gauge_function(PROCESS_PEAK_RSS, process_peak_rss)
+
+
+def start_buffer_accounting() -> List[int]:
+    usage = [0, 0]
+    _request_buffers.set(usage)
+    return usage
+
+
+@contextmanager
+def account_buffer(nbytes: int):
+    """นับ buffer ขนาด nbytes ที่ถืออยู่ระหว่าง with เข้าในขนาด buffer สูงสุดของ request (ประมาณจากขนาดที่รู้ ไม่ได้วัดจริง)"""
+    usage = _request_buffers.get()
+    if usage is None:
+        yield
+        return
+    usage[0] += nbytes
+    usage[1] = max(usage[1], usage[0])
+    try:
+        yield
+    finally:
+        usage[0] -= nbytes
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    if not MULTIPROCESS:
+        return generate_latest(), CONTENT_TYPE_LATEST
+    refresh_gauges()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
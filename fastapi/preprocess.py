@@ -0,0 +1,233 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Optional, Union
+
+import numpy as np
+
+from vad import decode_stream_to_pcm, decode_to_pcm, encode_wav
+
+logger = logging.getLogger(__name__)
+
+# sample rate ที่ Whisper ใช้ภายใน ส่งไปตรงนี้เลยจะไม่ต้อง resample ซ้ำ
+SAMPLE_RATE = 16000
+
+# รูปแบบไฟล์ที่ส่งต่อไป Whisper: wav ถอดรหัสเร็วที่สุด, opus เล็กที่สุด, flac อยู่ระหว่างกลาง (lossless)
+OUTPUT_FORMATS = {
+    "wav": None,
+    "flac": ["-c:a", "flac", "-f", "flac"],
+    "opus": ["-c:a", "libopus", "-application", "voip", "-f", "ogg"],
+}
+
+
+def normalize_pcm(
+    pcm: np.ndarray,
+    sample_rate: int = SAMPLE_RATE,
+    target_dbfs: float = -20.0,
+    max_gain_db: float = 20.0,
+    peak_dbfs: float = -1.0,
+    trim: bool = True,
+    threshold_db: float = -45.0,
+    padding_ms: float = 200.0,
+    frame_ms: float = 30.0,
+) -> np.ndarray:
+    """ตัดช่วงเงียบหัวท้ายและปรับความดังให้ RMS ของช่วงที่มีเสียงเท่ากับ target_dbfs
+    (ฟังก์ชันระดับ module เพื่อให้ส่งไปทำใน process pool ได้)"""
+    frame_length = max(1, int(sample_rate * frame_ms / 1000))
+    frame_count = len(pcm) // frame_length
+    if frame_count == 0:
+        return pcm
+
+    samples = pcm.astype(np.float32) / 32768.0
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length)
+    energy_db = 20.0 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10)
+    active = np.flatnonzero(energy_db > threshold_db)
+    if len(active) == 0:
+        # เงียบทั้งชิ้น ไม่ขยายเสียงรบกวน
+        return pcm
+
+    if trim:
+        padding = int(sample_rate * padding_ms / 1000)
+        start = max(0, int(active[0]) * frame_length - padding)
+        end = min(len(samples), (int(active[-1]) + 1) * frame_length + padding)
+        samples = samples[start:end]
+
+    # วัดความดังเฉพาะเฟรมที่มีเสียง ช่วงเงียบจะได้ไม่ดึงค่าเฉลี่ยลง
+    speech_rms = np.sqrt(np.mean(frames[active] ** 2))
+    gain_db = float(np.clip(target_dbfs - 20.0 * np.log10(speech_rms + 1e-10), -max_gain_db, max_gain_db))
+    peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+    if peak > 0:
+        # จำกัด gain ไม่ให้ peak เกิน peak_dbfs (กันเสียงแตก)
+        gain_db = min(gain_db, peak_dbfs - 20.0 * np.log10(peak))
+    samples = samples * (10.0 ** (gain_db / 20.0))
+    return np.clip(samples * 32768.0, -32768, 32767).astype(np.int16)
+
+
+def normalize_to_wav(pcm: np.ndarray, sample_rate: int, options: dict) -> bytes:
+    """normalize แล้วเข้ารหัสเป็น WAV ในขั้นตอนเดียว (ทำใน process pool)"""
+    return encode_wav(normalize_pcm(pcm, sample_rate, **options), sample_rate)
+
+
+async def encode_pcm(pcm: np.ndarray, output_format: str, bitrate: str, sample_rate: int = SAMPLE_RATE) -> Optional[bytes]:
+    """เข้ารหัส PCM 16-bit mono เป็น flac/opus ด้วย ffmpeg โดยไม่ block event loop"""
+    args = ["-b:a", bitrate] if output_format == "opus" else []
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+        *OUTPUT_FORMATS[output_format], *args,
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(pcm.astype(np.int16).tobytes())
+    if process.returncode != 0:
+        logger.warning(f"ffmpeg encode failed: {stderr.decode(errors='ignore').strip()[:200]}")
+        return None
+    return stdout
+
+
+class PreprocessResult:
+    """ผลของการเตรียมเสียงหนึ่ง chunk"""
+
+    def __init__(self, audio_data: bytes, bytes_in: int, seconds: float, duration: float, output_duration: float):
+        self.audio_data = audio_data
+        self.bytes_in = bytes_in
+        self.bytes_out = len(audio_data)
+        self.seconds = seconds
+        self.duration = duration
+        self.output_duration = output_duration
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_in - self.bytes_out
+
+
+class AudioPreprocessor:
+    """แปลงเสียงจาก browser เป็น 16 kHz mono พร้อมปรับความดังและตัดช่วงเงียบก่อนส่งไป Whisper
+    ส่วนที่ใช้ CPU (normalize/trim/เข้ารหัส WAV) ทำใน process pool, ถอดรหัส/เข้ารหัสด้วย ffmpeg subprocess"""
+
+    def __init__(
+        self,
+        output_format: str = "opus",
+        bitrate: str = "24k",
+        target_dbfs: float = -20.0,
+        max_gain_db: float = 20.0,
+        trim: bool = True,
+        threshold_db: float = -45.0,
+        padding_ms: float = 200.0,
+        workers: int = 2,
+    ):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported preprocess format: {output_format}")
+        self.output_format = output_format
+        self.bitrate = bitrate
+        self.options = {
+            "target_dbfs": target_dbfs,
+            "max_gain_db": max_gain_db,
+            "trim": trim,
+            "threshold_db": threshold_db,
+            "padding_ms": padding_ms,
+        }
+        self.workers = max(1, workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._ffmpeg_available = True
+        self.chunks = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds_spent = 0.0
+        self.seconds_trimmed = 0.0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # สร้างตอนใช้งานครั้งแรก และใช้ spawn แทน fork: fork จาก process ที่มี event loop, thread
+        # และ socket เปิดอยู่ทำให้ worker ติด lock ค้างหรือถือ file descriptor ของ server ไว้ได้
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def process(
+        self,
+        audio_data: Union[bytes, BinaryIO],
+        pcm: Optional[np.ndarray] = None
+    ) -> Optional[PreprocessResult]:
+        """เตรียมเสียงหนึ่ง chunk หรือไฟล์อัปโหลด (file object ถูก stream เข้า ffmpeg ไม่อ่านทั้งไฟล์)
+        pcm = PCM 16 kHz ที่ถอดรหัสไว้แล้ว เช่นจาก VAD คืน None ถ้าทำไม่ได้ ให้ผู้เรียกส่งเสียงเดิมต่อไปแทน"""
+        if not self._ffmpeg_available:
+            return None
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            if pcm is None:
+                if isinstance(audio_data, bytes):
+                    pcm = await decode_to_pcm(audio_data, SAMPLE_RATE)
+                else:
+                    pcm = await decode_stream_to_pcm(audio_data, SAMPLE_RATE)
+                if pcm is None:
+                    self.failures += 1
+                    return None
+
+            if self.output_format == "wav":
+                output = await loop.run_in_executor(self._pool(), normalize_to_wav, pcm, SAMPLE_RATE, self.options)
+                output_samples = (len(output) - 44) // 2
+            else:
+                normalized = await loop.run_in_executor(
+                    self._pool(), functools.partial(normalize_pcm, pcm, SAMPLE_RATE, **self.options)
+                )
+                output = await encode_pcm(normalized, self.output_format, self.bitrate)
+                output_samples = len(normalized)
+                if output is None:
+                    self.failures += 1
+                    return None
+        except FileNotFoundError:
+            logger.error("ffmpeg not found, audio preprocessing disabled")
+            self._ffmpeg_available = False
+            return None
+        except Exception as e:
+            logger.warning(f"Audio preprocessing failed: {str(e)}")
+            self.failures += 1
+            return None
+
+        if isinstance(audio_data, bytes):
+            bytes_in = len(audio_data)
+        else:
+            # ไม่ใช้ fileno(): SpooledTemporaryFile ที่ยังอยู่ในหน่วยความจำจะถูกเขียนลงดิสก์
+            bytes_in = audio_data.seek(0, os.SEEK_END)
+            audio_data.seek(0)
+        result = PreprocessResult(
+            output,
+            bytes_in,
+            time.perf_counter() - started,
+            len(pcm) / SAMPLE_RATE,
+            output_samples / SAMPLE_RATE,
+        )
+        self.chunks += 1
+        self.bytes_in += result.bytes_in
+        self.bytes_out += result.bytes_out
+        self.seconds_spent += result.seconds
+        self.seconds_trimmed += result.duration - result.output_duration
+        return result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._ffmpeg_available,
+            "format": self.output_format,
+            "chunks": self.chunks,
+            "failures": self.failures,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "seconds_spent": round(self.seconds_spent, 3),
+            "seconds_trimmed": round(self.seconds_trimmed, 2),
+        }
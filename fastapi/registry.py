@@ -0,0 +1,476 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from urllib.parse import unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str], None]
+
+
+class RegistryError(Exception):
+    """Redis ตอบกลับเป็น error"""
+
+
+class Registry:
+    """ที่เก็บสถานะที่ทุก worker ใช้ร่วมกัน (key/value มีอายุ, hash และ pub/sub)"""
+
+    backend = "base"
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        """ตั้งค่า key (nx=True ตั้งเฉพาะเมื่อยังไม่มี key) คืน False ถ้าไม่ได้ตั้ง"""
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def hset(self, key: str, field: str, value: str):
+        raise NotImplementedError
+
+    async def hdel(self, key: str, *fields: str):
+        raise NotImplementedError
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, handler: MessageHandler):
+        """ลงทะเบียนตัวรับข้อความของ channel (ข้อความจากทุก worker รวมถึงตัวเอง)"""
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_json(self, key: str) -> Optional[Any]:
+        value = await self.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        return await self.set(key, json.dumps(value, ensure_ascii=False), ttl, nx)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend}
+
+
+class MemoryRegistry(Registry):
+    """Registry ในหน่วยความจำของ process (ใช้ได้เมื่อรัน worker เดียว)"""
+
+    backend = "memory"
+
+    def __init__(self):
+        self._values: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+
+    def _alive(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._values
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self._values.get(key) if self._alive(key) else None
+        return value if isinstance(value, str) else None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        if nx and self._alive(key):
+            return False
+        self._values[key] = value
+        if ttl:
+            self._expires[key] = time.monotonic() + ttl
+        else:
+            self._expires.pop(key, None)
+        return True
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+
+    async def hset(self, key: str, field: str, value: str):
+        if not self._alive(key):
+            self._values[key] = {}
+        self._values[key][field] = value
+
+    async def hdel(self, key: str, *fields: str):
+        if self._alive(key):
+            for field in fields:
+                self._values[key].pop(field, None)
+            if not self._values[key]:
+                del self._values[key]
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._values[key]) if self._alive(key) else {}
+
+    async def publish(self, channel: str, message: str):
+        for handler in self._handlers.get(channel, []):
+            try:
+                handler(message)
+            except Exception as e:
+                logger.error(f"Error handling registry message on {channel}: {str(e)}")
+
+    def subscribe(self, channel: str, handler: MessageHandler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+
+async def _wait(awaitable: Awaitable[Any], timeout: float) -> Any:
+    """เหมือน asyncio.wait_for แต่ไม่กลืนการยกเลิกที่มาพร้อมกับคำตอบ
+    (wait_for ของ Python 3.11 คืนผลแทนการยกเลิก ทำให้ task ที่ถูก cancel ทำงานต่อและ stop() รอไม่จบ)"""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+    except BaseException:
+        task.cancel()
+        raise
+    if not done:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise asyncio.TimeoutError()
+    return task.result()
+
+
+class RespConnection:
+    """การเชื่อมต่อหนึ่งเส้นที่คุยด้วย Redis protocol (RESP2) ใช้ได้กับ Redis/Valkey/KeyDB"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host: str, port: int, password: Optional[str] = None, db: int = 0,
+                   username: Optional[str] = None, timeout: float = 5.0) -> "RespConnection":
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        connection = cls(reader, writer)
+        try:
+            if password:
+                await connection.execute(*(["AUTH", username, password] if username else ["AUTH", password]))
+            if db:
+                await connection.execute("SELECT", str(db))
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    @staticmethod
+    def encode(*args: str) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode() if isinstance(arg, str) else bytes(arg)
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(parts)
+
+    async def send(self, *args: str):
+        self.writer.write(self.encode(*args))
+        await self.writer.drain()
+
+    async def read_reply(self) -> Any:
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Registry connection closed")
+        kind, rest = line[:1], line[1:].rstrip(b"\r\n")
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RegistryError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            count = int(rest)
+            if count < 0:
+                return None
+            return [await self.read_reply() for _ in range(count)]
+        raise ConnectionError(f"Unexpected registry reply: {line[:20]!r}")
+
+    async def execute(self, *args: str) -> Any:
+        await self.send(*args)
+        return await self.read_reply()
+
+    def close(self):
+        self.writer.close()
+
+
+class RedisRegistry(Registry):
+    """Registry บน Redis ใช้ร่วมกันได้ทุก worker/ทุกเครื่อง (pool การเชื่อมต่อ + การเชื่อมต่อแยกสำหรับ subscribe)"""
+
+    backend = "redis"
+
+    def __init__(self, url: str, prefix: str = "stt:", max_connections: int = 10, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._idle: List[RespConnection] = []
+        self._slots = asyncio.Semaphore(max(1, max_connections))
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._subscriber: Optional[RespConnection] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribe_tasks: Set[asyncio.Task] = set()
+        self.commands = 0
+        self.errors = 0
+        self.reconnects = 0
+
+    async def _connect(self) -> RespConnection:
+        return await RespConnection.open(
+            self.host, self.port, self.password, self.db, self.username, self.timeout
+        )
+
+    async def execute(self, *args: str) -> Any:
+        """ส่งคำสั่งผ่าน pool (ลองใหม่หนึ่งครั้งด้วยการเชื่อมต่อใหม่ถ้าการเชื่อมต่อเดิมหลุด)"""
+        async with self._slots:
+            for attempt in range(2):
+                connection = self._idle.pop() if self._idle else None
+                try:
+                    if connection is None:
+                        connection = await self._connect()
+                    reply = await _wait(connection.execute(*args), self.timeout)
+                except RegistryError:
+                    if connection is not None:
+                        self._idle.append(connection)
+                    self.errors += 1
+                    raise
+                except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    if connection is not None:
+                        connection.close()
+                    self.errors += 1
+                    if attempt:
+                        raise
+                    self.reconnects += 1
+                    continue
+                except BaseException:
+                    # ถูกยกเลิกระหว่างรอคำตอบ การเชื่อมต่อนี้อาจยังมีคำตอบค้างอยู่ ใช้ต่อไม่ได้
+                    if connection is not None:
+                        connection.close()
+                    raise
+                self._idle.append(connection)
+                self.commands += 1
+                return reply
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.execute("GET", self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        args = ["SET", self.prefix + key, value]
+        if ttl:
+            args += ["PX", str(int(ttl * 1000))]
+        if nx:
+            args.append("NX")
+        return await self.execute(*args) is not None
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.execute("DEL", *(self.prefix + key for key in keys))
+
+    async def hset(self, key: str, field: str, value: str):
+        await self.execute("HSET", self.prefix + key, field, value)
+
+    async def hdel(self, key: str, *fields: str):
+        if fields:
+            await self.execute("HDEL", self.prefix + key, *fields)
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        reply = await self.execute("HGETALL", self.prefix + key) or []
+        return dict(zip(reply[0::2], reply[1::2]))
+
+    async def publish(self, channel: str, message: str):
+        await self.execute("PUBLISH", self.prefix + channel, message)
+
+    def subscribe(self, channel: str, handler: MessageHandler):
+        self._handlers.setdefault(self.prefix + channel, []).append(handler)
+        if self._subscriber is not None:
+            task = asyncio.create_task(self._subscriber.send("SUBSCRIBE", self.prefix + channel))
+            self._subscribe_tasks.add(task)
+            task.add_done_callback(self._subscribe_done)
+
+    def _subscribe_done(self, task: asyncio.Task):
+        self._subscribe_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # การเชื่อมต่อหลุด _listen จะต่อใหม่และ SUBSCRIBE ทุก channel อีกครั้ง
+            logger.warning(f"Registry SUBSCRIBE failed: {str(task.exception())}")
+
+    async def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        """รับข้อความ pub/sub และเชื่อมต่อใหม่เองเมื่อหลุด (ข้อความระหว่างหลุดจะหายไป)"""
+        delay = 0.5
+        while True:
+            try:
+                self._subscriber = await self._connect()
+                if self._handlers:
+                    await self._subscriber.send("SUBSCRIBE", *self._handlers)
+                delay = 0.5
+                while True:
+                    reply = await self._subscriber.read_reply()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == "message":
+                        for handler in self._handlers.get(reply[1], []):
+                            try:
+                                handler(reply[2])
+                            except Exception as e:
+                                logger.error(f"Error handling registry message on {reply[1]}: {str(e)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Registry subscriber disconnected: {str(e)}, retrying in {delay:.1f}s")
+            finally:
+                if self._subscriber is not None:
+                    self._subscriber.close()
+                    self._subscriber = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10.0)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        for task in list(self._subscribe_tasks):
+            task.cancel()
+        await asyncio.gather(*self._subscribe_tasks, return_exceptions=True)
+        for connection in self._idle:
+            connection.close()
+        self._idle.clear()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "address": f"{self.host}:{self.port}/{self.db}",
+            "connections_idle": len(self._idle),
+            "subscribed": self._subscriber is not None,
+            "commands": self.commands,
+            "errors": self.errors,
+            "reconnects": self.reconnects,
+        }
+
+
+def create_registry(url: str, prefix: str = "stt:") -> Registry:
+    """สร้าง registry จาก URL: ว่างหรือ memory:// = ในหน่วยความจำ, redis://[:password@]host:port/db = Redis"""
+    scheme = urlparse(url).scheme if url else "memory"
+    if scheme == "memory":
+        return MemoryRegistry()
+    if scheme == "redis":
+        return RedisRegistry(url, prefix)
+    raise ValueError(f"Unsupported registry URL: {url}")
+
+
+class SessionRegistry:
+    """session และการตั้งค่าของ client ที่ทุก worker เห็นร่วมกัน
+    (client ที่ reconnect ไปอีก worker ได้การตั้งค่าเดิม และนับจำนวนการเชื่อมต่อรวมได้)"""
+
+    def __init__(self, registry: Registry, worker_id: str, settings_ttl: float = 86400.0,
+                 heartbeat_interval: float = 10.0):
+        self.registry = registry
+        self.worker_id = worker_id
+        self.settings_ttl = settings_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.local_sessions: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def register(self, client_id: str):
+        self.local_sessions[client_id] = time.time()
+        try:
+            await self.registry.hset("sessions", client_id, json.dumps({
+                "worker": self.worker_id,
+                "connected_at": self.local_sessions[client_id],
+            }))
+        except Exception as e:
+            logger.error(f"Error registering session {client_id}: {str(e)}")
+
+    async def unregister(self, client_id: str):
+        self.local_sessions.pop(client_id, None)
+        try:
+            # client อาจ reconnect ไปอีก worker แล้ว ลบเฉพาะเมื่อยังเป็นของ worker นี้
+            current = (await self.registry.hgetall("sessions")).get(client_id)
+            if current is not None and json.loads(current).get("worker") == self.worker_id:
+                await self.registry.hdel("sessions", client_id)
+        except Exception as e:
+            logger.error(f"Error unregistering session {client_id}: {str(e)}")
+
+    async def load_settings(self, client_id: str) -> dict:
+        try:
+            return await self.registry.get_json(f"settings:{client_id}") or {}
+        except Exception as e:
+            logger.error(f"Error loading settings for {client_id}: {str(e)}")
+            return {}
+
+    async def save_settings(self, client_id: str, settings: dict):
+        try:
+            await self.registry.set_json(f"settings:{client_id}", settings, self.settings_ttl)
+        except Exception as e:
+            logger.error(f"Error saving settings for {client_id}: {str(e)}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        """ประกาศว่า worker นี้ยังทำงานอยู่ และล้าง session ของ worker ที่หายไปโดยไม่ได้ลบ"""
+        while True:
+            try:
+                await self.registry.set(f"worker:{self.worker_id}", str(time.time()), self.heartbeat_interval * 3)
+                sessions = await self.registry.hgetall("sessions")
+                alive = await self._alive_workers(sessions)
+                stale = [client_id for client_id, info in sessions.items() if json.loads(info)["worker"] not in alive]
+                if stale:
+                    await self.registry.hdel("sessions", *stale)
+                    logger.info(f"Removed {len(stale)} sessions of stopped workers")
+            except Exception as e:
+                logger.error(f"Session registry heartbeat failed: {str(e)}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def worker_alive(self, worker_id: str) -> bool:
+        """worker ยังส่ง heartbeat อยู่หรือไม่"""
+        if worker_id == self.worker_id:
+            return True
+        return await self.registry.get(f"worker:{worker_id}") is not None
+
+    async def _alive_workers(self, sessions: Dict[str, str]) -> set:
+        workers = {json.loads(info)["worker"] for info in sessions.values()}
+        return {worker for worker in workers if await self.worker_alive(worker)} | {self.worker_id}
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            for client_id in list(self.local_sessions):
+                await self.unregister(client_id)
+            await self.registry.delete(f"worker:{self.worker_id}")
+        except Exception as e:
+            logger.error(f"Error removing worker {self.worker_id} from registry: {str(e)}")
+
+    async def stats(self) -> dict:
+        stats = {"worker": self.worker_id, "local_sessions": len(self.local_sessions), **self.registry.stats()}
+        try:
+            sessions = await self.registry.hgetall("sessions")
+            by_worker: Dict[str, int] = {}
+            for info in sessions.values():
+                worker = json.loads(info)["worker"]
+                by_worker[worker] = by_worker.get(worker, 0) + 1
+            stats["sessions"] = len(sessions)
+            stats["sessions_by_worker"] = by_worker
+        except Exception as e:
+            stats["error"] = str(e)
+        return stats
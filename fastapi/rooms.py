@@ -0,0 +1,304 @@
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from registry import SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+TranslateFunc = Callable[[str, str, str], Awaitable[Optional[str]]]
+SendFunc = Callable[[dict], Awaitable[None]]
+
+ROLE_SPEAKER = "speaker"
+ROLE_LISTENER = "listener"
+
+# channel ที่ใช้ส่งผลแปลให้ทุก worker (แต่ละ worker ส่งต่อให้ผู้ฟังที่เชื่อมต่ออยู่กับตัวเอง)
+ROOMS_CHANNEL = "rooms"
+
+
+class RoomListener:
+    """ผู้ฟังหนึ่งรายพร้อมคิวส่งของตัวเอง ผู้ฟังที่รับช้าจะไม่ทำให้ผู้ฟังคนอื่นหรือผู้พูดต้องรอ"""
+
+    def __init__(self, client_id: str, target_lang: str, send: SendFunc, max_queue: int = 32):
+        self.client_id = client_id
+        self.target_lang = target_lang
+        self.send = send
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_queue))
+        self.sent = 0
+        self.dropped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def offer(self, message: dict):
+        """ใส่ข้อความเข้าคิวโดยไม่รอ ถ้าคิวเต็มจะทิ้งข้อความเก่าที่สุด (คำบรรยายที่ล้าสมัยไม่มีประโยชน์)"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def _run(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.send(message)
+                self.sent += 1
+            except Exception as e:
+                logger.warning(f"Error sending room message to {self.client_id}: {str(e)}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class Room:
+    """สมาชิกของห้องที่เชื่อมต่ออยู่กับ worker นี้ (สมาชิกทั้งหมดของห้องเก็บใน registry)"""
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.speaker_id: Optional[str] = None
+        self.listeners: Dict[str, RoomListener] = {}
+        self.seq = 0
+
+    @property
+    def is_empty(self) -> bool:
+        return self.speaker_id is None and not self.listeners
+
+    def target_langs(self) -> set:
+        return {listener.target_lang for listener in self.listeners.values()}
+
+    def stats(self) -> dict:
+        languages: Dict[str, int] = {}
+        for listener in self.listeners.values():
+            languages[listener.target_lang] = languages.get(listener.target_lang, 0) + 1
+        return {
+            "speaker": self.speaker_id,
+            "listeners": len(self.listeners),
+            "languages": languages,
+            "messages": self.seq,
+            "queued": sum(listener.queue.qsize() for listener in self.listeners.values()),
+            "dropped": sum(listener.dropped for listener in self.listeners.values()),
+        }
+
+
+class RoomManager:
+    """จัดการห้องและกระจายผล: ถอดเสียงของผู้พูดครั้งเดียว แปลครั้งเดียวต่อภาษาปลายทางพร้อมกัน
+    แล้วส่งให้ผู้ฟังที่เลือกภาษานั้นผ่านคิวส่งของแต่ละคน
+    สมาชิกของห้องเก็บใน registry และผลแปลส่งผ่าน pub/sub ผู้พูดและผู้ฟังจึงอยู่คนละ worker ได้"""
+
+    def __init__(
+        self,
+        translate: TranslateFunc,
+        sessions: SessionRegistry,
+        max_listener_queue: int = 32,
+        max_listeners: int = 0,
+    ):
+        self.translate = translate
+        self.sessions = sessions
+        self.registry = sessions.registry
+        self.max_listener_queue = max_listener_queue
+        self.max_listeners = max_listeners
+        self.rooms: Dict[str, Room] = {}
+        self._membership: Dict[str, str] = {}
+        self.translations = 0
+        self.broadcasts = 0
+        self.registry.subscribe(ROOMS_CHANNEL, self._deliver)
+
+    @staticmethod
+    def _speaker_key(room_id: str) -> str:
+        return f"room:{room_id}:speaker"
+
+    @staticmethod
+    def _listeners_key(room_id: str) -> str:
+        return f"room:{room_id}:listeners"
+
+    def room_of(self, client_id: str) -> Optional[Room]:
+        room_id = self._membership.get(client_id)
+        return self.rooms.get(room_id) if room_id is not None else None
+
+    def speaker_room(self, client_id: str) -> Optional[Room]:
+        """ห้องที่ client นี้เป็นผู้พูดอยู่ (ถ้ามี)"""
+        room = self.room_of(client_id)
+        return room if room is not None and room.speaker_id == client_id else None
+
+    async def _current_speaker(self, room_id: str) -> Optional[str]:
+        """ผู้พูดของห้อง (ไม่นับผู้พูดที่ worker หยุดทำงานไปแล้ว)"""
+        speaker = await self.registry.get_json(self._speaker_key(room_id))
+        if speaker is None or not await self.sessions.worker_alive(speaker["worker"]):
+            return None
+        return speaker["client_id"]
+
+    async def _listeners(self, room_id: str) -> Dict[str, dict]:
+        """ผู้ฟังทั้งหมดของห้องจากทุก worker (ล้างรายการของ worker ที่หยุดทำงานไปแล้ว)"""
+        listeners = {
+            client_id: json.loads(info)
+            for client_id, info in (await self.registry.hgetall(self._listeners_key(room_id))).items()
+        }
+        alive = {}
+        for worker in {info["worker"] for info in listeners.values()}:
+            alive[worker] = await self.sessions.worker_alive(worker)
+        stale = [client_id for client_id, info in listeners.items() if not alive[info["worker"]]]
+        if stale:
+            await self.registry.hdel(self._listeners_key(room_id), *stale)
+        return {client_id: info for client_id, info in listeners.items() if alive[info["worker"]]}
+
+    async def join(self, room_id: str, client_id: str, role: str, target_lang: str, send: SendFunc) -> Room:
+        """เข้าห้องในบทบาทผู้พูดหรือผู้ฟัง (ออกจากห้องเดิมก่อน) ถ้าเข้าไม่ได้จะ raise ValueError"""
+        if role not in (ROLE_SPEAKER, ROLE_LISTENER):
+            raise ValueError(f"Unknown room role: {role}")
+        if role == ROLE_SPEAKER and await self._current_speaker(room_id) not in (None, client_id):
+            raise ValueError("ห้องนี้มีผู้พูดอยู่แล้ว")
+        if role == ROLE_LISTENER and self.max_listeners:
+            listeners = await self._listeners(room_id)
+            if len(listeners) >= self.max_listeners and client_id not in listeners:
+                raise ValueError("ห้องนี้มีผู้ฟังเต็มแล้ว")
+
+        await self.leave(client_id)
+        member = {"client_id": client_id, "worker": self.sessions.worker_id}
+        if role == ROLE_SPEAKER and not await self.registry.set_json(self._speaker_key(room_id), member, nx=True):
+            # มี key อยู่แล้ว: เขียนทับได้เฉพาะเมื่อเป็นของ worker ที่หยุดไปแล้ว (อีก worker อาจเพิ่งได้สิทธิ์ไป)
+            if await self._current_speaker(room_id) not in (None, client_id):
+                raise ValueError("ห้องนี้มีผู้พูดอยู่แล้ว")
+            await self.registry.set_json(self._speaker_key(room_id), member)
+        elif role == ROLE_LISTENER:
+            await self.registry.hset(self._listeners_key(room_id), client_id, json.dumps({**member, "lang": target_lang}))
+        await self.registry.hset("rooms", room_id, "1")
+
+        room = self.rooms.setdefault(room_id, Room(room_id))
+        if role == ROLE_SPEAKER:
+            room.speaker_id = client_id
+        else:
+            listener = RoomListener(client_id, target_lang, send, self.max_listener_queue)
+            listener.start()
+            room.listeners[client_id] = listener
+        self._membership[client_id] = room_id
+        logger.info(f"Client {client_id} joined room {room_id} as {role}")
+        return room
+
+    async def leave(self, client_id: str):
+        room_id = self._membership.pop(client_id, None)
+        room = self.rooms.get(room_id) if room_id is not None else None
+        if room is None:
+            return
+        if room.speaker_id == client_id:
+            room.speaker_id = None
+        listener = room.listeners.pop(client_id, None)
+        if listener is not None:
+            await listener.close()
+        if room.is_empty:
+            del self.rooms[room_id]
+
+        try:
+            # client อาจเข้าห้องเดิมใหม่ผ่านอีก worker แล้ว ลบเฉพาะรายการที่ยังเป็นของ worker นี้
+            if listener is not None:
+                current = (await self.registry.hgetall(self._listeners_key(room_id))).get(client_id)
+                if current is not None and json.loads(current).get("worker") == self.sessions.worker_id:
+                    await self.registry.hdel(self._listeners_key(room_id), client_id)
+            else:
+                speaker = await self.registry.get_json(self._speaker_key(room_id))
+                if speaker is not None and (speaker["client_id"], speaker["worker"]) == (client_id, self.sessions.worker_id):
+                    await self.registry.delete(self._speaker_key(room_id))
+            if await self._current_speaker(room_id) is None and not await self._listeners(room_id):
+                await self.registry.hdel("rooms", room_id)
+        except Exception as e:
+            logger.error(f"Error removing {client_id} from room {room_id} in registry: {str(e)}")
+        logger.info(f"Client {client_id} left room {room_id}")
+
+    async def set_target_lang(self, client_id: str, target_lang: str):
+        room = self.room_of(client_id)
+        if room is not None and client_id in room.listeners:
+            room.listeners[client_id].target_lang = target_lang
+            await self.registry.hset(self._listeners_key(room.room_id), client_id, json.dumps({
+                "client_id": client_id,
+                "worker": self.sessions.worker_id,
+                "lang": target_lang,
+            }))
+
+    async def broadcast(
+        self, room: Room, text: str, source_lang: str, extra_targets: Iterable[str] = ()
+    ) -> Dict[str, Optional[str]]:
+        """แปลข้อความของผู้พูดเป็นทุกภาษาที่ผู้ฟัง (ทุก worker) ต้องการพร้อมกัน แล้วส่งผ่าน pub/sub
+        คืนผลแปลตามภาษา (รวม extra_targets เช่นภาษาที่ผู้พูดเลือกไว้เอง)"""
+        room.seq += 1
+        seq = room.seq
+        try:
+            listeners = await self._listeners(room.room_id)
+        except Exception as e:
+            logger.error(f"Error reading listeners of room {room.room_id}: {str(e)}")
+            listeners = {}
+        targets = sorted({info["lang"] for info in listeners.values()} | set(extra_targets))
+
+        async def translate_for(target_lang: str) -> Optional[str]:
+            translated = await self.translate(text, source_lang, target_lang)
+            self.translations += 1
+            message = {
+                "room": room.room_id,
+                "speaker": room.speaker_id,
+                "seq": seq,
+                "text": text,
+                "translated_text": translated or "การแปลล้มเหลว",
+                "source_lang": source_lang,
+                "target_lang": target_lang
+            }
+            # ส่งทันทีที่ภาษานี้แปลเสร็จ ไม่ต้องรอภาษาอื่น
+            try:
+                await self.registry.publish(ROOMS_CHANNEL, json.dumps(message, ensure_ascii=False))
+            except Exception as e:
+                logger.error(f"Error publishing room message for {room.room_id}: {str(e)}")
+            return translated
+
+        results = await asyncio.gather(*(translate_for(target) for target in targets))
+        self.broadcasts += 1
+        return dict(zip(targets, results))
+
+    def _deliver(self, payload: str):
+        """รับผลแปลจาก pub/sub แล้วใส่คิวของผู้ฟังใน worker นี้ที่เลือกภาษานั้น"""
+        message = json.loads(payload)
+        room = self.rooms.get(message["room"])
+        if room is None:
+            return
+        for listener in list(room.listeners.values()):
+            if listener.target_lang == message["target_lang"]:
+                listener.offer(message)
+
+    async def close(self):
+        for client_id in list(self._membership):
+            await self.leave(client_id)
+        self.rooms.clear()
+        self._membership.clear()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(listener.queue.qsize() for room in self.rooms.values() for listener in room.listeners.values())
+
+    async def stats(self) -> dict:
+        """ห้องทั้งหมดจากทุก worker พร้อมสถิติคิวของสมาชิกที่อยู่ใน worker นี้"""
+        rooms = {}
+        try:
+            for room_id in await self.registry.hgetall("rooms"):
+                listeners = await self._listeners(room_id)
+                languages: Dict[str, int] = {}
+                for info in listeners.values():
+                    languages[info["lang"]] = languages.get(info["lang"], 0) + 1
+                rooms[room_id] = {
+                    "speaker": await self._current_speaker(room_id),
+                    "listeners": len(listeners),
+                    "languages": languages,
+                }
+                if room_id in self.rooms:
+                    rooms[room_id]["local"] = self.rooms[room_id].stats()
+        except Exception as e:
+            logger.error(f"Error reading rooms from registry: {str(e)}")
+            rooms = {room_id: {"local": room.stats()} for room_id, room in self.rooms.items()}
+        return {
+            "rooms": rooms,
+            "broadcasts": self.broadcasts,
+            "translations": self.translations,
+        }
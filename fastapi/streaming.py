@@ -0,0 +1,188 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+from vad import VoiceActivityDetector, decode_to_pcm, encode_wav
+
+logger = logging.getLogger(__name__)
+
+TranscribeFunc = Callable[[bytes, str], Awaitable[Optional[dict]]]
+TranslateFunc = Callable[[str, str, str], Awaitable[Optional[str]]]
+
+
+class Segment:
+    """ช่วงข้อความหนึ่งช่วงจากผลของ Whisper (เวลาเทียบกับต้น buffer)"""
+
+    def __init__(self, start: float, end: float, text: str):
+        self.start = start
+        self.end = end
+        self.text = text.strip()
+
+    @property
+    def key(self) -> str:
+        return " ".join(self.text.split()).casefold()
+
+
+def parse_segments(result: dict, buffer_duration: float) -> List[Segment]:
+    """ดึง segments จาก JSON ของ Whisper (ถ้าไม่มีให้ถือว่าทั้ง buffer เป็น segment เดียว)"""
+    segments = [
+        Segment(float(seg.get("start", 0.0)), float(seg.get("end", buffer_duration)), seg.get("text", ""))
+        for seg in result.get("segments") or []
+    ]
+    segments = [seg for seg in segments if seg.text]
+    if not segments and result.get("text", "").strip():
+        segments = [Segment(0.0, buffer_duration, result["text"])]
+    return segments
+
+
+class StreamingTranscriber:
+    """ถอดเสียงแบบต่อเนื่องของ client หนึ่งราย: เก็บ PCM ที่ยังไม่ยืนยันไว้ใน buffer แล้วถอดเสียงทั้ง buffer
+    ทุกครั้งที่มีเสียงใหม่ segment ที่ได้ผลตรงกันสองรอบติดกันจะถูกยืนยัน (final) และตัดออกจาก buffer"""
+
+    def __init__(
+        self,
+        transcribe: TranscribeFunc,
+        translate: TranslateFunc,
+        detector: Optional[VoiceActivityDetector] = None,
+        sample_rate: int = 16000,
+        stable_margin: float = 1.0,
+        max_buffer_seconds: float = 20.0,
+    ):
+        self.transcribe = transcribe
+        self.translate = translate
+        self.detector = detector
+        self.sample_rate = sample_rate
+        self.stable_margin = stable_margin
+        self.max_buffer_seconds = max_buffer_seconds
+        self.buffer = np.zeros(0, dtype=np.int16)
+        self.source_lang: Optional[str] = None
+        self.next_segment_id = 0
+        self._previous: List[str] = []
+        self._pending: List[Segment] = []
+        # จำนวน sample ต้น buffer ที่ถอดเสียงสำเร็จแล้ว (ข้อความอยู่ใน _pending)
+        self._transcribed_samples = 0
+        self.dropped_seconds = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def buffer_duration(self) -> float:
+        return len(self.buffer) / self.sample_rate
+
+    async def process(self, audio_data: bytes, source_lang: str, target_lang: str) -> dict:
+        """รับ chunk ใหม่ แล้วคืนข้อความที่ยืนยันแล้ว (ถ้ามี) และข้อความชั่วคราวล่าสุด"""
+        async with self._lock:
+            pcm = await decode_to_pcm(audio_data, self.sample_rate)
+            if pcm is None:
+                return {
+                    "error": "ไม่สามารถถอดรหัสเสียงได้",
+                    "source_lang": source_lang,
+                    "target_lang": target_lang
+                }
+
+            finalized: List[Segment] = []
+            if self.source_lang is not None and source_lang != self.source_lang:
+                # เปลี่ยนภาษาต้นทาง: ยืนยันของเดิมทั้งหมดแล้วเริ่ม buffer ใหม่
+                finalized.extend(self._finalize_all())
+            self.source_lang = source_lang
+
+            has_speech = True
+            if self.detector is not None:
+                has_speech = (await asyncio.to_thread(self.detector.analyze, pcm)).has_speech
+
+            if not has_speech:
+                # ช่วงเงียบถือเป็นจุดจบประโยค ยืนยันข้อความที่ค้างอยู่ทั้งหมด
+                finalized.extend(self._finalize_all())
+            else:
+                self.buffer = np.concatenate([self.buffer, pcm])
+                finalized.extend(await self._update(source_lang))
+
+            final = await self._build_final(finalized, source_lang, target_lang)
+            return {
+                "streaming": True,
+                "final": final,
+                "partial_text": " ".join(seg.text for seg in self._pending),
+                "buffer_seconds": round(self.buffer_duration, 2),
+                "source_lang": source_lang,
+                "target_lang": target_lang
+            }
+
+    async def _update(self, source_lang: str) -> List[Segment]:
+        duration = self.buffer_duration
+        result = await self.transcribe(encode_wav(self.buffer, self.sample_rate), source_lang)
+        if result is None:
+            if duration > self.max_buffer_seconds:
+                return self._enforce_cap()
+            return []
+        segments = parse_segments(result, duration)
+
+        # segment ที่ตรงกับรอบก่อน ไม่ใช่ segment สุดท้าย และจบก่อนท้าย buffer พอสมควร ถือว่านิ่งแล้ว
+        stable = 0
+        while (
+            stable < len(segments) - 1
+            and stable < len(self._previous)
+            and segments[stable].key == self._previous[stable]
+            and segments[stable].end <= duration - self.stable_margin
+        ):
+            stable += 1
+
+        # buffer ยาวเกินกำหนด: บังคับยืนยันทุก segment ยกเว้นตัวสุดท้าย
+        if duration > self.max_buffer_seconds:
+            stable = max(stable, len(segments) - 1)
+
+        finalized = segments[:stable]
+        self._pending = segments[stable:]
+        self._previous = [seg.key for seg in self._pending]
+
+        if finalized:
+            cut = int(finalized[-1].end * self.sample_rate)
+            self.buffer = self.buffer[cut:]
+        elif duration > self.max_buffer_seconds:
+            finalized = self._finalize_all()
+        self._transcribed_samples = len(self.buffer)
+        return finalized
+
+    def _enforce_cap(self) -> List[Segment]:
+        """ถอดเสียงไม่สำเร็จ (เช่น Whisper ไม่ว่าง) แต่ buffer ยาวเกินกำหนด: ยืนยันข้อความที่ได้จากรอบก่อน
+        แล้วเก็บไว้เฉพาะเสียงที่ยังไม่เคยถอดไม่เกิน max_buffer_seconds ไม่ให้ buffer และ WAV ที่ส่งซ้ำโตไม่จำกัด"""
+        untranscribed = self.buffer[self._transcribed_samples:]
+        max_samples = int(self.max_buffer_seconds * self.sample_rate)
+        if len(untranscribed) > max_samples:
+            dropped = len(untranscribed) - max_samples
+            self.dropped_seconds += dropped / self.sample_rate
+            logger.warning(f"Streaming buffer over {self.max_buffer_seconds}s while Whisper is unavailable, "
+                           f"dropped {dropped / self.sample_rate:.1f}s of audio")
+            untranscribed = untranscribed[dropped:]
+        finalized = self._finalize_all()
+        self.buffer = untranscribed
+        return finalized
+
+    def _finalize_all(self) -> List[Segment]:
+        finalized = self._pending
+        self._pending = []
+        self._previous = []
+        self._transcribed_samples = 0
+        self.buffer = np.zeros(0, dtype=np.int16)
+        return finalized
+
+    async def _build_final(self, segments: List[Segment], source_lang: str, target_lang: str) -> Optional[dict]:
+        text = " ".join(seg.text for seg in segments).strip()
+        if not text:
+            return None
+        segment_id = self.next_segment_id
+        self.next_segment_id += 1
+        # แปลเฉพาะข้อความที่เพิ่งยืนยัน
+        translated_text = await self.translate(text, source_lang, target_lang)
+        return {
+            "segment_id": segment_id,
+            "text": text,
+            "translated_text": translated_text if translated_text else "การแปลล้มเหลว"
+        }
+
+    async def flush(self, target_lang: str) -> Optional[dict]:
+        """ยืนยันข้อความที่ค้างอยู่ทั้งหมด (เช่น ตอนปิดโหมด streaming)"""
+        async with self._lock:
+            if self.source_lang is None:
+                return None
+            return await self._build_final(self._finalize_all(), self.source_lang, target_lang)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# โมดูลของแอปถูก import แบบ top-level (เหมือนตอนรันใน container ด้วย WORKDIR เป็นโฟลเดอร์นี้)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+
+from batch_jobs import BatchJob, BatchJobManager, BatchSegment, split_at_silence
+from registry import MemoryRegistry
+
+SAMPLE_RATE = 16000
+
+
+def tone(seconds, amplitude=8000, frequency=220.0):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.int16)
+
+
+def test_split_at_silence_cuts_inside_the_pause():
+    pcm = np.concatenate([tone(13.0), silence(1.0), tone(12.0)])
+    boundaries = split_at_silence(pcm, SAMPLE_RATE, min_seconds=10.0, max_seconds=20.0)
+    assert len(boundaries) == 2
+    (first_start, cut), (second_start, end) = boundaries
+    assert (first_start, second_start, end) == (0, cut, len(pcm))
+    # ตัดตรงกลางช่วงเงียบ ไม่ใช่ตรงขอบ
+    assert 13.2 * SAMPLE_RATE <= cut <= 13.8 * SAMPLE_RATE
+
+
+def test_split_at_silence_respects_max_length_and_short_input():
+    pcm = tone(65.0)
+    boundaries = split_at_silence(pcm, SAMPLE_RATE, min_seconds=10.0, max_seconds=30.0)
+    assert boundaries[0][0] == 0 and boundaries[-1][1] == len(pcm)
+    assert all(end - start <= 30 * SAMPLE_RATE for start, end in boundaries)
+    assert all(a[1] == b[0] for a, b in zip(boundaries, boundaries[1:]))
+
+    assert split_at_silence(tone(5.0), SAMPLE_RATE) == [(0, 5 * SAMPLE_RATE)]
+    assert split_at_silence(np.zeros(0, dtype=np.int16), SAMPLE_RATE) == []
+
+
+def create_job(base_dir, job_id="0" * 32, segments=2, seconds=1.0):
+    directory = os.path.join(base_dir, job_id)
+    os.makedirs(directory)
+    length = int(seconds * SAMPLE_RATE)
+    job = BatchJob(
+        job_id, directory, "th", "en", SAMPLE_RATE, segments * seconds,
+        [BatchSegment(i, i * length, (i + 1) * length) for i in range(segments)],
+    )
+    tone(segments * seconds).tofile(job.pcm_path)
+    job.save()
+    return job
+
+
+def test_load_skips_truncated_last_line(tmp_path):
+    job = create_job(str(tmp_path))
+    with open(job.results_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"type": "segment", "index": 0, "text": "หนึ่ง"}) + "\n")
+        # process ถูกหยุดระหว่างเขียนบรรทัดที่สอง
+        f.write('{"type": "segment", "index": 1, "te')
+
+    loaded = BatchJob.load(job.directory)
+    assert list(loaded.results) == [0]
+    assert [segment.index for segment in loaded.pending] == [1]
+
+
+class FakeBackend:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.transcribed = []
+
+    async def transcribe(self, wav_data, source_lang, client_id):
+        self.transcribed.append(client_id)
+        await asyncio.sleep(self.delay)
+        return {"text": f"ข้อความ {len(self.transcribed)}"}
+
+    async def translate(self, text, source_lang, target_lang):
+        return f"translated {text}"
+
+
+async def collect(manager, job):
+    return [json.loads(line) async for line in manager.stream(job)]
+
+
+def test_resume_skips_completed_segments(tmp_path):
+    job = create_job(str(tmp_path), segments=3)
+    job.append_result({"type": "segment", "job_id": job.job_id, "index": 0, "text": "เดิม", "translated_text": "old"})
+
+    async def run():
+        backend = FakeBackend()
+        manager = BatchJobManager(str(tmp_path), backend.transcribe, backend.translate)
+        loaded = manager.get(job.job_id)
+        messages = await collect(manager, loaded)
+        return backend, messages
+
+    backend, messages = asyncio.run(run())
+    assert len(backend.transcribed) == 2
+    assert messages[0]["type"] == "job" and messages[0]["completed"] == 1
+    assert messages[1]["text"] == "เดิม"
+    assert sorted(m["index"] for m in messages[2:-1]) == [1, 2]
+    assert messages[-1] == {"type": "done", "job_id": job.job_id, "segments": 3, "completed": 3, "failed": 0}
+    assert sorted(BatchJob.load(job.directory).results) == [0, 1, 2]
+
+
+def test_only_the_lease_holder_runs_a_job(tmp_path):
+    job = create_job(str(tmp_path), segments=3)
+
+    async def run():
+        registry = MemoryRegistry()
+        backend_a, backend_b = FakeBackend(delay=0.05), FakeBackend()
+        manager_a = BatchJobManager(str(tmp_path), backend_a.transcribe, backend_a.translate,
+                                    max_concurrency=1, registry=registry, worker_id="a", poll_interval=0.01)
+        manager_b = BatchJobManager(str(tmp_path), backend_b.transcribe, backend_b.translate,
+                                    registry=registry, worker_id="b", poll_interval=0.01)
+        first = asyncio.create_task(collect(manager_a, manager_a.get(job.job_id)))
+        await asyncio.sleep(0.01)
+        # client ต่อใหม่ผ่านอีก worker ระหว่างที่งานยังรันอยู่: ส่งผลจากไฟล์ ไม่ถอดเสียงซ้ำ
+        followed = await collect(manager_b, manager_b.get(job.job_id))
+        await first
+        assert await registry.get("batch:" + job.job_id) is None
+        return backend_a, backend_b, followed
+
+    backend_a, backend_b, followed = asyncio.run(run())
+    assert len(backend_a.transcribed) == 3
+    assert backend_b.transcribed == []
+    assert sorted(m["index"] for m in followed if m["type"] == "segment") == [0, 1, 2]
+    assert followed[-1]["completed"] == 3
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    job = create_job(str(tmp_path), segments=2)
+    job.append_result({"type": "segment", "job_id": job.job_id, "index": 0, "text": "เดิม", "translated_text": "old"})
+
+    async def run():
+        registry = MemoryRegistry()
+        # worker ที่ถือ lease หยุดไปโดยไม่ได้คืน lease
+        await registry.set("batch:" + job.job_id, "stopped-worker", ttl=0.05)
+        backend = FakeBackend()
+        manager = BatchJobManager(str(tmp_path), backend.transcribe, backend.translate,
+                                  registry=registry, worker_id="b", poll_interval=0.01)
+        messages = await collect(manager, manager.get(job.job_id))
+        return backend, messages
+
+    backend, messages = asyncio.run(run())
+    assert len(backend.transcribed) == 1
+    assert [m["index"] for m in messages if m["type"] == "segment"] == [0, 1]
+    assert messages[-1]["completed"] == 2
@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from starlette.websockets import WebSocketState
+
+from connections import CLOSE_GOING_AWAY, ConnectionManager
+from ws_pipeline import ClientPipeline
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.client_state = WebSocketState.CONNECTED
+        self.sent = []
+        self.closed_with = None
+        self.fail = False
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        if self.fail:
+            raise ConnectionError("socket closed")
+        self.sent.append(message)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+        self.client_state = WebSocketState.DISCONNECTED
+
+
+async def connect(manager, client_id="c1"):
+    websocket = FakeWebSocket()
+    connection = await manager.connect(client_id, websocket)
+
+    async def process(audio_data, source_lang, target_lang, on_transcript):
+        return None
+
+    connection.pipeline = ClientPipeline(client_id, process, websocket.send_json)
+    return connection, websocket
+
+
+def pings(websocket):
+    return [message for message in websocket.sent if message.get("type") == "ping"]
+
+
+def test_slow_send_queue_does_not_evict_healthy_client():
+    async def run():
+        manager = ConnectionManager(heartbeat_interval=0.05, heartbeat_timeout=0.2)
+        connection, websocket = await connect(manager)
+        manager.pong(connection)
+
+        # pipeline กำลังส่งผลลัพธ์ก้อนใหญ่นานกว่า heartbeat_interval
+        async with connection.pipeline._send_lock:
+            await manager._check(connection)
+            await asyncio.sleep(0.15)
+            await manager._check(connection)
+            assert manager.connections == {"c1": connection}
+            assert connection.ping_sent_at is None
+            assert pings(websocket) == []
+
+        await asyncio.wait_for(connection.ping_task, 1)
+        assert len(pings(websocket)) == 1
+        assert connection.ping_sent_at is not None
+        assert manager.evicted_dead == 0
+        await manager.close()
+
+    asyncio.run(run())
+
+
+def test_missed_pong_evicts_client():
+    async def run():
+        manager = ConnectionManager(heartbeat_interval=0.05, heartbeat_timeout=0.1)
+        connection, websocket = await connect(manager)
+        manager.pong(connection)
+
+        await manager._check(connection)
+        await asyncio.wait_for(connection.ping_task, 1)
+        # ตอบ pong ทันเวลา: นับรอบใหม่
+        manager.pong(connection)
+        await manager._check(connection)
+        await asyncio.wait_for(connection.ping_task, 1)
+        connection.ping_sent_at = time.monotonic() - 0.2
+        await manager._check(connection)
+        assert manager.evicted_dead == 1
+        assert websocket.closed_with == CLOSE_GOING_AWAY
+        assert "c1" not in manager.connections
+
+    asyncio.run(run())
+
+
+def test_failed_ping_evicts_dead_socket():
+    async def run():
+        manager = ConnectionManager(heartbeat_interval=0.05, heartbeat_timeout=1.0)
+        connection, websocket = await connect(manager)
+        websocket.fail = True
+
+        await manager._check(connection)
+        await asyncio.wait_for(connection.ping_task, 1)
+        assert manager.evicted_dead == 1
+        assert websocket.closed_with == CLOSE_GOING_AWAY
+
+    asyncio.run(run())
+
+
+def test_disconnect_cancels_pending_ping():
+    async def run():
+        manager = ConnectionManager(heartbeat_interval=0.05, heartbeat_timeout=1.0)
+        connection, websocket = await connect(manager)
+
+        async with connection.pipeline._send_lock:
+            await manager._check(connection)
+            manager.disconnect(connection)
+            await asyncio.gather(connection.ping_task, return_exceptions=True)
+        assert connection.ping_task.cancelled()
+        assert pings(websocket) == []
+        assert manager.evicted_dead == 0
+
+    asyncio.run(run())
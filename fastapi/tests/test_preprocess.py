@@ -0,0 +1,65 @@
+import asyncio
+import tempfile
+
+import numpy as np
+
+import preprocess
+from preprocess import SAMPLE_RATE, AudioPreprocessor
+
+
+def tone(seconds: float, amplitude: float = 0.05) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * 440 * t) * amplitude * 32767).astype(np.int16)
+
+
+def test_pool_uses_spawn_context():
+    preprocessor = AudioPreprocessor(output_format="wav", workers=1)
+    try:
+        assert preprocessor._pool()._mp_context.get_start_method() == "spawn"
+    finally:
+        preprocessor.close()
+
+
+def test_wav_output_is_normalized_in_pool():
+    preprocessor = AudioPreprocessor(output_format="wav", workers=1)
+    pcm = np.concatenate([np.zeros(SAMPLE_RATE, dtype=np.int16), tone(1.0)])
+
+    async def run():
+        return await preprocessor.process(b"x" * 1000, pcm)
+
+    try:
+        result = asyncio.run(run())
+    finally:
+        preprocessor.close()
+    assert result is not None
+    assert result.audio_data[:4] == b"RIFF"
+    assert result.bytes_in == 1000
+    # ช่วงเงียบด้านหน้าถูกตัดเหลือแค่ padding
+    assert result.output_duration < result.duration - 0.5
+
+
+def test_file_upload_is_streamed_without_rollover(monkeypatch):
+    preprocessor = AudioPreprocessor(output_format="wav", workers=1)
+    decoded = []
+
+    async def fake_decode(audio_file, sample_rate=SAMPLE_RATE):
+        decoded.append(audio_file)
+        return tone(0.5)
+
+    monkeypatch.setattr(preprocess, "decode_stream_to_pcm", fake_decode)
+    upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    upload.write(b"y" * 4096)
+    upload.seek(0)
+
+    async def run():
+        return await preprocessor.process(upload)
+
+    try:
+        result = asyncio.run(run())
+    finally:
+        preprocessor.close()
+    assert decoded == [upload]
+    assert result is not None and result.bytes_in == 4096
+    # ขนาดไฟล์อ่านด้วย seek ไม่ใช่ fileno() ไฟล์เล็กจึงยังอยู่ในหน่วยความจำ
+    assert not upload._rolled
+    assert upload.tell() == 0
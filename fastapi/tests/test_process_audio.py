@@ -0,0 +1,48 @@
+import asyncio
+
+import main
+from transcription_cache import TranscriptionCache
+from vad import FilterResult
+
+
+class SilentDetector:
+    sample_rate = 16000
+
+    def __init__(self):
+        self.calls = 0
+
+    async def filter(self, audio_data):
+        self.calls += 1
+        # ให้ request ที่สองเข้ามารอผลของ request แรก
+        await asyncio.sleep(0.01)
+        return FilterResult(True, audio_data, duration=1.5)
+
+
+def test_concurrent_silent_chunks_share_silence_result(monkeypatch):
+    detector = SilentDetector()
+    cache = TranscriptionCache()
+    requests = []
+
+    async def request_transcription(*args):
+        requests.append(args)
+
+    monkeypatch.setattr(main, "voice_detector", detector)
+    monkeypatch.setattr(main, "audio_preprocessor", None)
+    monkeypatch.setattr(main, "transcription_cache", cache)
+    monkeypatch.setattr(main, "request_transcription", request_transcription)
+
+    async def run():
+        return await asyncio.gather(
+            main.process_audio_and_translate(b"silent", "th", "en", client_id="a"),
+            main.process_audio_and_translate(b"silent", "th", "en", client_id="b"),
+        )
+
+    results = asyncio.run(run())
+    for result in results:
+        assert result["silence"] is True
+        assert result["duration"] == 1.5
+    assert detector.calls == 1
+    assert cache.coalesced == 1
+    assert requests == []
+    # ผลว่าไม่มีเสียงพูดไม่ถูกเก็บลง cache
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+from registry import RedisRegistry, RegistryError, SessionRegistry
+
+# Redis จำลองตัวเดียวกับที่ใช้ทดสอบโหลด
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "benchmark"))
+from stub_servers import StubRedis  # noqa: E402
+
+
+class StubRedisServer:
+    """เปิด/ปิด StubRedis บน port เดิมได้ (จำลอง Redis restart) โดยข้อมูลเดิมหายไปเหมือน Redis ที่ไม่มี persistence"""
+
+    def __init__(self):
+        self.port = 0
+        self.stub = StubRedis()
+        self._server = None
+        self._writers = set()
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            await self.stub.handle(reader, writer)
+        finally:
+            self._writers.discard(writer)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        self.stub = StubRedis()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+
+async def wait_until(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+def run_with_stub(test):
+    async def run():
+        server = StubRedisServer()
+        await server.start()
+        try:
+            await test(server)
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_key_value_and_hash_commands():
+    async def test(server):
+        registry = RedisRegistry(server.url, prefix="t:")
+        try:
+            assert await registry.get("missing") is None
+            # ข้อความหลายไบต์: ความยาวใน RESP ต้องนับเป็น byte ไม่ใช่ตัวอักษร
+            assert await registry.set("greeting", "สวัสดี\r\nครับ") is True
+            assert await registry.get("greeting") == "สวัสดี\r\nครับ"
+            assert b"t:greeting" in server.stub.values
+
+            assert await registry.set("greeting", "other", nx=True) is False
+            assert await registry.set("lock", "1", ttl=0.05, nx=True) is True
+            await asyncio.sleep(0.1)
+            assert await registry.get("lock") is None
+
+            await registry.set_json("settings", {"lang": "th", "n": 1})
+            assert await registry.get_json("settings") == {"lang": "th", "n": 1}
+            await registry.delete("greeting", "settings")
+            assert await registry.get("greeting") is None
+
+            await registry.hset("h", "a", "1")
+            await registry.hset("h", "b", "2")
+            assert await registry.hgetall("h") == {"a": "1", "b": "2"}
+            await registry.hdel("h", "a")
+            assert await registry.hgetall("h") == {"b": "2"}
+            assert await registry.hgetall("empty") == {}
+
+            with pytest.raises(RegistryError):
+                await registry.execute("NOPE")
+            # การเชื่อมต่อที่ได้ error reply ยังใช้ต่อได้
+            assert await registry.get("missing") is None
+            assert registry.stats()["connections_idle"] == 1
+        finally:
+            await registry.close()
+
+    run_with_stub(test)
+
+
+def test_pool_reconnects_after_restart():
+    async def test(server):
+        registry = RedisRegistry(server.url)
+        try:
+            await registry.set("k", "v")
+            await server.stop()
+            await server.start()
+            # การเชื่อมต่อเดิมใน pool หลุด: ลองใหม่ด้วยการเชื่อมต่อใหม่เองหนึ่งครั้ง
+            assert await registry.get("k") is None
+            assert registry.reconnects == 1
+            await registry.set("k", "v2")
+            assert await registry.get("k") == "v2"
+        finally:
+            await registry.close()
+
+    run_with_stub(test)
+
+
+def test_pubsub_resubscribes_after_restart():
+    async def test(server):
+        publisher = RedisRegistry(server.url)
+        subscriber = RedisRegistry(server.url)
+        received = []
+        subscriber.subscribe("events", received.append)
+        await subscriber.start()
+        try:
+            await wait_until(lambda: server.stub.channels.get(b"stt:events"))
+            await publisher.publish("events", "one")
+            await wait_until(lambda: received == ["one"])
+
+            await server.stop()
+            await server.start()
+            # subscriber ต่อใหม่และ SUBSCRIBE ทุก channel เดิมอีกครั้ง
+            await wait_until(lambda: server.stub.channels.get(b"stt:events"))
+            await publisher.publish("events", "two")
+            await wait_until(lambda: received == ["one", "two"])
+
+            # channel ที่ลงทะเบียนหลังเชื่อมต่อแล้วก็ได้รับข้อความ
+            later = []
+            subscriber.subscribe("later", later.append)
+            await wait_until(lambda: server.stub.channels.get(b"stt:later"))
+            await publisher.publish("later", "three")
+            await wait_until(lambda: later == ["three"])
+        finally:
+            await subscriber.close()
+            await publisher.close()
+
+    run_with_stub(test)
+
+
+def test_session_registry_removes_sessions_of_stopped_workers():
+    async def test(server):
+        registry_a = RedisRegistry(server.url)
+        registry_b = RedisRegistry(server.url)
+        worker_a = SessionRegistry(registry_a, "a", heartbeat_interval=0.05)
+        worker_b = SessionRegistry(registry_b, "b", heartbeat_interval=0.05)
+        try:
+            await worker_a.register("client-a")
+            await worker_b.register("client-b")
+            worker_a.start()
+            worker_b.start()
+            await asyncio.sleep(0.1)
+            assert set(await registry_a.hgetall("sessions")) == {"client-a", "client-b"}
+
+            # worker b หยุดไปโดยไม่ได้ลบ session (เช่น process ถูก kill) heartbeat หมดอายุหลัง 3 รอบ
+            worker_b._task.cancel()
+            await asyncio.gather(worker_b._task, return_exceptions=True)
+            worker_b._task = None
+
+            async def sessions():
+                return set(await registry_a.hgetall("sessions"))
+
+            for _ in range(100):
+                if await sessions() == {"client-a"}:
+                    break
+                await asyncio.sleep(0.02)
+            assert await sessions() == {"client-a"}
+            stats = await worker_a.stats()
+            assert stats["sessions_by_worker"] == {"a": 1}
+        finally:
+            await worker_a.stop()
+            await registry_a.close()
+            await registry_b.close()
+
+    run_with_stub(test)
+
+
+def test_unregister_keeps_session_taken_over_by_another_worker():
+    async def test(server):
+        registry = RedisRegistry(server.url)
+        worker_a = SessionRegistry(registry, "a")
+        worker_b = SessionRegistry(registry, "b")
+        try:
+            await worker_a.register("client")
+            # client reconnect ไปที่ worker b ก่อนที่ worker a จะรู้ว่าการเชื่อมต่อเดิมหลุด
+            await worker_b.register("client")
+            await worker_a.unregister("client")
+            sessions = await registry.hgetall("sessions")
+            assert json.loads(sessions["client"])["worker"] == "b"
+
+            await worker_b.unregister("client")
+            assert await registry.hgetall("sessions") == {}
+        finally:
+            await registry.close()
+
+    run_with_stub(test)
+
+
+def test_cancelled_command_does_not_return_connection_to_pool():
+    async def run():
+        closed = asyncio.Event()
+
+        async def silent(reader, writer):
+            # รับคำสั่งแต่ไม่ตอบ จนกว่า client จะปิดการเชื่อมต่อ
+            await reader.read()
+            closed.set()
+            writer.close()
+
+        server = await asyncio.start_server(silent, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        registry = RedisRegistry(f"redis://127.0.0.1:{port}/0")
+        connections = []
+        connect = registry._connect
+
+        async def tracked_connect():
+            # เก็บการเชื่อมต่อไว้ ไม่ให้ถูกปิดเองตอน garbage collect
+            connections.append(await connect())
+            return connections[-1]
+
+        registry._connect = tracked_connect
+        try:
+            task = asyncio.create_task(registry.get("k"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await asyncio.wait_for(closed.wait(), 1)
+            assert connections[0].writer.is_closing()
+            assert registry.stats()["connections_idle"] == 0
+        finally:
+            await registry.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
@@ -0,0 +1,156 @@
+import asyncio
+import json
+
+import pytest
+
+from registry import MemoryRegistry, SessionRegistry
+from rooms import ROLE_LISTENER, ROLE_SPEAKER, RoomManager
+
+
+class FakeTranslator:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, text, source_lang, target_lang):
+        self.calls.append((text, source_lang, target_lang))
+        return f"{target_lang}:{text}"
+
+
+def collector():
+    received = []
+
+    async def send(message):
+        received.append(message)
+
+    return received, send
+
+
+def create_manager(registry=None, worker_id="w1", **kwargs):
+    translator = FakeTranslator()
+    sessions = SessionRegistry(registry or MemoryRegistry(), worker_id)
+    return RoomManager(translator, sessions, **kwargs), translator
+
+
+async def drain(manager):
+    for _ in range(100):
+        if manager.queue_depth == 0:
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)
+
+
+def test_broadcast_translates_once_per_language_and_delivers_by_language():
+    async def run():
+        manager, translator = create_manager()
+        english_a, send_english_a = collector()
+        english_b, send_english_b = collector()
+        japanese, send_japanese = collector()
+        try:
+            room = await manager.join("r1", "speaker", ROLE_SPEAKER, "en", collector()[1])
+            await manager.join("r1", "en-a", ROLE_LISTENER, "en", send_english_a)
+            await manager.join("r1", "en-b", ROLE_LISTENER, "en", send_english_b)
+            await manager.join("r1", "ja", ROLE_LISTENER, "ja", send_japanese)
+
+            results = await manager.broadcast(room, "สวัสดี", "th", extra_targets=["en"])
+            await drain(manager)
+        finally:
+            await manager.close()
+
+        assert results == {"en": "en:สวัสดี", "ja": "ja:สวัสดี"}
+        # ผู้ฟังภาษาเดียวกันสองคนและภาษาของผู้พูดเองใช้คำแปลครั้งเดียวกัน
+        assert sorted(call[2] for call in translator.calls) == ["en", "ja"]
+        assert [m["translated_text"] for m in english_a] == ["en:สวัสดี"]
+        assert [m["translated_text"] for m in english_b] == ["en:สวัสดี"]
+        assert [m["translated_text"] for m in japanese] == ["ja:สวัสดี"]
+        assert japanese[0]["text"] == "สวัสดี" and japanese[0]["seq"] == 1
+
+    asyncio.run(run())
+
+
+def test_slow_listener_drops_oldest_without_blocking_others():
+    async def run():
+        manager, _ = create_manager(max_listener_queue=2)
+        release = asyncio.Event()
+        slow = []
+
+        async def send_slow(message):
+            slow.append(message["seq"])
+            await release.wait()
+
+        fast, send_fast = collector()
+        try:
+            room = await manager.join("r1", "speaker", ROLE_SPEAKER, "th", collector()[1])
+            await manager.join("r1", "slow", ROLE_LISTENER, "en", send_slow)
+            await manager.join("r1", "fast", ROLE_LISTENER, "en", send_fast)
+
+            await manager.broadcast(room, "หนึ่ง", "th")
+            # ให้ผู้ฟังที่ช้าหยิบข้อความแรกไปแล้วค้างอยู่ที่การส่ง
+            await asyncio.sleep(0.01)
+            for text in ("สอง", "สาม", "สี่", "ห้า"):
+                await manager.broadcast(room, text, "th")
+                await asyncio.sleep(0)
+            await asyncio.sleep(0.01)
+            assert [m["seq"] for m in fast] == [1, 2, 3, 4, 5]
+
+            stats = room.stats()
+            assert stats["dropped"] == 2
+            release.set()
+            await drain(manager)
+            assert slow == [1, 4, 5]
+        finally:
+            release.set()
+            await manager.close()
+
+    asyncio.run(run())
+
+
+def test_second_speaker_is_rejected():
+    async def run():
+        manager, _ = create_manager()
+        try:
+            await manager.join("r1", "first", ROLE_SPEAKER, "en", collector()[1])
+            with pytest.raises(ValueError):
+                await manager.join("r1", "second", ROLE_SPEAKER, "en", collector()[1])
+            # ผู้พูดคนเดิมเข้าซ้ำได้
+            await manager.join("r1", "first", ROLE_SPEAKER, "en", collector()[1])
+
+            await manager.leave("first")
+            room = await manager.join("r1", "second", ROLE_SPEAKER, "en", collector()[1])
+            assert room.speaker_id == "second"
+        finally:
+            await manager.close()
+
+    asyncio.run(run())
+
+
+def test_leave_keeps_membership_taken_over_by_another_worker():
+    async def run():
+        registry = MemoryRegistry()
+        manager_a, _ = create_manager(registry, "a")
+        manager_b, _ = create_manager(registry, "b")
+        # ทั้งสอง worker ยังทำงานอยู่
+        await registry.set("worker:a", "1")
+        await registry.set("worker:b", "1")
+        try:
+            await manager_a.join("r1", "speaker", ROLE_SPEAKER, "th", collector()[1])
+            await manager_a.join("r1", "listener", ROLE_LISTENER, "en", collector()[1])
+            # client ทั้งสอง reconnect ไปที่ worker b ก่อนที่ worker a จะรู้ว่าการเชื่อมต่อเดิมหลุด
+            await manager_b.join("r1", "speaker", ROLE_SPEAKER, "th", collector()[1])
+            await manager_b.join("r1", "listener", ROLE_LISTENER, "ja", collector()[1])
+
+            await manager_a.leave("speaker")
+            await manager_a.leave("listener")
+            assert await registry.get_json("room:r1:speaker") == {"client_id": "speaker", "worker": "b"}
+            listeners = await registry.hgetall("room:r1:listeners")
+            assert json.loads(listeners["listener"]) == {"client_id": "listener", "worker": "b", "lang": "ja"}
+            assert "r1" in await registry.hgetall("rooms")
+
+            await manager_b.leave("speaker")
+            await manager_b.leave("listener")
+            assert await registry.get("room:r1:speaker") is None
+            assert await registry.hgetall("rooms") == {}
+        finally:
+            await manager_a.close()
+            await manager_b.close()
+
+    asyncio.run(run())
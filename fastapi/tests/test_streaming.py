@@ -0,0 +1,75 @@
+import asyncio
+
+import numpy as np
+
+import streaming
+from streaming import StreamingTranscriber
+
+SAMPLE_RATE = 16000
+
+
+def chunk(seconds: float) -> bytes:
+    return np.full(int(seconds * SAMPLE_RATE), 1000, dtype=np.int16).tobytes()
+
+
+async def fake_decode(audio_data, sample_rate=SAMPLE_RATE):
+    return np.frombuffer(audio_data, dtype=np.int16)
+
+
+async def echo_translate(text, source_lang, target_lang):
+    return text.upper()
+
+
+def test_buffer_is_capped_while_whisper_is_unavailable(monkeypatch):
+    monkeypatch.setattr(streaming, "decode_to_pcm", fake_decode)
+    uploads = []
+    whisper_up = True
+
+    async def transcribe(wav_data, source_lang):
+        uploads.append(len(wav_data))
+        if not whisper_up:
+            return None
+        return {"segments": [{"start": 0.0, "end": 0.9, "text": "hello"}]}
+
+    async def run():
+        nonlocal whisper_up
+        session = StreamingTranscriber(transcribe, echo_translate, max_buffer_seconds=5.0)
+        result = await session.process(chunk(1.0), "en", "th")
+        assert result["partial_text"] == "hello"
+
+        whisper_up = False
+        finals = []
+        for _ in range(20):
+            result = await session.process(chunk(1.0), "en", "th")
+            assert session.buffer_duration <= 6.0
+            if result["final"]:
+                finals.append(result["final"]["text"])
+        # ข้อความที่ถอดได้ก่อน Whisper ล่มถูกยืนยัน ไม่หายไปกับเสียงที่ถูกตัด
+        assert finals == ["hello"]
+        assert session.dropped_seconds > 0
+        # ขนาด WAV ที่ส่งซ้ำไม่โตเกินขีดจำกัด
+        assert max(uploads) <= 44 + int(6.0 * SAMPLE_RATE) * 2
+
+    asyncio.run(run())
+
+
+def test_stable_segments_are_finalized_and_cut(monkeypatch):
+    monkeypatch.setattr(streaming, "decode_to_pcm", fake_decode)
+
+    async def transcribe(wav_data, source_lang):
+        return {"segments": [
+            {"start": 0.0, "end": 1.0, "text": "first"},
+            {"start": 1.0, "end": 2.5, "text": "second"},
+        ]}
+
+    async def run():
+        session = StreamingTranscriber(transcribe, echo_translate, stable_margin=0.5)
+        first = await session.process(chunk(2.5), "en", "th")
+        assert first["final"] is None
+        second = await session.process(chunk(0.5), "en", "th")
+        assert second["final"]["text"] == "first"
+        assert second["final"]["translated_text"] == "FIRST"
+        assert second["partial_text"] == "second"
+        assert abs(session.buffer_duration - 2.0) < 0.01
+
+    asyncio.run(run())
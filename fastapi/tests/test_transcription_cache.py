@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from http_client import BackendResponse
+from registry import MemoryRegistry
+from transcription_cache import TranscriptionCache
+
+
+class FakeWhisper:
+    def __init__(self, status_code=200, delay=0.02):
+        self.status_code = status_code
+        self.delay = delay
+        self.calls = 0
+
+    async def fetch(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return BackendResponse(self.status_code, f'{{"text": "call {self.calls}"}}', self.delay)
+
+
+def test_identical_in_flight_requests_call_whisper_once():
+    async def run():
+        cache = TranscriptionCache()
+        whisper = FakeWhisper()
+        responses = await asyncio.gather(*(cache.get_or_fetch(b"audio", "th", whisper.fetch) for _ in range(5)))
+        assert whisper.calls == 1
+        assert {response.text for response in responses} == {'{"text": "call 1"}'}
+        assert cache.stats()["coalesced"] == 4
+        # ครั้งต่อไปได้จาก cache
+        assert (await cache.get_or_fetch(b"audio", "th", whisper.fetch)).text == '{"text": "call 1"}'
+        assert cache.hits == 1
+        # ภาษาต่างกันเป็นคนละ key
+        await cache.get_or_fetch(b"audio", "en", whisper.fetch)
+        assert whisper.calls == 2
+        assert cache.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_failed_response_is_shared_but_not_cached():
+    async def run():
+        cache = TranscriptionCache()
+        whisper = FakeWhisper(status_code=500)
+        responses = await asyncio.gather(*(cache.get_or_fetch(b"audio", "th", whisper.fetch) for _ in range(3)))
+        assert whisper.calls == 1
+        assert all(response.status_code == 500 for response in responses)
+        await cache.get_or_fetch(b"audio", "th", whisper.fetch)
+        assert whisper.calls == 2
+
+    asyncio.run(run())
+
+
+def test_cancelled_leader_fails_followers_without_cancelling_them():
+    async def run():
+        cache = TranscriptionCache()
+        whisper = FakeWhisper(delay=1.0)
+        leader = asyncio.create_task(cache.get_or_fetch(b"audio", "th", whisper.fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_fetch(b"audio", "th", whisper.fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(RuntimeError):
+            await follower
+        assert leader.cancelled()
+        assert cache.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_eviction_by_size_and_count():
+    async def run():
+        cache = TranscriptionCache(max_entries=2, max_bytes=10_000)
+        for index in range(3):
+            await cache.get_or_fetch(bytes([index]), "th", FakeWhisper(delay=0).fetch)
+        assert cache.stats()["entries"] == 2
+        assert cache.evictions == 1
+        assert cache.stats()["bytes"] == sum(len(r.text.encode()) for r in cache._entries.values())
+
+    asyncio.run(run())
+
+
+def test_shared_registry_result_is_used_before_whisper():
+    async def run():
+        shared = MemoryRegistry()
+        first = TranscriptionCache(shared=shared)
+        second = TranscriptionCache(shared=shared)
+        whisper = FakeWhisper(delay=0)
+        await first.get_or_fetch(b"audio", "th", whisper.fetch)
+        response = await second.get_or_fetch(b"audio", "th", whisper.fetch)
+        assert whisper.calls == 1
+        assert response.status_code == 200
+        assert second.shared_hits == 1
+
+    asyncio.run(run())
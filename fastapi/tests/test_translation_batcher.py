@@ -0,0 +1,83 @@
+import asyncio
+
+from translation_batcher import TranslationBatcher
+
+
+class FakeBackend:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+
+    async def send(self, texts, source_lang, target_lang):
+        self.calls.append((list(texts), source_lang, target_lang))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("backend down")
+        return [text.upper() for text in texts]
+
+
+def test_requests_within_window_share_one_batch():
+    async def run():
+        backend = FakeBackend()
+        batcher = TranslationBatcher(backend.send, window=0.02, max_batch_size=16)
+        results = await asyncio.gather(
+            batcher.translate("a", "th", "en"),
+            batcher.translate("b", "th", "en"),
+            batcher.translate("a", "th", "en"),
+            batcher.translate("c", "th", "fr"),
+        )
+        assert results == ["A", "B", "A", "C"]
+        # ข้อความซ้ำส่งครั้งเดียว และแยก batch ตามคู่ภาษา
+        assert sorted(backend.calls) == [(["a", "b"], "th", "en"), (["c"], "th", "fr")]
+        assert batcher.stats()["batches_sent"] == 2
+
+    asyncio.run(run())
+
+
+def test_full_batch_is_sent_without_waiting_for_window():
+    async def run():
+        backend = FakeBackend()
+        batcher = TranslationBatcher(backend.send, window=10.0, max_batch_size=2)
+        results = await asyncio.wait_for(
+            asyncio.gather(batcher.translate("a", "th", "en"), batcher.translate("b", "th", "en")), 1.0
+        )
+        assert results == ["A", "B"]
+        assert backend.calls == [(["a", "b"], "th", "en")]
+
+    asyncio.run(run())
+
+
+def test_failed_batch_resolves_every_waiter_with_none():
+    async def run():
+        batcher = TranslationBatcher(FakeBackend(fail=True).send, window=0.01)
+        results = await asyncio.gather(batcher.translate("a", "th", "en"), batcher.translate("b", "th", "en"))
+        assert results == [None, None]
+
+    asyncio.run(run())
+
+
+def test_close_waits_for_in_flight_batches():
+    async def run():
+        backend = FakeBackend(delay=0.05)
+        batcher = TranslationBatcher(backend.send, window=10.0, max_batch_size=1)
+        waiter = asyncio.create_task(batcher.translate("a", "th", "en"))
+        await asyncio.sleep(0.01)
+        assert batcher._tasks
+        await batcher.close()
+        assert await waiter == "A"
+        assert not batcher._tasks
+
+    asyncio.run(run())
+
+
+def test_close_cancels_stuck_batches_and_answers_waiters():
+    async def run():
+        batcher = TranslationBatcher(FakeBackend(delay=10).send, window=10.0, max_batch_size=1)
+        waiter = asyncio.create_task(batcher.translate("a", "th", "en"))
+        await asyncio.sleep(0.01)
+        await batcher.close(timeout=0.01)
+        assert await asyncio.wait_for(waiter, 1.0) is None
+
+    asyncio.run(run())
@@ -0,0 +1,42 @@
+import asyncio
+import sqlite3
+
+from translation_cache import TranslationCache
+
+
+def count_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_lru_eviction_and_normalized_keys():
+    async def run():
+        cache = TranslationCache(max_entries=2)
+        await cache.set("Hello  World", "en", "th", "libre", "a")
+        await cache.set("b", "en", "th", "libre", "b")
+        assert await cache.get(" hello world ", "en", "th", "libre") == "a"
+        await cache.set("c", "en", "th", "libre", "c")
+        # "b" ใช้ล่าสุดน้อยที่สุดจึงถูกลบ
+        assert await cache.get("b", "en", "th", "libre") is None
+        assert await cache.get("hello world", "en", "th", "deepl") is None
+        assert cache.evictions == 1
+
+    asyncio.run(run())
+
+
+def test_database_is_pruned_while_running(tmp_path):
+    path = str(tmp_path / "cache.db")
+
+    async def run():
+        cache = TranslationCache(max_entries=1, db_path=path, db_max_rows=5, db_prune_every=10)
+        for index in range(25):
+            await cache.set(f"text {index}", "en", "th", "libre", str(index))
+        assert count_rows(path) <= 10
+        # รายการล่าสุดยังอ่านจากดิสก์ได้
+        assert await cache.get("text 24", "en", "th", "libre") == "24"
+        cache.close()
+
+    asyncio.run(run())
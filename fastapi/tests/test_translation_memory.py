@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+
+from translation_memory import TranslationMemory, parse_records
+
+
+def test_exact_match_ignores_case_and_punctuation():
+    memory = TranslationMemory()
+    memory.add("Where is the station?", "สถานีอยู่ที่ไหน", "en", "th")
+    match = memory.lookup("where is the station", "en", "th")
+    assert (match.target, match.kind, match.score) == ("สถานีอยู่ที่ไหน", "exact", 1.0)
+    assert memory.lookup("where is the station", "en", "ja") is None
+
+
+def test_substituted_numbers_are_reported_separately():
+    memory = TranslationMemory()
+    memory.add("Room 5 is on floor 3", "ห้อง 5 อยู่ชั้น 3", "en", "th")
+    match = memory.lookup("Room 7 is on floor 2", "en", "th")
+    assert (match.target, match.kind) == ("ห้อง 7 อยู่ชั้น 2", "substituted")
+    assert memory.lookup("Room 5 is on floor 3", "en", "th").kind == "exact"
+    stats = memory.stats()
+    assert stats["hits"]["substituted"] == 1 and stats["hits"]["exact"] == 1
+    assert stats["numbers_substituted"] == 1
+
+
+def test_number_mismatch_is_rejected():
+    memory = TranslationMemory()
+    # ตัวเลขในคำแปลเป็นตัวหนังสือ แทนตัวเลขใหม่ไม่ได้
+    memory.add("Gate 2 is closed", "ประตูสองปิดอยู่", "en", "th")
+    assert memory.lookup("Gate 9 is closed", "en", "th") is None
+    assert memory.stats()["rejected_number_mismatch"] == 1
+
+    memory = TranslationMemory(substitute_numbers=False)
+    memory.add("Gate 2 is closed", "ประตู 2 ปิดอยู่", "en", "th")
+    assert memory.lookup("Gate 9 is closed", "en", "th") is None
+
+
+def test_fuzzy_is_off_by_default():
+    memory = TranslationMemory()
+    memory.add("Please do not open the door until the train stops", "ห้ามเปิดประตู", "en", "th")
+    memory.add("Please close the windows", "กรุณาปิดหน้าต่าง", "en", "th")
+    assert memory.lookup("Please close the window", "en", "th") is None
+    assert memory.lookup("Please do open the door until the train stops", "en", "th") is None
+
+
+def test_fuzzy_requires_word_level_agreement():
+    memory = TranslationMemory(fuzzy=True, threshold=0.75)
+    memory.add("Please do not open the door until the train stops", "ห้ามเปิดประตู", "en", "th")
+    memory.add("Please close the windows", "กรุณาปิดหน้าต่าง", "en", "th")
+    # n-gram คล้ายกันมากแต่มีคำหายไป ความหมายกลับกัน
+    assert memory.lookup("Please do open the door until the train stops", "en", "th") is None
+    match = memory.lookup("Please close the window", "en", "th")
+    assert (match.target, match.kind) == ("กรุณาปิดหน้าต่าง", "fuzzy")
+    assert match.score < 1.0
+
+
+def test_glossary_only_lookup():
+    memory = TranslationMemory()
+    memory.add("Good morning", "สวัสดีตอนเช้า", "en", "th")
+    memory.add("Platform {n}", "ชานชาลา {n}", "en", "th", pinned=True)
+    memory.add("Exit", "ทางออก", "en", "th", pinned=True)
+
+    assert memory.lookup("Good morning", "en", "th", pinned=True) is None
+    assert memory.lookup("Platform 4", "en", "th", pinned=True).target == "ชานชาลา 4"
+    assert memory.lookup("exit!", "en", "th", pinned=True).kind == "exact"
+    assert memory.lookup("Exit", "en", "th", pinned=False) is None
+    assert memory.lookup("Good morning", "en", "th", pinned=False).target == "สวัสดีตอนเช้า"
+    # การค้นเฉพาะ glossary ที่ไม่เจอไม่นับเป็น miss
+    assert memory.stats()["misses"] == 1
+
+
+def test_glossary_is_not_overwritten_by_provider():
+    memory = TranslationMemory()
+    memory.add("Exit", "ทางออก", "en", "th", pinned=True)
+    memory.add("Exit", "ออก", "en", "th")
+    assert memory.lookup("Exit", "en", "th").target == "ทางออก"
+
+
+def test_eviction_keeps_glossary_entries():
+    memory = TranslationMemory(max_entries=3)
+    memory.add("Exit", "ทางออก", "en", "th", pinned=True)
+    for word in ("one", "two", "three", "four"):
+        memory.add(f"word {word}", word.upper(), "en", "th")
+    assert len(memory) == 3
+    assert memory.stats()["evictions"] == 2
+    assert memory.lookup("word one", "en", "th") is None
+    assert memory.lookup("word two", "en", "th") is None
+    assert memory.lookup("word four", "en", "th").target == "FOUR"
+    assert memory.lookup("Exit", "en", "th").target == "ทางออก"
+
+
+def test_ndjson_round_trip(tmp_path):
+    path = str(tmp_path / "memory.ndjson")
+    memory = TranslationMemory(path=path)
+    memory.add("Platform {n}", "ชานชาลา {n}", "en", "th", pinned=True)
+    memory.add("Exit", "ทางออก", "en", "th", pinned=True)
+    memory.add("Room 5", "ห้อง 5", "en", "th")
+    memory.add("ขอบคุณ", "Thank you", "th", "en")
+    memory.close()
+
+    with open(path, encoding="utf-8") as f:
+        records = list(parse_records(f))
+    assert len(records) == 4
+    assert {"source_lang": "en", "target_lang": "th", "source": "Exit", "target": "ทางออก", "pinned": True} in records
+
+    loaded = TranslationMemory(path=path)
+    assert len(loaded) == 4
+    assert sorted(map(json.dumps, loaded.export_entries())) == sorted(map(json.dumps, memory.export_entries()))
+    assert loaded.lookup("Platform 9", "en", "th").target == "ชานชาลา 9"
+    assert loaded.lookup("Room 6", "en", "th").kind == "substituted"
+    # สถานะ pinned ถูกเก็บใน NDJSON: glossary ยังเป็น glossary รายการที่เรียนรู้ยังเป็นรายการที่เรียนรู้
+    assert loaded.lookup("Exit", "en", "th", pinned=True) is not None
+    assert loaded.lookup("Room 5", "en", "th", pinned=True) is None
+
+
+def test_import_skips_invalid_records():
+    memory = TranslationMemory()
+    imported, skipped = memory.import_entries([
+        {"source": "Exit", "target": "ทางออก"},
+        {"source": "Hello"},
+        {"source": "123", "target": "123"},
+        {"source": "Hi", "target": "สวัสดี", "source_lang": "en", "target_lang": "en"},
+    ], "en", "th")
+    assert (imported, skipped) == (1, 3)
+    assert memory.lookup("Exit", "en", "th", pinned=True).target == "ทางออก"
+
+
+def test_concurrent_saves_use_separate_temp_files(tmp_path, caplog):
+    path = str(tmp_path / "memory.ndjson")
+    memories = []
+    words = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet"]
+    for worker in ("north", "south", "east", "west"):
+        memory = TranslationMemory()
+        for first in words:
+            for second in words:
+                for third in words:
+                    memory.add(f"{first} {second} {third} {worker}", f"{first} {second} {third} {worker}", "en", "th")
+        memories.append(memory)
+
+    threads = [threading.Thread(target=memory.save, args=(path,)) for memory in memories]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert "Error saving" not in caplog.text
+    # ไฟล์เป็นของ worker ใด worker หนึ่งทั้งไฟล์ ไม่ปนกัน และไม่มีไฟล์ชั่วคราวค้าง
+    assert os.listdir(tmp_path) == ["memory.ndjson"]
+    loaded = TranslationMemory(path=path)
+    assert len(loaded) == 1000
+    assert len({record["target"].split()[-1] for record in loaded.export_entries()}) == 1
+
+
+def test_import_is_applied_by_other_workers(monkeypatch):
+    import main
+
+    memory = TranslationMemory()
+    monkeypatch.setattr(main, "translation_memory", memory)
+    message = {
+        "worker": "other-worker",
+        "records": [{"source": "Exit", "target": "ทางออก"}],
+        "source_lang": "en",
+        "target_lang": "th",
+    }
+    main.apply_translation_memory_import(json.dumps(message))
+    assert memory.lookup("Exit", "en", "th", pinned=True).target == "ทางออก"
+
+    # ข้อความที่ worker นี้ส่งเองถูกข้าม (import ไปแล้วตอนรับ request)
+    memory = TranslationMemory()
+    monkeypatch.setattr(main, "translation_memory", memory)
+    main.apply_translation_memory_import(json.dumps({**message, "worker": main.WORKER_ID}))
+    assert len(memory) == 0
@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+from backend_health import BackendMonitor, CircuitBreaker
+from translation_providers import TokenBucket, TranslationProvider, TranslationRouter
+
+
+class FakeProvider(TranslationProvider):
+    def __init__(self, name, result="ok", delay=0.0, **kwargs):
+        super().__init__(None, name, **kwargs)
+        self.name = name
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+
+    async def translate(self, texts, source_lang, target_lang):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.result is None:
+            return None
+        return [f"{self.result}:{text}" for text in texts]
+
+
+def make_router(*providers, reset_timeout=30.0):
+    monitor = BackendMonitor(None, failure_threshold=1, reset_timeout=reset_timeout)
+    return monitor, TranslationRouter(monitor, list(providers))
+
+
+def test_circuit_breaker_transitions():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_blocking
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert not breaker.is_blocking
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # half_open ปล่อยให้ลองได้ทีละหนึ่ง
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_circuit_breaker_release_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.release_trial()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_token_bucket_throttles_and_waits():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=2)
+        assert await bucket.acquire()
+        assert await bucket.acquire()
+        # ต้องรอ 0.05 วินาทีสำหรับ token ถัดไป
+        assert not await bucket.acquire(max_wait=0.01)
+        assert bucket.throttled == 1
+        started = time.monotonic()
+        assert await bucket.acquire(max_wait=1.0)
+        assert time.monotonic() - started >= 0.04
+
+    asyncio.run(run())
+
+
+def test_token_bucket_refunds_cancelled_wait():
+    async def run():
+        bucket = TokenBucket(rate=1, capacity=1)
+        assert await bucket.acquire()
+        task = asyncio.create_task(bucket.acquire(max_wait=10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        bucket._refill()
+        assert bucket.tokens > -0.5
+
+    asyncio.run(run())
+
+
+def test_router_returns_serving_provider():
+    async def run():
+        primary = FakeProvider("primary", result=None)
+        backup = FakeProvider("backup", result="b")
+        monitor, router = make_router(primary, backup)
+        assert router.preferred_provider("th", "en") == "primary"
+        assert await router.translate(["x"], "th", "en") == (["b:x"], "backup")
+        # primary ล้มเหลวจนตัดวงจร: provider ที่จะได้งานต่อไปคือ backup
+        assert router.preferred_provider("th", "en") == "backup"
+
+    asyncio.run(run())
+
+
+def test_rate_limited_half_open_trial_is_released():
+    async def run():
+        primary = FakeProvider("primary", rate_limit=0.001, burst=1)
+        backup = FakeProvider("backup", result="b")
+        monitor, router = make_router(primary, backup, reset_timeout=0.0)
+        await monitor.record_result("primary", False)
+        primary.rate_limiter.tokens = 0
+        # half_open แต่ติด rate limit ในเครื่อง: ใช้ backup และไม่ถือสิทธิ์ทดลองค้างไว้
+        assert (await router.translate(["x"], "th", "en"))[1] == "backup"
+        breaker = monitor.get("primary").breaker
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        primary.rate_limiter.tokens = 1
+        assert await router.translate(["x"], "th", "en") == (["ok:x"], "primary")
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(run())
+
+
+def test_cancelled_half_open_trial_is_released():
+    async def run():
+        primary = FakeProvider("primary", delay=1.0)
+        monitor, router = make_router(primary, reset_timeout=0.0)
+        await monitor.record_result("primary", False)
+        task = asyncio.create_task(router.translate(["x"], "th", "en"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert monitor.allow_request("primary")
+
+    asyncio.run(run())
+
+
+def test_local_throttling_is_not_recorded_as_backend_failure():
+    async def run():
+        primary = FakeProvider("primary", rate_limit=1, burst=1, latency_budget=0.5)
+        backup = FakeProvider("backup", result="b")
+        monitor, router = make_router(primary, backup)
+        primary.rate_limiter.tokens = 0
+        assert (await router.translate(["x"], "th", "en"))[1] == "backup"
+        status = monitor.get("primary")
+        assert status.total_failures == 0
+        assert status.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(run())
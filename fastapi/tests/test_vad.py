@@ -0,0 +1,106 @@
+import asyncio
+import io
+import wave
+
+import numpy as np
+
+import vad
+from vad import VoiceActivityDetector
+
+SAMPLE_RATE = 16000
+
+
+def tone(seconds, amplitude=8000, frequency=220.0):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.int16)
+
+
+def noise(seconds, amplitude=30, seed=0):
+    return np.random.default_rng(seed).normal(0, amplitude, int(seconds * SAMPLE_RATE)).astype(np.int16)
+
+
+def wav_samples(data):
+    with wave.open(io.BytesIO(data)) as wav:
+        assert (wav.getframerate(), wav.getnchannels()) == (SAMPLE_RATE, 1)
+        return wav.getnframes()
+
+
+def decoded_as(monkeypatch, pcm):
+    """ให้ decode_to_pcm คืน PCM ที่กำหนด (ไม่ต้องใช้ ffmpeg)"""
+    async def decode_to_pcm(audio_data, sample_rate=16000):
+        return pcm
+
+    monkeypatch.setattr(vad, "decode_to_pcm", decode_to_pcm)
+
+
+def test_silence_and_quiet_noise_have_no_speech():
+    detector = VoiceActivityDetector()
+    assert not detector.analyze(silence(2.0)).has_speech
+    assert not detector.analyze(noise(2.0)).has_speech
+    assert not detector.analyze(np.zeros(10, dtype=np.int16)).has_speech
+
+
+def test_tone_above_threshold_is_speech():
+    detector = VoiceActivityDetector()
+    result = detector.analyze(np.concatenate([silence(1.0), tone(1.0), silence(1.0)]))
+    assert result.has_speech
+    assert abs(result.speech_start - 1.0) <= 0.03
+    assert abs(result.speech_end - 2.0) <= 0.03
+    assert abs(result.speech_duration - 1.0) <= 0.06
+
+    # เสียงที่สั้นกว่า min_speech_ms ไม่นับเป็นเสียงพูด
+    assert not detector.analyze(np.concatenate([silence(1.0), tone(0.1), silence(1.0)])).has_speech
+    # เบากว่าเกณฑ์ (-45 dBFS) ไม่นับ
+    assert not detector.analyze(tone(1.0, amplitude=100)).has_speech
+
+
+def test_filter_skips_silent_chunk(monkeypatch):
+    decoded_as(monkeypatch, silence(1.5))
+    detector = VoiceActivityDetector()
+    result = asyncio.run(detector.filter(b"chunk"))
+    assert result.skip
+    assert result.audio_data == b"chunk"
+    assert result.duration == 1.5
+    stats = detector.stats()
+    assert (stats["chunks_total"], stats["chunks_skipped"], stats["seconds_skipped"]) == (1, 1, 1.5)
+
+
+def test_filter_passes_speech_through_without_trim(monkeypatch):
+    pcm = np.concatenate([silence(1.0), tone(1.0)])
+    decoded_as(monkeypatch, pcm)
+    result = asyncio.run(VoiceActivityDetector().filter(b"chunk"))
+    assert not result.skip
+    assert result.audio_data == b"chunk"
+    assert result.pcm is pcm
+
+
+def test_trim_keeps_padding_within_bounds(monkeypatch):
+    detector = VoiceActivityDetector(trim=True, trim_padding_ms=200)
+
+    # เงียบหัวท้าย 1 วินาที: เหลือเสียงพูด + padding 0.2 วินาทีแต่ละด้าน
+    decoded_as(monkeypatch, np.concatenate([silence(1.0), tone(1.0), silence(1.0)]))
+    result = asyncio.run(detector.filter(b"chunk"))
+    assert not result.skip
+    assert abs(wav_samples(result.audio_data) - 1.4 * SAMPLE_RATE) <= 0.03 * SAMPLE_RATE
+    assert abs(result.trimmed - 1.6) <= 0.03
+
+    # เสียงพูดชิดขอบ: padding ไม่เกินขอบของ chunk
+    decoded_as(monkeypatch, np.concatenate([tone(1.0), silence(0.1)]))
+    result = asyncio.run(detector.filter(b"chunk"))
+    assert wav_samples(result.audio_data) == int(1.1 * SAMPLE_RATE)
+    assert result.trimmed == 0.0
+
+
+def test_filter_passes_through_without_ffmpeg(monkeypatch):
+    async def decode_to_pcm(audio_data, sample_rate=16000):
+        raise FileNotFoundError("ffmpeg")
+
+    monkeypatch.setattr(vad, "decode_to_pcm", decode_to_pcm)
+    detector = VoiceActivityDetector()
+    result = asyncio.run(detector.filter(b"chunk"))
+    assert not result.skip and result.audio_data == b"chunk"
+    assert detector.stats()["enabled"] is False
@@ -0,0 +1,203 @@
+import asyncio
+
+from http_client import BackendResponse
+from whisper_pool import WhisperPool
+from whisper_scheduler import WhisperScheduler
+
+
+class StubBreaker:
+    def __init__(self):
+        self.is_blocking = False
+
+
+class StubStatus:
+    def __init__(self):
+        self.is_up = True
+        self.avg_latency = None
+        self.allow = True
+        self.breaker = StubBreaker()
+        self.results = []
+
+    @property
+    def is_available(self):
+        return self.is_up is not False and self.allow
+
+
+class StubMonitor:
+    """แทน BackendMonitor: กำหนดผล probe, latency และ circuit breaker ของแต่ละ replica ได้เอง"""
+
+    def __init__(self):
+        self.statuses = {}
+
+    def register(self, name, probe_url=None):
+        self.statuses[name] = StubStatus()
+        return self.statuses[name]
+
+    def get(self, name):
+        return self.statuses[name]
+
+    def allow_request(self, name):
+        return self.statuses[name].allow
+
+    async def record_result(self, name, ok, latency=None, error=None):
+        self.statuses[name].results.append(ok)
+
+
+def create_pool(count=2, **kwargs):
+    monitor = StubMonitor()
+    pool = WhisperPool(monitor, [f"http://whisper-{i}:9000/" for i in range(count)], **kwargs)
+    return pool, monitor
+
+
+def create_hedging_pool(**kwargs):
+    pool, monitor = create_pool(hedge=True, hedge_min_delay=0.02, hedge_min_samples=5, **kwargs)
+    pool._latencies.extend([0.01] * 5)
+    return pool, monitor
+
+
+def fake_send(behaviour):
+    """send ปลอม: behaviour[ชื่อ replica] = (เวลาตอบ, status code)"""
+    calls = []
+    cancelled = []
+
+    async def send(replica):
+        calls.append(replica.name)
+        delay, status = behaviour[replica.name]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(replica.name)
+            raise
+        return BackendResponse(status, replica.name, delay)
+
+    return send, calls, cancelled
+
+
+def test_choose_ranks_by_outstanding_times_latency():
+    pool, monitor = create_pool(count=2)
+    first, second = pool.replicas["whisper-1"], pool.replicas["whisper-2"]
+    monitor.get("whisper-1").avg_latency = 1.0
+    monitor.get("whisper-2").avg_latency = 0.2
+
+    second.outstanding = 3
+    assert pool.choose() is second  # 4 x 0.2 < 1 x 1.0
+    second.outstanding = 5
+    assert pool.choose() is first  # 6 x 0.2 > 1 x 1.0
+    assert pool.choose(exclude=[first]) is second
+
+
+def test_choose_skips_unhealthy_replicas_and_respects_breaker():
+    pool, monitor = create_pool(count=3)
+    for name, latency in (("whisper-1", 0.1), ("whisper-2", 0.5), ("whisper-3", 1.0)):
+        monitor.get(name).avg_latency = latency
+
+    monitor.get("whisper-1").is_up = False
+    assert pool.choose().name == "whisper-2"
+
+    # circuit breaker ไม่อนุญาต ข้ามไปตัวถัดไป
+    monitor.get("whisper-2").allow = False
+    assert pool.choose().name == "whisper-3"
+
+    # ถ้าไม่มีตัวไหน probe ผ่านเลย ให้ circuit breaker เป็นตัวตัดสิน
+    for status in monitor.statuses.values():
+        status.is_up = False
+    assert pool.choose().name == "whisper-1"
+
+    for status in monitor.statuses.values():
+        status.allow = False
+    assert pool.choose() is None
+
+
+def test_hedge_delay_needs_samples_and_has_a_floor():
+    pool, _ = create_pool(hedge=True, hedge_percentile=50, hedge_min_delay=0.5, hedge_min_samples=3)
+    pool._latencies.extend([1.0, 2.0])
+    assert pool.hedge_delay() is None
+    pool._latencies.append(3.0)
+    assert pool.hedge_delay() == 2.0
+    pool._latencies.clear()
+    pool._latencies.extend([0.1, 0.1, 0.1])
+    assert pool.hedge_delay() == 0.5
+
+
+def test_no_hedge_when_primary_answers_in_time():
+    async def run():
+        pool, _ = create_hedging_pool()
+        send, calls, _ = fake_send({"whisper-1": (0.0, 200), "whisper-2": (0.0, 200)})
+        response = await pool.request(send)
+        assert response.status_code == 200
+        assert len(calls) == 1
+        assert pool.hedges_sent == 0
+
+    asyncio.run(run())
+
+
+def test_hedged_request_wins_and_slow_primary_is_cancelled():
+    async def run():
+        pool, monitor = create_hedging_pool()
+        monitor.get("whisper-2").avg_latency = 5.0  # ให้ whisper-1 เป็นตัวแรก
+        send, calls, cancelled = fake_send({"whisper-1": (1.0, 200), "whisper-2": (0.0, 200)})
+        response = await pool.request(send)
+        assert response.text == "whisper-2"
+        assert calls == ["whisper-1", "whisper-2"]
+        assert cancelled == ["whisper-1"]
+        assert pool.hedges_sent == 1
+        assert pool.replicas["whisper-2"].hedges_won == 1
+        assert all(replica.outstanding == 0 for replica in pool.replicas.values())
+        # แพ้การแข่งไม่นับเป็นความล้มเหลวของ replica
+        assert monitor.get("whisper-1").results == []
+
+    asyncio.run(run())
+
+
+def test_first_response_5xx_waits_for_the_other():
+    async def run():
+        pool, monitor = create_hedging_pool()
+        monitor.get("whisper-2").avg_latency = 5.0
+        send, _, _ = fake_send({"whisper-1": (0.1, 200), "whisper-2": (0.0, 503)})
+        response = await pool.request(send)
+        assert (response.status_code, response.text) == (200, "whisper-1")
+        assert pool.replicas["whisper-2"].hedges_won == 0
+        assert monitor.get("whisper-2").results == [False]
+
+        # ทั้งสองตัวล้มเหลว คืนคำตอบสุดท้าย
+        send, _, _ = fake_send({"whisper-1": (0.1, 500), "whisper-2": (0.0, 503)})
+        response = await pool.request(send)
+        assert response.status_code == 500
+
+    asyncio.run(run())
+
+
+def test_hedge_takes_its_own_scheduler_slot():
+    async def run():
+        pool, monitor = create_hedging_pool()
+        monitor.get("whisper-2").avg_latency = 5.0
+        behaviour = {"whisper-1": (0.1, 200), "whisper-2": (0.05, 200)}
+
+        # slot เดียวถูก request หลักใช้อยู่ ไม่ส่งซ้ำ
+        scheduler = WhisperScheduler(max_concurrency=1)
+        send, calls, _ = fake_send(behaviour)
+        async with scheduler.slot("client"):
+            await pool.request(send, scheduler=scheduler)
+        assert calls == ["whisper-1"]
+        assert pool.hedges_sent == 0
+
+        # มี slot ว่าง: request ที่ส่งซ้ำจอง slot ระหว่างทำงานแล้วคืนเมื่อจบ
+        scheduler = WhisperScheduler(max_concurrency=2)
+        send, calls, _ = fake_send(behaviour)
+        peak = 0
+
+        async def watch():
+            nonlocal peak
+            while True:
+                peak = max(peak, scheduler.active)
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.create_task(watch())
+        async with scheduler.slot("client"):
+            await pool.request(send, scheduler=scheduler)
+        watcher.cancel()
+        assert calls == ["whisper-1", "whisper-2"]
+        assert peak == 2
+        assert scheduler.active == 0
+
+    asyncio.run(run())
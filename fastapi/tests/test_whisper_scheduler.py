@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+import whisper_scheduler
+from whisper_scheduler import PRIORITY_BATCH, PRIORITY_LIVE, SchedulerBusy, WhisperScheduler
+
+
+async def grant_order(scheduler, requests):
+    """ส่งคำขอตามลำดับขณะที่ slot เต็ม แล้วคืนลำดับที่ได้รับสิทธิ์"""
+    order = []
+
+    async def request(name, client_id, priority):
+        await scheduler.acquire(client_id, priority)
+        order.append(name)
+        scheduler.release(0.0)
+
+    await scheduler.acquire("holder")
+    tasks = [asyncio.create_task(request(*item)) for item in requests]
+    await asyncio.sleep(0)
+    scheduler.release(0.0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_round_robin_across_clients():
+    async def run():
+        scheduler = WhisperScheduler(max_concurrency=1)
+        order = await grant_order(scheduler, [
+            ("a1", "a", PRIORITY_LIVE), ("a2", "a", PRIORITY_LIVE), ("a3", "a", PRIORITY_LIVE),
+            ("b1", "b", PRIORITY_LIVE), ("c1", "c", PRIORITY_LIVE),
+        ])
+        assert order == ["a1", "b1", "c1", "a2", "a3"]
+        assert scheduler.active == 0
+        assert scheduler.waiting == 0
+
+    asyncio.run(run())
+
+
+def test_live_priority_before_batch():
+    async def run():
+        scheduler = WhisperScheduler(max_concurrency=1)
+        order = await grant_order(scheduler, [
+            ("batch", "a", PRIORITY_BATCH), ("live1", "b", PRIORITY_LIVE), ("live2", "c", PRIORITY_LIVE),
+        ])
+        assert order == ["live1", "live2", "batch"]
+
+    asyncio.run(run())
+
+
+def test_queue_full_is_rejected():
+    async def run():
+        scheduler = WhisperScheduler(max_concurrency=1, max_queue=1)
+        await scheduler.acquire("holder")
+        waiter = asyncio.create_task(scheduler.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy) as busy:
+            await scheduler.acquire("b")
+        assert busy.value.reason == "queue_full"
+        assert busy.value.retry_after >= 1
+        scheduler.release()
+        await waiter
+        scheduler.release()
+        assert scheduler.active == 0
+
+    asyncio.run(run())
+
+
+def test_deadline_expires_waiting_request():
+    async def run():
+        scheduler = WhisperScheduler(max_concurrency=1, deadlines={PRIORITY_LIVE: 0.02})
+        await scheduler.acquire("holder")
+        with pytest.raises(SchedulerBusy) as busy:
+            await scheduler.acquire("a")
+        assert busy.value.reason == "deadline_exceeded"
+        assert scheduler.expired == 1
+        assert scheduler.waiting == 0
+        scheduler.release()
+        assert scheduler.active == 0
+
+    asyncio.run(run())
+
+
+def test_grant_racing_deadline_does_not_leak_slot(monkeypatch):
+    async def run():
+        scheduler = WhisperScheduler(max_concurrency=1)
+        await scheduler.acquire("holder")
+
+        async def granted_then_timed_out(future, timeout):
+            # slot ว่างและถูกมอบให้ ticket แล้ว แต่ deadline มาถึงก่อนผู้รอได้ทำงานต่อ
+            scheduler.release()
+            assert future.done()
+            raise asyncio.TimeoutError()
+
+        monkeypatch.setattr(whisper_scheduler.asyncio, "wait_for", granted_then_timed_out)
+        with pytest.raises(SchedulerBusy):
+            await scheduler.acquire("a")
+        assert scheduler.active == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_after_grant_releases_slot():
+    async def run():
+        scheduler = WhisperScheduler(max_concurrency=1)
+        await scheduler.acquire("holder")
+        waiter = asyncio.create_task(scheduler.acquire("a"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        scheduler.release()
+        (outcome,) = await asyncio.gather(waiter, return_exceptions=True)
+        if not isinstance(outcome, asyncio.CancelledError):
+            # wait_for บางเวอร์ชันคืนผลแทนการยกเลิกเมื่อ future เสร็จแล้ว: ผู้เรียกถือ slot อยู่
+            scheduler.release()
+        assert scheduler.active == 0
+        await scheduler.acquire("b")
+        assert scheduler.active == 1
+
+    asyncio.run(run())
@@ -0,0 +1,171 @@
+import asyncio
+
+from ws_pipeline import DROP_OLDEST, REJECT, ClientPipeline
+
+
+def result_for(audio_data, source_lang, target_lang):
+    text = audio_data.decode()
+    return {"original_text": text, "translated_text": text.upper(), "source_lang": source_lang, "target_lang": target_lang}
+
+
+class Recorder:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(message)
+
+    def seqs(self):
+        return [message.get("seq") for message in self.messages if "seq" in message]
+
+
+async def wait_until(condition, timeout=1.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.001)
+
+
+def test_results_are_sent_in_seq_order():
+    async def run():
+        recorder = Recorder()
+        delays = {b"a": 0.05, b"b": 0.0, b"c": 0.01}
+
+        async def process(audio_data, source_lang, target_lang, on_transcript):
+            await asyncio.sleep(delays[audio_data])
+            return result_for(audio_data, source_lang, target_lang)
+
+        pipeline = ClientPipeline("c1", process, recorder.send, max_queue=4, max_in_flight=3)
+        pipeline.start()
+        for audio in (b"a", b"b", b"c"):
+            await pipeline.submit(audio, "th", "en")
+        await wait_until(lambda: len(recorder.messages) == 3)
+        await pipeline.close()
+        assert recorder.seqs() == [0, 1, 2]
+        assert [message["text"] for message in recorder.messages] == ["a", "b", "c"]
+        assert pipeline.in_flight_bytes == 0
+
+    asyncio.run(run())
+
+
+def test_drop_oldest_keeps_seq_order():
+    async def run():
+        recorder = Recorder()
+        release = asyncio.Event()
+
+        async def process(audio_data, source_lang, target_lang, on_transcript):
+            await release.wait()
+            return result_for(audio_data, source_lang, target_lang)
+
+        pipeline = ClientPipeline("c1", process, recorder.send, max_queue=1, max_in_flight=1,
+                                  overflow_policy=DROP_OLDEST)
+        pipeline.start()
+        assert await pipeline.submit(b"a", "th", "en") == 0
+        await wait_until(lambda: pipeline.queue_depth == 0)
+        assert await pipeline.submit(b"b", "th", "en") == 1
+        # คิวเต็ม: seq 1 ถูกทิ้งแทน seq 2
+        assert await pipeline.submit(b"c", "th", "en") == 2
+        assert pipeline.dropped == 1
+        release.set()
+        await wait_until(lambda: len(recorder.messages) == 3)
+        await pipeline.close()
+        assert recorder.seqs() == [0, 1, 2]
+        assert recorder.messages[1]["status"] == "dropped"
+        assert recorder.messages[2]["text"] == "c"
+
+    asyncio.run(run())
+
+
+def test_rejected_chunk_keeps_its_seq():
+    async def run():
+        recorder = Recorder()
+        release = asyncio.Event()
+
+        async def process(audio_data, source_lang, target_lang, on_transcript):
+            await release.wait()
+            return result_for(audio_data, source_lang, target_lang)
+
+        pipeline = ClientPipeline("c1", process, recorder.send, max_queue=1, max_in_flight=1,
+                                  overflow_policy=REJECT)
+        pipeline.start()
+        assert await pipeline.submit(b"a", "th", "en") == 0
+        await wait_until(lambda: pipeline.queue_depth == 0)
+        assert await pipeline.submit(b"b", "th", "en") == 1
+        assert await pipeline.submit(b"c", "th", "en") is None
+        assert pipeline.rejected == 1
+        # แจ้งทันทีพร้อม seq ของ chunk ที่ถูกปฏิเสธ ไม่ต้องรอผลของ seq ก่อนหน้า
+        assert recorder.messages[0]["status"] == "slow_down"
+        assert recorder.messages[0]["seq"] == 2
+        release.set()
+        await wait_until(lambda: len(recorder.messages) == 3)
+        assert await pipeline.submit(b"d", "th", "en") == 3
+        await wait_until(lambda: len(recorder.messages) == 4)
+        await pipeline.close()
+        assert recorder.seqs() == [2, 0, 1, 3]
+        assert [message.get("text") for message in recorder.messages[1:]] == ["a", "b", "d"]
+
+    asyncio.run(run())
+
+
+def test_transcript_then_translation_per_segment():
+    async def run():
+        recorder = Recorder()
+        release_first = asyncio.Event()
+
+        async def process(audio_data, source_lang, target_lang, on_transcript):
+            await on_transcript(audio_data.decode())
+            if audio_data == b"a":
+                await release_first.wait()
+            return result_for(audio_data, source_lang, target_lang)
+
+        pipeline = ClientPipeline("c1", process, recorder.send, max_queue=4, max_in_flight=2)
+        pipeline.start()
+        await pipeline.submit(b"a", "th", "en")
+        await pipeline.submit(b"b", "th", "en")
+        # ข้อความต้นฉบับของ seq 1 ส่งได้ทันทีหลัง seq 0 แม้คำแปลของ seq 0 ยังไม่เสร็จ
+        await wait_until(lambda: len(recorder.messages) == 3)
+        assert [(m["type"], m["seq"]) for m in recorder.messages] == [
+            ("transcript", 0), ("transcript", 1), ("translation", 1)
+        ]
+        release_first.set()
+        await wait_until(lambda: len(recorder.messages) == 4)
+        await pipeline.close()
+        assert recorder.messages[3]["type"] == "translation"
+        assert recorder.messages[3]["segment_id"] == 0
+
+    asyncio.run(run())
+
+
+def test_drop_oldest_frees_bytes_before_byte_limit():
+    async def run():
+        recorder = Recorder()
+        release = asyncio.Event()
+
+        async def process(audio_data, source_lang, target_lang, on_transcript):
+            await release.wait()
+            return result_for(audio_data, source_lang, target_lang)
+
+        pipeline = ClientPipeline("c1", process, recorder.send, max_queue=4, max_in_flight=1,
+                                  overflow_policy=DROP_OLDEST, max_in_flight_bytes=6)
+        pipeline.start()
+        assert await pipeline.submit(b"aa", "th", "en") == 0
+        await wait_until(lambda: pipeline.queue_depth == 0)
+        assert await pipeline.submit(b"bb", "th", "en") == 1
+        # คิวยังไม่เต็มแต่ขนาดรวมเกิน: ทิ้ง seq 1 ที่รออยู่ในคิวแทนการปฏิเสธ chunk ใหม่
+        assert await pipeline.submit(b"cccc", "th", "en") == 2
+        assert (pipeline.dropped, pipeline.rejected) == (1, 0)
+        assert pipeline.in_flight_bytes == 6
+        # ทิ้งทั้งคิวก็ยังไม่พอ (seq 0 กำลังประมวลผล) จึงปฏิเสธโดยไม่ทิ้ง seq 2
+        assert await pipeline.submit(b"dddddd", "th", "en") is None
+        assert (pipeline.dropped, pipeline.rejected) == (1, 1)
+        assert pipeline.queued_bytes == 4
+        release.set()
+        await wait_until(lambda: len(recorder.messages) == 4)
+        await pipeline.close()
+        assert recorder.seqs() == [3, 0, 1, 2]
+        assert recorder.messages[2]["status"] == "dropped"
+        assert recorder.messages[3]["text"] == "cccc"
+        assert pipeline.in_flight_bytes == 0
+
+    asyncio.run(run())
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from http_client import BackendResponse
+from registry import Registry
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionCache:
+    """Cache ผลถอดเสียงตาม hash ของข้อมูลเสียง + ภาษา (LRU จำกัดจำนวนและขนาด)
+    และรวม request ที่เหมือนกันซึ่งกำลังทำงานอยู่พร้อมกันให้เรียก Whisper เพียงครั้งเดียว
+    (ถ้ามี registry ร่วม ผลที่ worker อื่นถอดไว้แล้วจะถูกใช้ก่อนเรียก Whisper)"""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 16 * 1024 * 1024,
+                 shared: Optional[Registry] = None, shared_ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self._entries: "OrderedDict[str, BackendResponse]" = OrderedDict()
+        self._bytes = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(audio_data: bytes, source_lang: str) -> str:
+        return f"{source_lang}:{hashlib.sha256(audio_data).hexdigest()}"
+
+    async def get_or_fetch(
+        self,
+        audio_data: bytes,
+        source_lang: str,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """คืนผลจาก cache, รอผลของ request เดียวกันที่กำลังทำอยู่ หรือเรียก fetch เอง
+        (fetch คืนผลแบบอื่นได้ เช่นเสียงที่ไม่มีเสียงพูด ผู้รอพร้อมกันได้ผลเดียวกันแต่เก็บลง cache เฉพาะ BackendResponse 200)"""
+        key = self.make_key(audio_data, source_lang)
+
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logger.info("Transcription cache hit")
+            return cached
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            logger.info("Joined in-flight transcription for identical audio")
+            # shield เพื่อไม่ให้การยกเลิกของผู้รอรายหนึ่งไปยกเลิกงานของคนอื่น
+            return await asyncio.shield(in_flight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = await self._get_shared(key)
+            if response is None:
+                response = await fetch()
+                if self._cacheable(response):
+                    await self._set_shared(key, response)
+        except BaseException as e:
+            if not future.done():
+                # ผู้เรียกหลักถูกยกเลิก: ผู้รอรายอื่นควรได้ error ไม่ใช่ถูกยกเลิกตามไปด้วย
+                future.set_exception(
+                    RuntimeError("Transcription request was cancelled") if isinstance(e, asyncio.CancelledError) else e
+                )
+                # กันไม่ให้ asyncio เตือนเรื่อง exception ที่ไม่มีใครรอ
+                future.exception()
+            raise
+        else:
+            future.set_result(response)
+            if self._cacheable(response):
+                self._put(key, response)
+            return response
+        finally:
+            del self._in_flight[key]
+
+    @staticmethod
+    def _cacheable(response: Any) -> bool:
+        return isinstance(response, BackendResponse) and response.status_code == 200
+
+    async def _get_shared(self, key: str) -> Optional[BackendResponse]:
+        if self.shared is None:
+            return None
+        try:
+            cached = await self.shared.get(f"transcription:{key}")
+        except Exception as e:
+            logger.error(f"Error reading shared transcription cache: {str(e)}")
+            return None
+        if cached is None:
+            return None
+        self.shared_hits += 1
+        logger.info("Shared transcription cache hit")
+        return BackendResponse(200, cached, 0.0)
+
+    async def _set_shared(self, key: str, response: BackendResponse):
+        if self.shared is None or len(response.text.encode()) > self.max_bytes:
+            return
+        try:
+            await self.shared.set(f"transcription:{key}", response.text, self.shared_ttl)
+        except Exception as e:
+            logger.error(f"Error writing shared transcription cache: {str(e)}")
+
+    def _put(self, key: str, response: BackendResponse):
+        size = len(response.text.encode())
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous.text.encode())
+        self._entries[key] = response
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.text.encode())
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+BatchKey = Tuple[str, str]
+# คืนผลหนึ่งรายการต่อข้อความตามลำดับเดิม (เช่นคำแปลคู่กับชื่อ provider) หรือ None ถ้าล้มเหลว
+SendBatchFunc = Callable[[List[str], str, str], Awaitable[Optional[List[Any]]]]
+
+
+class _PendingBatch:
+    def __init__(self):
+        # ข้อความเดียวกันในรอบเดียวกันส่งไปครั้งเดียวแล้วแจกผลให้ทุกผู้เรียก
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+        self.timer: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.waiters)
+
+
+class TranslationBatcher:
+    """รวมคำขอแปลของหลาย client ที่มีคู่ภาษาเดียวกันภายในช่วงเวลาสั้นๆ แล้วส่งเป็น request เดียว"""
+
+    def __init__(self, send_batch: SendBatchFunc, window: float = 0.02, max_batch_size: int = 16):
+        self.send_batch = send_batch
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending: Dict[BatchKey, _PendingBatch] = {}
+        # เก็บ reference ของ task ที่ส่ง batch ไว้ ไม่ให้ถูก garbage collect และให้รอได้ตอนปิด
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches_sent = 0
+        self.texts_sent = 0
+        self.requests = 0
+
+    async def translate(self, text: str, source_lang: str, target_lang: str) -> Optional[Any]:
+        """เพิ่มข้อความเข้ารอบปัจจุบันแล้วรอผลการแปลของตัวเอง"""
+        self.requests += 1
+        key = (source_lang, target_lang)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = _PendingBatch()
+            self._pending[key] = batch
+            batch.timer = self._spawn(self._flush_later(key, batch))
+
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.setdefault(text, []).append(future)
+
+        if len(batch) >= self.max_batch_size:
+            batch.timer.cancel()
+            self._take(key, batch)
+            self._spawn(self._send(key, batch))
+
+        return await future
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _take(self, key: BatchKey, batch: _PendingBatch):
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+
+    async def _flush_later(self, key: BatchKey, batch: _PendingBatch):
+        await asyncio.sleep(self.window)
+        self._take(key, batch)
+        await self._send(key, batch)
+
+    async def _send(self, key: BatchKey, batch: _PendingBatch):
+        source_lang, target_lang = key
+        texts = list(batch.waiters)
+        results = None
+        try:
+            results = await self.send_batch(texts, source_lang, target_lang)
+            if results is not None and len(results) != len(texts):
+                logger.error(f"Translation batch returned {len(results)} results for {len(texts)} texts")
+                results = None
+        except Exception as e:
+            logger.error(f"Error sending translation batch: {str(e)}")
+            results = None
+        finally:
+            # ตอบผู้รอทุกรายแม้ถูกยกเลิกตอนปิดแอป (ได้ None = แปลไม่สำเร็จ)
+            self.batches_sent += 1
+            self.texts_sent += len(texts)
+            logger.info(f"Sent translation batch {source_lang}->{target_lang} with {len(texts)} texts")
+
+            for index, text in enumerate(texts):
+                value = results[index] if results is not None else None
+                for future in batch.waiters[text]:
+                    if not future.done():
+                        future.set_result(value)
+
+    async def close(self, timeout: float = 5.0):
+        """รอ batch ที่รอส่งหรือกำลังส่งให้เสร็จ (ไม่เกิน timeout) แล้วยกเลิกส่วนที่เหลือ"""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": round(self.window * 1000, 1),
+            "max_batch_size": self.max_batch_size,
+            "requests": self.requests,
+            "batches_sent": self.batches_sent,
+            "texts_sent": self.texts_sent,
+            "avg_batch_size": round(self.texts_sent / self.batches_sent, 2) if self.batches_sent else 0.0,
+        }
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from registry import Registry
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str, str]
+
+
+def normalize_text(text: str) -> str:
+    """ทำข้อความให้อยู่ในรูปมาตรฐาน (ตัดช่องว่างซ้ำ/หัวท้าย และไม่สนตัวพิมพ์เล็กใหญ่) เพื่อใช้เป็น key"""
+    return " ".join(text.split()).casefold()
+
+
+class SQLiteCacheStore:
+    """เก็บผลการแปลลงไฟล์ SQLite เพื่อให้ cache อยู่รอดหลัง restart container"""
+
+    def __init__(self, path: str, max_rows: int = 100000):
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " text TEXT NOT NULL, source_lang TEXT NOT NULL, target_lang TEXT NOT NULL,"
+            " service TEXT NOT NULL, translated_text TEXT NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (text, source_lang, target_lang, service))"
+        )
+        self._conn.commit()
+
+    def get(self, key: CacheKey, min_created_at: float) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translated_text FROM translations"
+                " WHERE text = ? AND source_lang = ? AND target_lang = ? AND service = ? AND created_at >= ?",
+                (*key, min_created_at),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: CacheKey, value: str, created_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, value, created_at),
+            )
+            self._conn.commit()
+
+    def prune(self, min_created_at: float):
+        """ลบรายการที่หมดอายุ และรายการเก่าสุดที่เกินจำนวนสูงสุด"""
+        with self._lock:
+            self._conn.execute("DELETE FROM translations WHERE created_at < ?", (min_created_at,))
+            self._conn.execute(
+                "DELETE FROM translations WHERE rowid NOT IN"
+                " (SELECT rowid FROM translations ORDER BY created_at DESC LIMIT ?)",
+                (self.max_rows,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM translations")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TranslationCache:
+    """Cache ผลการแปลในหน่วยความจำแบบ LRU + TTL พร้อม registry ที่ใช้ร่วมกันทุก worker
+    และ SQLite เป็นชั้นถัดไป (ไม่บังคับทั้งสองชั้น)"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400.0, db_path: str = "", db_max_rows: int = 100000,
+                 shared: Optional[Registry] = None, db_prune_every: int = 1000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # ลบแถวที่หมดอายุ/เกินจำนวนทุกๆ db_prune_every ครั้งที่เขียน ไม่ใช่แค่ตอนเปิด ไฟล์จะได้ไม่โตไม่จำกัด
+        self.db_prune_every = max(1, db_prune_every)
+        self._db_writes = 0
+        self.shared = shared
+        self._entries: "OrderedDict[CacheKey, Tuple[str, float]]" = OrderedDict()
+        self.store: Optional[SQLiteCacheStore] = None
+        if db_path:
+            try:
+                self.store = SQLiteCacheStore(db_path, db_max_rows)
+                self.store.prune(time.time() - ttl)
+                logger.info(f"Translation cache persisted to: {db_path}")
+            except Exception as e:
+                logger.error(f"Cannot open translation cache database: {str(e)}")
+                self.store = None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, source_lang: str, target_lang: str, service: str) -> CacheKey:
+        return (normalize_text(text), source_lang, target_lang, service)
+
+    @staticmethod
+    def shared_key(key: CacheKey) -> str:
+        return "translation:" + hashlib.sha256(json.dumps(key, ensure_ascii=False).encode()).hexdigest()
+
+    async def get(self, text: str, source_lang: str, target_lang: str, service: str) -> Optional[str]:
+        key = self.make_key(text, source_lang, target_lang, service)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, created_at = entry
+            if now - created_at <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self.shared is not None:
+            try:
+                value = await self.shared.get(self.shared_key(key))
+            except Exception as e:
+                logger.error(f"Error reading shared translation cache: {str(e)}")
+                value = None
+            if value is not None:
+                self._put(key, value, now)
+                self.hits += 1
+                self.shared_hits += 1
+                return value
+
+        if self.store is not None:
+            try:
+                value = await asyncio.to_thread(self.store.get, key, now - self.ttl)
+            except Exception as e:
+                logger.error(f"Error reading translation cache database: {str(e)}")
+                value = None
+            if value is not None:
+                # ดึงกลับเข้าหน่วยความจำเพื่อให้ครั้งต่อไปไม่ต้องอ่านดิสก์
+                self._put(key, value, now)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, source_lang: str, target_lang: str, service: str, translated_text: str):
+        key = self.make_key(text, source_lang, target_lang, service)
+        now = time.time()
+        self._put(key, translated_text, now)
+        if self.shared is not None:
+            try:
+                await self.shared.set(self.shared_key(key), translated_text, self.ttl)
+            except Exception as e:
+                logger.error(f"Error writing shared translation cache: {str(e)}")
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.set, key, translated_text, now)
+                self._db_writes += 1
+                if self._db_writes % self.db_prune_every == 0:
+                    await asyncio.to_thread(self.store.prune, now - self.ttl)
+            except Exception as e:
+                logger.error(f"Error writing translation cache database: {str(e)}")
+
+    def _put(self, key: CacheKey, value: str, created_at: float):
+        self._entries[key] = (value, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def clear(self):
+        self._entries.clear()
+        if self.store is not None:
+            await asyncio.to_thread(self.store.clear)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "persistent": self.store is not None,
+            "shared": self.shared is not None,
+        }
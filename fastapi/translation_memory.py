@@ -0,0 +1,472 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from translation_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+LanguagePair = Tuple[str, str]
+
+# ตัวเลข เช่น 15, 3.5, 1,200, 10:30, 12/05 (นับเป็นตัวเลขเดียว)
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,:/]\d+)*")
+# ตัวแปรใน glossary เช่น "ห้อง {room} อยู่ชั้น {floor}"
+PLACEHOLDER_PATTERN = re.compile(r"\{(\w+)\}")
+# ตัวแทนตัวเลขใน key (อักขระ private use จึงไม่ชนกับข้อความจริงและไม่ถูกตัดเป็นวรรคตอน)
+NUMBER_TOKEN = "\ue000"
+# ตำแหน่งตัวเลขในคำแปลที่เก็บไว้ (ตัวเลขตัวที่ i ของประโยคต้นทางอยู่ระหว่าง \ue001 กับ \ue002)
+NUMBER_SLOT = re.compile("\ue001(\\d+)\ue002")
+# วรรคตอนท้ายประโยคที่ยอมให้ต่างจาก glossary ได้
+TRAILING_PUNCTUATION = r"[\s.,!?;:。、…]*"
+
+
+def strip_punctuation(text: str) -> str:
+    """ตัดเครื่องหมายวรรคตอนออก (ดูจากหมวด Unicode เพราะ \\w ของ regex ไม่นับสระ/วรรณยุกต์ไทย)"""
+    return "".join(ch for ch in text if not unicodedata.category(ch).startswith("P"))
+
+
+def match_key(text: str) -> Tuple[str, List[str]]:
+    """key สำหรับเทียบประโยค (ตัวเลขถูกแทนด้วย token, ไม่สนวรรคตอน/ตัวพิมพ์) และตัวเลขตามลำดับที่พบ"""
+    numbers = NUMBER_PATTERN.findall(text)
+    key = NUMBER_PATTERN.sub(NUMBER_TOKEN, text)
+    return normalize_text(strip_punctuation(key)), numbers
+
+
+def char_ngrams(key: str, n: int) -> Set[str]:
+    padded = f" {key} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def words_agree(words: List[str], other: List[str], threshold: float, n: int) -> bool:
+    """ประโยคสองประโยคต่างกันแค่การสะกดของบางคำ: จำนวนคำเท่ากันและทุกคู่คำที่ต่างกันคล้ายกันถึง threshold
+    (ประโยคที่มีคำเพิ่ม/หายไป เช่น "do open" กับ "do not open" ไม่ถือว่าตรงกัน แม้ n-gram จะคล้ายกันมาก)"""
+    if len(words) != len(other):
+        return False
+    for word, other_word in zip(words, other):
+        if word == other_word:
+            continue
+        if NUMBER_TOKEN in (word, other_word):
+            return False
+        grams, other_grams = char_ngrams(word, n), char_ngrams(other_word, n)
+        if 2.0 * len(grams & other_grams) / (len(grams) + len(other_grams)) < threshold:
+            return False
+    return True
+
+
+def number_template(target: str, numbers: List[str]) -> Optional[str]:
+    """แทนตัวเลขของประโยคต้นทางในคำแปลด้วยตำแหน่ง คืน None ถ้ามีตัวเลขที่หาในคำแปลไม่เจอ
+    (เช่น แปลเป็นตัวหนังสือ) ซึ่งแปลว่าแทนตัวเลขใหม่ลงไปตรงๆ ไม่ได้"""
+    if not numbers:
+        return target
+    slots = {}
+    for index, number in enumerate(numbers):
+        # ตัวเลขซ้ำกันใช้ตำแหน่งแรก
+        slots.setdefault(number, index)
+    found = set()
+
+    def replace(match: re.Match) -> str:
+        index = slots.get(match.group(0))
+        if index is None:
+            return match.group(0)
+        found.add(match.group(0))
+        return f"\ue001{index}\ue002"
+
+    template = NUMBER_PATTERN.sub(replace, target)
+    return template if found == set(slots) else None
+
+
+def compile_pattern(source: str) -> Optional[re.Pattern]:
+    """แปลงประโยคที่มีตัวแปร {name} เป็น regex (ตัวแปรจับข้อความใดๆ)"""
+    parts = PLACEHOLDER_PATTERN.split(" ".join(source.split()))
+    if len(parts) == 1:
+        return None
+    regex = []
+    names = set()
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            regex.append(re.escape(part))
+        elif part in names:
+            regex.append(f"(?P={part})")
+        else:
+            names.add(part)
+            regex.append(f"(?P<{part}>.+?)")
+    return re.compile("".join(regex) + TRAILING_PUNCTUATION, re.IGNORECASE)
+
+
+class MemoryEntry:
+    """ประโยคต้นทางหนึ่งประโยคกับคำแปลที่เก็บไว้"""
+
+    __slots__ = ("entry_id", "source", "target", "key", "numbers", "template", "grams", "pinned", "hits")
+
+    def __init__(self, entry_id: int, source: str, target: str, key: str, numbers: List[str],
+                 template: Optional[str], grams: Set[str], pinned: bool):
+        self.entry_id = entry_id
+        self.source = source
+        self.target = target
+        self.key = key
+        self.numbers = numbers
+        self.template = template
+        self.grams = grams
+        self.pinned = pinned
+        self.hits = 0
+
+
+class PatternEntry:
+    """รายการ glossary ที่มีตัวแปร {name} (เทียบแบบ template ไม่ใช่ความคล้าย)"""
+
+    __slots__ = ("source", "target", "regex", "hits")
+
+    def __init__(self, source: str, target: str, regex: re.Pattern):
+        self.source = source
+        self.target = target
+        self.regex = regex
+        self.hits = 0
+
+    def fill(self, text: str) -> Optional[str]:
+        match = self.regex.fullmatch(" ".join(text.split()))
+        if match is None:
+            return None
+        values = match.groupdict()
+        return PLACEHOLDER_PATTERN.sub(lambda m: values.get(m.group(1), m.group(0)), self.target)
+
+
+class MemoryMatch:
+    """ผลการค้นใน translation memory"""
+
+    def __init__(self, target: str, score: float, kind: str, source: str):
+        self.target = target
+        self.score = score
+        self.kind = kind  # exact, substituted (key ตรงแต่แทนตัวเลขใหม่), fuzzy หรือ pattern
+        self.source = source
+
+
+class LanguageIndex:
+    """index ของคู่ภาษาเดียว: key ตรงตัว + inverted index ของ character n-gram สำหรับหาประโยคที่คล้าย"""
+
+    def __init__(self, ngram: int):
+        self.ngram = ngram
+        self.entries: Dict[int, MemoryEntry] = {}
+        self.by_key: Dict[str, int] = {}
+        self.postings: Dict[str, Set[int]] = defaultdict(set)
+        self.patterns: List[PatternEntry] = []
+        # ลำดับที่เพิ่มรายการที่เรียนรู้จากการแปลจริง (ใช้เลือกรายการที่จะลบเมื่อเต็ม)
+        self.learned: "OrderedDict[int, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries) + len(self.patterns)
+
+    def add(self, entry: MemoryEntry):
+        existing = self.by_key.get(entry.key)
+        if existing is not None:
+            if self.entries[existing].pinned and not entry.pinned:
+                # ไม่เขียนทับคำแปลจาก glossary ด้วยคำแปลของ provider
+                return
+            self.remove(existing)
+        self.entries[entry.entry_id] = entry
+        self.by_key[entry.key] = entry.entry_id
+        for gram in entry.grams:
+            self.postings[gram].add(entry.entry_id)
+        if not entry.pinned:
+            self.learned[entry.entry_id] = None
+
+    def remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        if self.by_key.get(entry.key) == entry_id:
+            del self.by_key[entry.key]
+        for gram in entry.grams:
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self.postings[gram]
+        self.learned.pop(entry_id, None)
+
+    def evict_oldest(self) -> bool:
+        if not self.learned:
+            return False
+        entry_id, _ = self.learned.popitem(last=False)
+        self.remove(entry_id)
+        return True
+
+    def candidates(self, grams: Set[str], threshold: float, limit: int) -> List[Tuple[float, MemoryEntry]]:
+        """รายการที่ Dice similarity ของ n-gram >= threshold เรียงจากคล้ายที่สุด"""
+        size = len(grams)
+        # Dice >= t ต้องมีจำนวน gram อยู่ในช่วง [size * t / (2 - t), size * (2 - t) / t]
+        min_size = size * threshold / (2 - threshold)
+        max_size = size * (2 - threshold) / threshold
+        overlap: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for entry_id in self.postings.get(gram, ()):
+                overlap[entry_id] += 1
+        scored = []
+        for entry_id, shared in overlap.items():
+            entry = self.entries[entry_id]
+            other = len(entry.grams)
+            if other < min_size or other > max_size:
+                continue
+            score = 2.0 * shared / (size + other)
+            if score >= threshold:
+                scored.append((score, entry))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored[:limit]
+
+
+class TranslationMemory:
+    """เก็บประโยคที่เคยแปลแล้วแยกตามคู่ภาษา คืนคำแปลเดิมเมื่อประโยคตรงกัน (ไม่สนวรรคตอน/ตัวพิมพ์)
+    โดยแทนตัวเลขใหม่ลงในคำแปลได้ และรองรับ glossary ที่มีตัวแปร {name} ซึ่ง import/export เป็น NDJSON
+    (fuzzy=True ใช้คำแปลของประโยคที่คล้ายกันด้วย character n-gram ซึ่งต่างกันได้แค่การสะกดของคำ)"""
+
+    def __init__(
+        self,
+        max_entries: int = 50000,
+        threshold: float = 0.9,
+        substitute_numbers: bool = True,
+        fuzzy: bool = False,
+        ngram: int = 3,
+        max_candidates: int = 20,
+        path: str = "",
+    ):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Translation memory threshold must be in (0, 1]: {threshold}")
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.substitute_numbers = substitute_numbers
+        self.fuzzy = fuzzy
+        self.ngram = ngram
+        self.max_candidates = max_candidates
+        self.path = path
+        self._indexes: Dict[LanguagePair, LanguageIndex] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._entries = 0
+        self.hits = {"exact": 0, "substituted": 0, "fuzzy": 0, "pattern": 0}
+        self.substituted = 0
+        self.rejected = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lookup_seconds = 0.0
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return self._entries
+
+    def _index(self, source_lang: str, target_lang: str) -> LanguageIndex:
+        pair = (source_lang, target_lang)
+        index = self._indexes.get(pair)
+        if index is None:
+            index = self._indexes[pair] = LanguageIndex(self.ngram)
+        return index
+
+    def add(self, source: str, target: str, source_lang: str, target_lang: str, pinned: bool = False) -> bool:
+        """เพิ่มคู่ประโยค (pinned = มาจาก glossary ไม่ถูกลบเมื่อเต็มและไม่ถูกเขียนทับ) คืน False ถ้าใช้ไม่ได้"""
+        if not source or not source.strip() or not target or source_lang == target_lang:
+            return False
+        regex = compile_pattern(source) if pinned else None
+        with self._lock:
+            index = self._index(source_lang, target_lang)
+            before = len(index)
+            if regex is not None:
+                index.patterns = [p for p in index.patterns if p.source != source]
+                index.patterns.append(PatternEntry(source, target, regex))
+            else:
+                key, numbers = match_key(source)
+                if not key.strip(NUMBER_TOKEN + " "):
+                    # มีแต่ตัวเลข/วรรคตอน ไม่มีอะไรให้เทียบ
+                    return False
+                self._next_id += 1
+                index.add(MemoryEntry(
+                    self._next_id, source, target, key, numbers,
+                    number_template(target, numbers), char_ngrams(key, self.ngram), pinned,
+                ))
+            self._entries += len(index) - before
+            while self.max_entries and self._entries > self.max_entries:
+                if not self._evict():
+                    break
+        return True
+
+    def _evict(self) -> bool:
+        # ลบรายการที่เรียนรู้เก่าสุดของคู่ภาษาที่ใหญ่ที่สุด
+        for index in sorted(self._indexes.values(), key=len, reverse=True):
+            if index.evict_oldest():
+                self._entries -= 1
+                self.evictions += 1
+                return True
+        return False
+
+    def lookup(self, text: str, source_lang: str, target_lang: str,
+               pinned: Optional[bool] = None) -> Optional[MemoryMatch]:
+        """หาคำแปลจาก memory คืน None ถ้าไม่มีประโยคที่ตรงหรือคล้ายพอ
+        (pinned=True ค้นเฉพาะ glossary, pinned=False ค้นเฉพาะรายการที่เรียนรู้จากการแปล, None ค้นทั้งหมด)"""
+        started = time.perf_counter()
+        with self._lock:
+            match = self._lookup(text, source_lang, target_lang, pinned)
+            if match is not None:
+                self.hits[match.kind] += 1
+            elif pinned is not True:
+                # การค้นเฉพาะ glossary ก่อนเปิด cache ไม่นับเป็น miss (จะถูกค้นต่อด้วย pinned=False)
+                self.misses += 1
+            self.lookup_seconds += time.perf_counter() - started
+        return match
+
+    def _lookup(self, text: str, source_lang: str, target_lang: str,
+                pinned: Optional[bool]) -> Optional[MemoryMatch]:
+        index = self._indexes.get((source_lang, target_lang))
+        if index is None or not text or not text.strip():
+            return None
+
+        if pinned is not False:
+            for pattern in index.patterns:
+                filled = pattern.fill(text)
+                if filled is not None:
+                    pattern.hits += 1
+                    return MemoryMatch(filled, 1.0, "pattern", pattern.source)
+
+        key, numbers = match_key(text)
+        entry_id = index.by_key.get(key)
+        if entry_id is not None and pinned in (None, index.entries[entry_id].pinned):
+            entry = index.entries[entry_id]
+            target = self._apply_numbers(entry, numbers)
+            if target is None:
+                return None
+            entry.hits += 1
+            return MemoryMatch(target, 1.0, "exact" if numbers == entry.numbers else "substituted", entry.source)
+
+        if not self.fuzzy or pinned is True:
+            return None
+        words = key.split()
+        for score, entry in index.candidates(char_ngrams(key, self.ngram), self.threshold, self.max_candidates):
+            if entry.key == key:
+                continue
+            if not words_agree(words, entry.key.split(), self.threshold, self.ngram):
+                continue
+            target = self._apply_numbers(entry, numbers)
+            if target is None:
+                continue
+            entry.hits += 1
+            return MemoryMatch(target, score, "fuzzy", entry.source)
+        return None
+
+    def _apply_numbers(self, entry: MemoryEntry, numbers: List[str]) -> Optional[str]:
+        """คำแปลของ entry สำหรับตัวเลขชุดใหม่ คืน None ถ้าตัวเลขต่างกันและแทนลงไปไม่ได้
+        (ตัวเลขผิดในคำแปลแย่กว่าส่งไปแปลใหม่)"""
+        if numbers == entry.numbers:
+            return entry.target
+        if not self.substitute_numbers or entry.template is None or len(numbers) != len(entry.numbers):
+            self.rejected += 1
+            return None
+        self.substituted += 1
+        return NUMBER_SLOT.sub(lambda m: numbers[int(m.group(1))], entry.template)
+
+    def import_entries(self, records: Iterable[dict], source_lang: str = "", target_lang: str = "") -> Tuple[int, int]:
+        """เพิ่มรายการจาก glossary (dict ที่มี source, target และ source_lang/target_lang ถ้าไม่ได้ระบุค่าเริ่มต้น)
+        คืน (จำนวนที่เพิ่ม, จำนวนที่ข้าม)"""
+        imported = skipped = 0
+        for record in records:
+            try:
+                added = self.add(
+                    str(record["source"]),
+                    str(record["target"]),
+                    str(record.get("source_lang") or source_lang),
+                    str(record.get("target_lang") or target_lang),
+                    pinned=bool(record.get("pinned", True)),
+                )
+            except (KeyError, TypeError, AttributeError):
+                added = False
+            if added:
+                imported += 1
+            else:
+                skipped += 1
+        return imported, skipped
+
+    def export_entries(self, source_lang: str = "", target_lang: str = "") -> Iterator[dict]:
+        """รายการทั้งหมด (กรองตามภาษาได้) ในรูปแบบเดียวกับที่ import_entries รับ"""
+        with self._lock:
+            snapshot = [
+                (pair, list(index.patterns), list(index.entries.values()))
+                for pair, index in self._indexes.items()
+                if (not source_lang or pair[0] == source_lang) and (not target_lang or pair[1] == target_lang)
+            ]
+        for (src, tgt), patterns, entries in snapshot:
+            for pattern in patterns:
+                yield {"source_lang": src, "target_lang": tgt, "source": pattern.source,
+                       "target": pattern.target, "pinned": True}
+            for entry in entries:
+                yield {"source_lang": src, "target_lang": tgt, "source": entry.source,
+                       "target": entry.target, "pinned": entry.pinned}
+
+    def load(self, path: str):
+        try:
+            with open(path, encoding="utf-8") as f:
+                imported, skipped = self.import_entries(parse_records(f))
+            logger.info(f"Loaded {imported} translation memory entries from {path} ({skipped} skipped)")
+        except Exception as e:
+            logger.error(f"Error loading translation memory from {path}: {str(e)}")
+
+    def save(self, path: str):
+        """เขียนเป็น NDJSON ผ่านไฟล์ชั่วคราว เพื่อไม่ให้ไฟล์เดิมเสียถ้าเขียนไม่จบ
+        (ไฟล์ชั่วคราวของแต่ละ process ไม่ซ้ำกัน worker ที่ปิดพร้อมกันจึงไม่เขียนทับไฟล์ชั่วคราวของกันและกัน)"""
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(path)), prefix=f"{os.path.basename(path)}.", suffix=".tmp"
+            )
+            # mkstemp สร้างไฟล์ที่อ่านได้เฉพาะเจ้าของ
+            os.chmod(temp_path, 0o644)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for record in self.export_entries():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(temp_path, path)
+            temp_path = None
+            logger.info(f"Saved {len(self)} translation memory entries to {path}")
+        except Exception as e:
+            logger.error(f"Error saving translation memory to {path}: {str(e)}")
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def close(self):
+        if self.path:
+            self.save(self.path)
+
+    def stats(self) -> dict:
+        lookups = self.misses + sum(self.hits.values())
+        return {
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "fuzzy": self.fuzzy,
+            "language_pairs": {
+                f"{src}-{tgt}": len(index) for (src, tgt), index in self._indexes.items()
+            },
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_rate": round(sum(self.hits.values()) / lookups, 3) if lookups else 0.0,
+            "numbers_substituted": self.substituted,
+            "rejected_number_mismatch": self.rejected,
+            "evictions": self.evictions,
+            "avg_lookup_ms": round(self.lookup_seconds / lookups * 1000, 3) if lookups else 0.0,
+        }
+
+
+def parse_records(lines: Iterable[str]) -> Iterator[dict]:
+    """อ่าน NDJSON ทีละบรรทัด (ข้ามบรรทัดว่าง) ให้ ValueError ถ้าบรรทัดไหนไม่ใช่ JSON object"""
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {number} is not a JSON object")
+        yield record
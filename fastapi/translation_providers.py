@@ -0,0 +1,364 @@
+import asyncio
+import html
+import logging
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple, Type
+
+from backend_health import BackendMonitor
+from http_client import HttpClientManager
+from metrics import BACKEND_REQUESTS, TRANSLATION_FALLBACKS, status_label
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """จำกัดอัตราการเรียก provider: เติม token ตาม rate ต่อวินาที สะสมได้ไม่เกิน capacity"""
+
+    def __init__(self, rate: float, capacity: float = 0.0):
+        self.rate = rate
+        self.capacity = capacity if capacity > 0 else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.throttled = 0
+        self.waited = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1.0, max_wait: Optional[float] = None) -> bool:
+        """รอจนมี token พอ คืน False ทันทีถ้าต้องรอนานกว่า max_wait (ไม่หัก token)"""
+        if self.rate <= 0:
+            return True
+        self._refill()
+        wait = max(0.0, (tokens - self.tokens) / self.rate)
+        if max_wait is not None and wait > max_wait:
+            self.throttled += 1
+            return False
+        # จอง token ไว้ก่อน (ติดลบได้) เพื่อให้ผู้ที่รอหลายรายได้คิวตามลำดับ
+        self.tokens -= tokens
+        if wait > 0:
+            self.waited += wait
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # ถูกยกเลิกระหว่างรอ: คืน token ที่จองไว้ให้ผู้ที่รอต่อจากนี้
+                self.tokens += tokens
+                raise
+        return True
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "rate_per_second": self.rate,
+            "capacity": self.capacity,
+            "tokens": round(self.tokens, 2),
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited, 2),
+        }
+
+
+class TranslationProvider:
+    """บริการแปลภาษาหนึ่งราย พร้อมความสามารถที่ประกาศไว้ (คู่ภาษา, ขนาด batch, จำนวนตัวอักษร)"""
+
+    name = ""
+    default_max_batch_size = 50
+    default_max_chars = 5000
+    # None = ไม่จำกัดภาษา (ให้บริการปลายทางเป็นผู้ตัดสิน)
+    default_languages: Optional[FrozenSet[str]] = None
+
+    def __init__(
+        self,
+        http_clients: HttpClientManager,
+        backend: str,
+        url: str = "",
+        api_key: str = "",
+        languages: Optional[Iterable[str]] = None,
+        max_batch_size: int = 0,
+        max_chars: int = 0,
+        rate_limit: float = 0.0,
+        burst: float = 0.0,
+        latency_budget: float = 10.0,
+        timeout: float = 30.0,
+    ):
+        self.http_clients = http_clients
+        self.backend = backend
+        self.url = url
+        self.api_key = api_key
+        self.languages = frozenset(languages) if languages else self.default_languages
+        self.max_batch_size = max_batch_size or self.default_max_batch_size
+        self.max_chars = max_chars or self.default_max_chars
+        self.rate_limiter = TokenBucket(rate_limit, burst)
+        self.latency_budget = latency_budget
+        self.timeout = timeout
+
+    @property
+    def probe_url(self) -> Optional[str]:
+        """URL สำหรับ health probe (None = ติดตามจากผลของ request จริง)"""
+        return None
+
+    def is_configured(self) -> bool:
+        return True
+
+    def supports(self, source_lang: str, target_lang: str) -> bool:
+        return self.languages is None or (source_lang in self.languages and target_lang in self.languages)
+
+    def split_batches(self, texts: List[str]) -> List[List[str]]:
+        """แบ่งข้อความเป็นชุดที่ไม่เกิน max_batch_size และ max_chars ต่อ request"""
+        batches: List[List[str]] = []
+        current: List[str] = []
+        chars = 0
+        for text in texts:
+            if current and (len(current) >= self.max_batch_size or chars + len(text) > self.max_chars):
+                batches.append(current)
+                current, chars = [], 0
+            current.append(text)
+            chars += len(text)
+        if current:
+            batches.append(current)
+        return batches
+
+    async def translate(self, texts: List[str], source_lang: str, target_lang: str) -> Optional[List[str]]:
+        """แปลข้อความหนึ่งชุด (ไม่เกินความสามารถที่ประกาศไว้) คืน None ถ้าล้มเหลว"""
+        raise NotImplementedError
+
+    def capabilities(self) -> dict:
+        return {
+            "languages": sorted(self.languages) if self.languages is not None else "any",
+            "max_batch_size": self.max_batch_size,
+            "max_chars": self.max_chars,
+            "latency_budget": self.latency_budget,
+        }
+
+
+class LibreTranslateProvider(TranslationProvider):
+    """LibreTranslate (open-source ติดตั้งเองได้)"""
+
+    name = "libre"
+
+    @property
+    def probe_url(self) -> Optional[str]:
+        # /languages มีให้ probe ได้โดยไม่ต้องแปลจริง
+        return self.url.replace("/translate", "/languages")
+
+    async def translate(self, texts: List[str], source_lang: str, target_lang: str) -> Optional[List[str]]:
+        payload = {
+            "q": texts,
+            "source": source_lang,
+            "target": target_lang,
+            "format": "text"
+        }
+        if self.api_key:
+            payload["api_key"] = self.api_key
+
+        response = await self.http_clients.post(self.backend, self.url, json=payload, timeout=self.timeout)
+        BACKEND_REQUESTS.labels(self.backend, status_label(response.status_code)).inc()
+        if response.status_code != 200:
+            logger.error(f"LibreTranslate API error: {response.status_code}, {response.text}")
+            return None
+        translated = response.json().get("translatedText", "")
+        # q เป็น list จะได้ list กลับมา (บางเวอร์ชันคืน string เมื่อมีข้อความเดียว)
+        return translated if isinstance(translated, list) else [translated]
+
+
+class GoogleTranslateProvider(TranslationProvider):
+    """Google Cloud Translation API v2 (ต้องใช้ API key)"""
+
+    name = "google"
+    default_max_batch_size = 128
+    default_max_chars = 30000
+
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    async def translate(self, texts: List[str], source_lang: str, target_lang: str) -> Optional[List[str]]:
+        url = f"{self.url or 'https://translation.googleapis.com/language/translate/v2'}?key={self.api_key}"
+        payload = {
+            "q": texts,
+            "source": source_lang,
+            "target": target_lang,
+            "format": "text"
+        }
+
+        response = await self.http_clients.post(self.backend, url, json=payload, timeout=self.timeout)
+        BACKEND_REQUESTS.labels(self.backend, status_label(response.status_code)).inc()
+        if response.status_code != 200:
+            logger.error(f"Google Translate API error: {response.status_code}, {response.text}")
+            return None
+        translations = response.json().get("data", {}).get("translations", [])
+        if not translations:
+            return None
+        return [html.unescape(t.get("translatedText", "")) for t in translations]
+
+
+class DeepLProvider(TranslationProvider):
+    """DeepL API (ต้องใช้ API key)"""
+
+    name = "deepl"
+    default_max_batch_size = 50
+    default_max_chars = 30000
+    default_languages = frozenset({
+        "ar", "bg", "cs", "da", "de", "el", "en", "es", "et", "fi", "fr", "hu", "id", "it", "ja", "ko",
+        "lt", "lv", "nb", "nl", "pl", "pt", "ro", "ru", "sk", "sl", "sv", "tr", "uk", "zh",
+    })
+
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    async def translate(self, texts: List[str], source_lang: str, target_lang: str) -> Optional[List[str]]:
+        headers = {
+            "Authorization": f"DeepL-Auth-Key {self.api_key}"
+        }
+        payload = {
+            "text": texts,
+            "source_lang": source_lang.upper(),
+            "target_lang": target_lang.upper()
+        }
+
+        # ค่าเริ่มต้นใช้ API ฟรีของ DeepL
+        url = self.url or "https://api-free.deepl.com/v2/translate"
+        response = await self.http_clients.post(self.backend, url, headers=headers, json=payload, timeout=self.timeout)
+        BACKEND_REQUESTS.labels(self.backend, status_label(response.status_code)).inc()
+        if response.status_code != 200:
+            logger.error(f"DeepL API error: {response.status_code}, {response.text}")
+            return None
+        translations = response.json().get("translations", [])
+        if not translations:
+            return None
+        return [t.get("text", "") for t in translations]
+
+
+# provider ที่เลือกได้จาก TRANSLATION_PROVIDERS (เพิ่ม provider ใหม่ด้วย register_provider)
+PROVIDER_TYPES: Dict[str, Type[TranslationProvider]] = {
+    LibreTranslateProvider.name: LibreTranslateProvider,
+    GoogleTranslateProvider.name: GoogleTranslateProvider,
+    DeepLProvider.name: DeepLProvider,
+}
+
+
+def register_provider(provider_type: Type[TranslationProvider]):
+    PROVIDER_TYPES[provider_type.name] = provider_type
+
+
+class TranslationRouter:
+    """ส่งคำขอแปลไปยัง provider ตามลำดับที่ตั้งไว้ ถ้า provider ล้มเหลว ติด rate limit
+    หรือใช้เวลาเกิน latency budget จะย้ายไปยัง provider ถัดไปที่รองรับคู่ภาษานั้น"""
+
+    def __init__(self, monitor: BackendMonitor, providers: List[TranslationProvider]):
+        self.monitor = monitor
+        self.providers = providers
+        for provider in providers:
+            monitor.register(provider.backend, provider.probe_url)
+        self.served: Dict[str, int] = {provider.name: 0 for provider in providers}
+
+    @property
+    def is_available(self) -> bool:
+        return any(self.monitor.get(provider.backend).is_available for provider in self.providers)
+
+    def accepting(self) -> bool:
+        """มี provider ที่ circuit breaker ยอมให้ส่งงาน (หรือถึงเวลาลองใหม่) อย่างน้อยหนึ่งราย"""
+        return any(not self.monitor.get(provider.backend).breaker.is_blocking for provider in self.providers)
+
+    def preferred_provider(self, source_lang: str, target_lang: str) -> Optional[str]:
+        """ชื่อ provider ที่จะได้รับงานของคู่ภาษานี้ถ้าส่งตอนนี้ (ใช้เป็นส่วนหนึ่งของ key ของ cache)"""
+        for provider in self.providers:
+            if provider.supports(source_lang, target_lang) and not self.monitor.get(provider.backend).breaker.is_blocking:
+                return provider.name
+        return None
+
+    async def translate(self, texts: List[str], source_lang: str, target_lang: str) -> Optional[Tuple[List[str], str]]:
+        """แปลข้อความทั้งชุดด้วย provider แรกที่ทำได้สำเร็จ คืน (ผลการแปล, ชื่อ provider ที่แปล)
+        หรือ None ถ้าทุกรายล้มเหลว"""
+        candidates = [p for p in self.providers if p.supports(source_lang, target_lang)]
+        if not candidates:
+            logger.error(f"No translation provider supports {source_lang}->{target_lang}")
+            return None
+
+        for index, provider in enumerate(candidates):
+            # provider สุดท้ายไม่มีที่ให้ย้ายไปแล้ว จึงรอได้จนถึง timeout ปกติแทน latency budget
+            has_fallback = index < len(candidates) - 1
+            if not self.monitor.allow_request(provider.backend):
+                TRANSLATION_FALLBACKS.labels(provider.name, "circuit_open").inc()
+                logger.warning(f"Translation provider {provider.name} skipped (circuit open)")
+                continue
+
+            budget = provider.latency_budget if has_fallback else provider.timeout
+            recorded = False
+            try:
+                batches = provider.split_batches(texts)
+                # ขอ token ของทุกชุดพร้อมกันก่อนส่ง (นอกช่วงจับเวลาของ backend เพราะการรอ rate limit
+                # ในเครื่องไม่ใช่ความผิดของ backend) เพื่อไม่ให้ส่งไปแล้วบางชุดแต่ชุดที่เหลือติด rate limit
+                if not await provider.rate_limiter.acquire(len(batches), max_wait=budget):
+                    TRANSLATION_FALLBACKS.labels(provider.name, "rate_limited").inc()
+                    logger.warning(f"Translation provider {provider.name} is rate limited")
+                    continue
+
+                started = time.perf_counter()
+                try:
+                    results = await asyncio.wait_for(
+                        self._translate_with(provider, batches, source_lang, target_lang), budget
+                    )
+                except asyncio.TimeoutError:
+                    BACKEND_REQUESTS.labels(provider.backend, "timeout").inc()
+                    TRANSLATION_FALLBACKS.labels(provider.name, "timeout").inc()
+                    logger.warning(f"Translation provider {provider.name} exceeded latency budget {budget:.1f}s")
+                    recorded = True
+                    await self.monitor.record_result(provider.backend, False, error="latency budget exceeded")
+                    continue
+                except Exception as e:
+                    BACKEND_REQUESTS.labels(provider.backend, "error").inc()
+                    TRANSLATION_FALLBACKS.labels(provider.name, "error").inc()
+                    logger.error(f"Translation provider {provider.name} error: {str(e)}")
+                    recorded = True
+                    await self.monitor.record_result(provider.backend, False, error=str(e) or type(e).__name__)
+                    continue
+
+                elapsed = time.perf_counter() - started
+                recorded = True
+                if results is None:
+                    TRANSLATION_FALLBACKS.labels(provider.name, "failed").inc()
+                    await self.monitor.record_result(provider.backend, False, elapsed, "translation failed")
+                    continue
+                await self.monitor.record_result(provider.backend, True, elapsed)
+            finally:
+                if not recorded:
+                    # ไม่ได้ผลจาก backend (ติด rate limit หรือถูกยกเลิก): คืนสิทธิ์ทดลองของ half_open
+                    # ไม่เช่นนั้น provider ที่ไม่มี health probe จะติดอยู่ใน half_open ตลอดไป
+                    self.monitor.release_trial(provider.backend)
+            self.served[provider.name] += 1
+            if index > 0:
+                logger.info(f"Translated with fallback provider {provider.name}")
+            return results, provider.name
+
+        return None
+
+    async def _translate_with(
+        self, provider: TranslationProvider, batches: List[List[str]], source_lang: str, target_lang: str
+    ) -> Optional[List[str]]:
+        async def send(batch: List[str]) -> Optional[List[str]]:
+            results = await provider.translate(batch, source_lang, target_lang)
+            if results is not None and len(results) != len(batch):
+                logger.error(f"{provider.name} returned {len(results)} results for {len(batch)} texts")
+                return None
+            return results
+
+        batch_results = await asyncio.gather(*(send(batch) for batch in batches))
+        if any(results is None for results in batch_results):
+            return None
+        return [text for results in batch_results for text in results]
+
+    def stats(self) -> dict:
+        return {
+            "fallback_order": [provider.name for provider in self.providers],
+            "providers": {
+                provider.name: {
+                    "backend": provider.backend,
+                    "available": self.monitor.get(provider.backend).is_available,
+                    "served": self.served[provider.name],
+                    **provider.capabilities(),
+                    "rate_limit": provider.rate_limiter.stats(),
+                }
+                for provider in self.providers
+            },
+        }
@@ -0,0 +1,293 @@
+import asyncio
+import io
+import logging
+import wave
+from typing import BinaryIO, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+async def decode_to_pcm(audio_data: bytes, sample_rate: int = 16000) -> Optional[np.ndarray]:
+    """ถอดรหัสไฟล์เสียง (webm/opus ฯลฯ) เป็น PCM 16-bit mono ด้วย ffmpeg โดยไม่ block event loop"""
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate),
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate(audio_data)
+    if process.returncode != 0:
+        logger.warning(f"ffmpeg decode failed: {stderr.decode(errors='ignore').strip()[:200]}")
+        return None
+    return np.frombuffer(stdout, dtype=np.int16)
+
+
+async def decode_file_to_pcm(input_path: str, output_path: str, sample_rate: int = 16000) -> bool:
+    """ถอดรหัสไฟล์เสียงบนดิสก์เป็นไฟล์ PCM 16-bit mono (ใช้กับไฟล์ยาว เพื่อไม่ต้องโหลดทั้งไฟล์เข้าหน่วยความจำ)"""
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", input_path,
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate),
+        output_path,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        logger.warning(f"ffmpeg decode failed: {stderr.decode(errors='ignore').strip()[:200]}")
+        return False
+    return True
+
+
+async def feed_file(process: asyncio.subprocess.Process, audio_file: BinaryIO, chunk_size: int = 64 * 1024):
+    """ส่งเนื้อไฟล์เข้า stdin ของ ffmpeg ทีละช่วง (ไม่อ่านทั้งไฟล์เข้าหน่วยความจำ)"""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(audio_file.read, chunk_size)
+            if not chunk:
+                break
+            process.stdin.write(chunk)
+            await process.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        process.stdin.close()
+
+
+async def decode_stream_to_pcm(
+    audio_file: BinaryIO,
+    sample_rate: int = 16000,
+    chunk_size: int = 64 * 1024,
+) -> Optional[np.ndarray]:
+    """ถอดรหัส file object (เช่นไฟล์อัปโหลดที่ spool ไว้) เป็น PCM 16-bit mono โดย stream เข้า ffmpeg
+    หน่วยความจำที่ใช้จึงเป็นขนาดของ PCM ไม่ใช่ขนาดไฟล์ต้นฉบับบวก PCM"""
+    audio_file.seek(0)
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate),
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    feeder = asyncio.create_task(feed_file(process, audio_file, chunk_size))
+    try:
+        stdout, stderr = await asyncio.gather(process.stdout.read(), process.stderr.read())
+        await process.wait()
+    finally:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        feeder.cancel()
+        await asyncio.gather(feeder, return_exceptions=True)
+        audio_file.seek(0)
+    if process.returncode != 0:
+        logger.warning(f"ffmpeg decode failed: {stderr.decode(errors='ignore').strip()[:200]}")
+        return None
+    return np.frombuffer(stdout, dtype=np.int16)
+
+
+async def measure_duration(
+    audio_file: BinaryIO,
+    max_seconds: float = 0.0,
+    sample_rate: int = 8000,
+    chunk_size: int = 64 * 1024,
+) -> Optional[float]:
+    """วัดความยาวเสียงด้วยการถอดรหัสแบบ stream ทีละช่วง (ไม่เก็บ PCM ไว้)
+    หยุดทันทีเมื่อยาวเกิน max_seconds และคืน None ถ้าถอดรหัสไม่ได้"""
+    audio_file.seek(0)
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate),
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+
+    feeder = asyncio.create_task(feed_file(process, audio_file, chunk_size))
+    decoded = 0
+    exceeded = False
+    finished = False
+    try:
+        while True:
+            chunk = await process.stdout.read(chunk_size)
+            if not chunk:
+                finished = True
+                break
+            decoded += len(chunk)
+            if max_seconds and decoded > max_seconds * sample_rate * 2:
+                exceeded = True
+                break
+    finally:
+        if not finished:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        feeder.cancel()
+        await asyncio.gather(feeder, return_exceptions=True)
+        await process.wait()
+        audio_file.seek(0)
+
+    if not exceeded and process.returncode != 0:
+        logger.warning(f"ffmpeg could not decode upload (exit code {process.returncode})")
+        return None
+    return decoded / 2 / sample_rate
+
+
+def encode_wav(pcm: np.ndarray, sample_rate: int = 16000) -> bytes:
+    """แปลง PCM 16-bit mono เป็นไฟล์ WAV"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+
+class VadResult:
+    """ผลการตรวจจับเสียงพูดของ chunk หนึ่ง"""
+
+    def __init__(self, has_speech: bool, duration: float, speech_duration: float,
+                 speech_start: float = 0.0, speech_end: float = 0.0):
+        self.has_speech = has_speech
+        self.duration = duration
+        self.speech_duration = speech_duration
+        self.speech_start = speech_start
+        self.speech_end = speech_end
+
+
+class FilterResult:
+    """ผลของการกรอง chunk: ข้ามทั้งชิ้น หรือส่งต่อ (อาจถูกตัดช่วงเงียบหัวท้ายแล้ว)"""
+
+    def __init__(self, skip: bool, audio_data: bytes, duration: float = 0.0, trimmed: float = 0.0,
+                 pcm: Optional[np.ndarray] = None):
+        self.skip = skip
+        self.audio_data = audio_data
+        self.duration = duration
+        self.trimmed = trimmed
+        # PCM ที่ถอดรหัสแล้ว (ก่อนตัด) ให้ขั้นตอนถัดไปใช้ต่อได้โดยไม่ต้องถอดรหัสซ้ำ
+        self.pcm = pcm
+
+
+class VoiceActivityDetector:
+    """ตรวจจับเสียงพูดด้วยพลังงานต่อเฟรมและอัตราการตัดศูนย์ (คำนวณแบบ vectorized ด้วย NumPy)"""
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        frame_ms: float = 30.0,
+        energy_threshold_db: float = -45.0,
+        noise_margin_db: float = 10.0,
+        max_noise_floor_db: float = -35.0,
+        zcr_max: float = 0.25,
+        min_speech_ms: float = 250.0,
+        trim: bool = False,
+        trim_padding_ms: float = 200.0,
+    ):
+        self.sample_rate = sample_rate
+        self.frame_length = max(1, int(sample_rate * frame_ms / 1000))
+        self.energy_threshold_db = energy_threshold_db
+        self.noise_margin_db = noise_margin_db
+        self.max_noise_floor_db = max_noise_floor_db
+        self.zcr_max = zcr_max
+        self.min_speech_ms = min_speech_ms
+        self.trim = trim
+        self.trim_padding = int(sample_rate * trim_padding_ms / 1000)
+        self._ffmpeg_available = True
+        self.chunks_total = 0
+        self.chunks_skipped = 0
+        self.seconds_skipped = 0.0
+        self.seconds_trimmed = 0.0
+        self.decode_failures = 0
+
+    def analyze(self, pcm: np.ndarray) -> VadResult:
+        """วิเคราะห์ PCM ว่ามีเสียงพูดหรือไม่ และอยู่ช่วงไหน"""
+        duration = len(pcm) / self.sample_rate
+        frame_count = len(pcm) // self.frame_length
+        if frame_count == 0:
+            return VadResult(False, duration, 0.0)
+
+        frames = pcm[:frame_count * self.frame_length].reshape(frame_count, self.frame_length).astype(np.float32) / 32768.0
+        rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        energy_db = 20.0 * np.log10(rms + 1e-10)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+        # เกณฑ์ปรับตามระดับเสียงรบกวนของ chunk (percentile ต่ำ = ช่วงที่เงียบที่สุด)
+        # จำกัดเพดานไว้ เพราะ chunk ที่พูดต่อเนื่องทั้งชิ้นจะมี percentile ต่ำสูงเกินจริง
+        noise_floor_db = min(np.percentile(energy_db, 10), self.max_noise_floor_db)
+        threshold_db = max(self.energy_threshold_db, noise_floor_db + self.noise_margin_db)
+
+        # เฟรมที่ดังแต่ ZCR สูงมักเป็น noise ยกเว้นดังกว่าเกณฑ์มาก (เช่นเสียงเสียดแทรก)
+        loud = energy_db > threshold_db
+        speech = loud & ((zcr < self.zcr_max) | (energy_db > threshold_db + self.noise_margin_db))
+
+        frame_seconds = self.frame_length / self.sample_rate
+        speech_duration = float(np.count_nonzero(speech)) * frame_seconds
+        if speech_duration * 1000 < self.min_speech_ms:
+            return VadResult(False, duration, speech_duration)
+
+        indices = np.flatnonzero(speech)
+        return VadResult(
+            True,
+            duration,
+            speech_duration,
+            float(indices[0]) * frame_seconds,
+            float(indices[-1] + 1) * frame_seconds,
+        )
+
+    async def filter(self, audio_data: bytes) -> FilterResult:
+        """ตรวจ chunk แล้วตัดสินใจว่าจะข้ามหรือส่งต่อไป Whisper (ถ้าถอดรหัสไม่ได้จะส่งต่อตามเดิม)"""
+        self.chunks_total += 1
+        if not self._ffmpeg_available:
+            return FilterResult(False, audio_data)
+
+        try:
+            pcm = await decode_to_pcm(audio_data, self.sample_rate)
+        except FileNotFoundError:
+            logger.error("ffmpeg not found, voice activity detection disabled")
+            self._ffmpeg_available = False
+            return FilterResult(False, audio_data)
+        if pcm is None:
+            self.decode_failures += 1
+            return FilterResult(False, audio_data)
+
+        result = await asyncio.to_thread(self.analyze, pcm)
+        if not result.has_speech:
+            self.chunks_skipped += 1
+            self.seconds_skipped += result.duration
+            logger.info(f"Skipped silent chunk ({result.duration:.2f}s, speech {result.speech_duration:.2f}s)")
+            return FilterResult(True, audio_data, result.duration)
+
+        if not self.trim:
+            return FilterResult(False, audio_data, result.duration, pcm=pcm)
+
+        # ตัดช่วงเงียบหัวท้ายแล้วส่งเป็น WAV 16 kHz mono
+        start = max(0, int(result.speech_start * self.sample_rate) - self.trim_padding)
+        end = min(len(pcm), int(result.speech_end * self.sample_rate) + self.trim_padding)
+        trimmed = (len(pcm) - (end - start)) / self.sample_rate
+        self.seconds_trimmed += trimmed
+        return FilterResult(False, encode_wav(pcm[start:end], self.sample_rate), result.duration, trimmed, pcm)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._ffmpeg_available,
+            "chunks_total": self.chunks_total,
+            "chunks_skipped": self.chunks_skipped,
+            "seconds_skipped": round(self.seconds_skipped, 2),
+            "seconds_trimmed": round(self.seconds_trimmed, 2),
+            "decode_failures": self.decode_failures,
+        }
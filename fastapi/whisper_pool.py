@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urljoin
+
+import numpy as np
+
+from backend_health import BackendMonitor
+from http_client import BackendResponse
+from whisper_scheduler import WhisperScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class WhisperReplica:
+    """Whisper หนึ่ง instance พร้อมจำนวนงานที่ส่งไปแล้วยังไม่ได้คำตอบ"""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.hedges_won = 0
+
+
+SendFunc = Callable[[WhisperReplica], Awaitable[BackendResponse]]
+
+
+class WhisperPool:
+    """กระจายงานไปยัง Whisper หลาย replica: เลือกตัวที่งานค้างน้อยและเร็วที่สุด ข้ามตัวที่ไม่พร้อม
+    และ (ถ้าเปิด hedging) ส่งซ้ำไปอีก replica เมื่อรอนานเกิน percentile ของ latency แล้วใช้คำตอบที่มาก่อน"""
+
+    def __init__(
+        self,
+        monitor: BackendMonitor,
+        urls: List[str],
+        probe_path: str = "/openapi.json",
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 0.5,
+        hedge_min_samples: int = 20,
+        latency_window: int = 200,
+    ):
+        self.monitor = monitor
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.replicas: Dict[str, WhisperReplica] = {}
+        # replica เดียวใช้ชื่อ "whisper" ตามเดิม เพื่อไม่ให้ชื่อใน health/metrics เปลี่ยน
+        for i, url in enumerate(urls):
+            name = "whisper" if len(urls) == 1 else f"whisper-{i + 1}"
+            self.replicas[name] = WhisperReplica(name, url)
+            monitor.register(name, urljoin(url, probe_path))
+        self._latencies = deque(maxlen=latency_window)
+        self._reported_available: Optional[bool] = None
+        self.hedges_sent = 0
+
+    @property
+    def is_available(self) -> bool:
+        return any(self.monitor.get(name).is_available for name in self.replicas)
+
+    def accepting(self) -> bool:
+        """มี replica ที่ circuit breaker ยอมให้ส่งงาน (หรือถึงเวลาลองใหม่) อย่างน้อยหนึ่งตัว"""
+        return any(not self.monitor.get(name).breaker.is_blocking for name in self.replicas)
+
+    def availability_changed(self) -> bool:
+        """คืน True ถ้าสถานะรวม (มี replica พร้อมอย่างน้อยหนึ่งตัว) เปลี่ยนไปจากครั้งก่อนที่ตรวจ"""
+        available = self.is_available
+        changed = available != self._reported_available
+        self._reported_available = available
+        return changed
+
+    def _expected_wait(self, replica: WhisperReplica, default_latency: float) -> float:
+        latency = self.monitor.get(replica.name).avg_latency
+        return (replica.outstanding + 1) * (latency if latency is not None else default_latency)
+
+    def choose(self, exclude: Iterable[WhisperReplica] = ()) -> Optional[WhisperReplica]:
+        """เลือก replica ที่คาดว่าจะตอบเร็วที่สุด (งานค้าง x latency เฉลี่ย) ที่ circuit breaker อนุญาต"""
+        excluded = set(replica.name for replica in exclude)
+        candidates = [replica for name, replica in self.replicas.items() if name not in excluded]
+        # ข้าม replica ที่ probe ล่าสุดล้มเหลว (ถ้าไม่มีตัวไหนผ่านเลย ให้ circuit breaker เป็นตัวตัดสิน)
+        healthy = [replica for replica in candidates if self.monitor.get(replica.name).is_up is not False]
+        candidates = healthy or candidates
+
+        known = [self.monitor.get(r.name).avg_latency for r in candidates if self.monitor.get(r.name).avg_latency]
+        default_latency = sum(known) / len(known) if known else 1.0
+        for replica in sorted(candidates, key=lambda r: self._expected_wait(r, default_latency)):
+            if self.monitor.allow_request(replica.name):
+                return replica
+        return None
+
+    def hedge_delay(self) -> Optional[float]:
+        """เวลารอก่อนส่ง request ซ้ำ (None = ยังมีสถิติไม่พอ)"""
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, float(np.percentile(self._latencies, self.hedge_percentile)))
+
+    async def request(
+        self, send: SendFunc, allow_hedge: bool = True, scheduler: Optional[WhisperScheduler] = None
+    ) -> Optional[BackendResponse]:
+        """ส่งงานผ่าน replica ที่เลือก คืน None ถ้าไม่มี replica ที่รับงานได้
+        ถ้าให้ scheduler มา request ที่ส่งซ้ำต้องได้ slot ของตัวเองก่อน จำนวนที่ส่งพร้อมกันจึงไม่เกิน max_concurrency"""
+        primary = self.choose()
+        if primary is None:
+            return None
+        delay = self.hedge_delay() if self.hedge and allow_hedge and len(self.replicas) > 1 else None
+        if delay is None:
+            return await self._send(primary, send)
+
+        first = asyncio.create_task(self._send(primary, send))
+        pending = {first}
+        hedge_slot = False
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            # ส่งซ้ำเฉพาะไปยัง replica ที่ว่าง เพื่อไม่ให้ hedging เพิ่มภาระตอนระบบหนักอยู่แล้ว
+            secondary = self.choose(exclude=[primary])
+            if secondary is None or secondary.outstanding > 0:
+                return await first
+            if scheduler is not None:
+                hedge_slot = scheduler.try_acquire()
+                if not hedge_slot:
+                    return await first
+            self.hedges_sent += 1
+            logger.info(f"Hedging Whisper request to {secondary.name} after {delay:.2f}s on {primary.name}")
+            second = asyncio.create_task(self._send(secondary, send))
+            pending.add(second)
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # ใช้คำตอบแรกที่สำเร็จ ถ้าตัวแรกที่ตอบกลับล้มเหลวให้รออีกตัว
+                    if task.exception() is None and task.result().status_code < 500:
+                        if task is second:
+                            secondary.hedges_won += 1
+                        return task.result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            # คำตอบที่ช้ากว่า (หรือเมื่อผู้เรียกถูกยกเลิก) ไม่ต้องรอต่อ
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if hedge_slot:
+                scheduler.release()
+
+    async def _send(self, replica: WhisperReplica, send: SendFunc) -> BackendResponse:
+        replica.outstanding += 1
+        replica.requests += 1
+        started = time.perf_counter()
+        try:
+            response = await send(replica)
+        except asyncio.CancelledError:
+            # แพ้การแข่งของ hedging ไม่นับว่า replica ล้มเหลว
+            raise
+        except Exception as e:
+            await self.monitor.record_result(replica.name, False, error=str(e) or type(e).__name__)
+            raise
+        finally:
+            replica.outstanding -= 1
+
+        ok = response.status_code < 500
+        if ok:
+            self._latencies.append(time.perf_counter() - started)
+        # 4xx เป็นปัญหาของ request ไม่ใช่ของ backend จึงไม่นับเป็นความล้มเหลว
+        await self.monitor.record_result(
+            replica.name,
+            ok,
+            response.elapsed,
+            None if ok else f"HTTP {response.status_code}"
+        )
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "hedging": self.hedge,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1) if self.hedge_delay() is not None else None,
+            "hedges_sent": self.hedges_sent,
+            "replicas": {
+                name: {
+                    "url": replica.url,
+                    "outstanding": replica.outstanding,
+                    "requests": replica.requests,
+                    "hedges_won": replica.hedges_won,
+                    "available": self.monitor.get(name).is_available,
+                }
+                for name, replica in self.replicas.items()
+            },
+        }
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# ระดับความสำคัญ (ค่าน้อยได้ก่อน)
+PRIORITY_LIVE = 0  # เสียงสดจาก WebSocket
+PRIORITY_BATCH = 1  # ไฟล์ที่อัปโหลดผ่าน /transcribe
+
+
+class SchedulerBusy(Exception):
+    """Whisper ไม่ว่างพอจะรับงาน (คิวเต็มหรือรอนานเกินกำหนด) พร้อมเวลาที่แนะนำให้ลองใหม่"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, client_id: str, priority: int, future: asyncio.Future):
+        self.client_id = client_id
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class WhisperScheduler:
+    """ควบคุมจำนวนงานที่ส่งไป Whisper พร้อมกันทั้งระบบ โดยจัดคิวแบบ round-robin ต่อ client_id
+    แยกตามระดับความสำคัญ และตัดงานที่รอนานเกิน deadline ทิ้ง"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 2,
+        max_queue: int = 100,
+        deadlines: Optional[Dict[int, float]] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.deadlines = deadlines or {PRIORITY_LIVE: 10.0, PRIORITY_BATCH: 120.0}
+        self.active = 0
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Ticket]]"] = {}
+        self._waiting = 0
+        self._avg_service_time: Optional[float] = None
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def retry_after(self) -> int:
+        """ประมาณเวลา (วินาที) ที่คิวจะว่างพอให้ลองใหม่"""
+        service_time = self._avg_service_time or 5.0
+        return max(1, math.ceil(service_time * (self._waiting + 1) / self.max_concurrency))
+
+    async def acquire(self, client_id: str, priority: int = PRIORITY_LIVE):
+        """รอจนได้สิทธิ์ส่งงานไป Whisper หรือ raise SchedulerBusy"""
+        if self.active < self.max_concurrency and self._waiting == 0:
+            self.active += 1
+            return
+
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerBusy("queue_full", self.retry_after())
+
+        ticket = _Ticket(client_id, priority, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(priority, OrderedDict()).setdefault(client_id, deque()).append(ticket)
+        self._waiting += 1
+
+        try:
+            await asyncio.wait_for(ticket.future, timeout=self.deadlines.get(priority))
+        except asyncio.TimeoutError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # ได้สิทธิ์พร้อมกับที่หมดเวลา (ก่อนผู้รอได้ทำงานต่อ) ต้องคืนสิทธิ์ ไม่เช่นนั้น slot จะหายไปถาวร
+                self.release()
+            else:
+                self._discard(ticket)
+            self.expired += 1
+            logger.warning(f"Dropped stale Whisper request for {client_id} after waiting in queue")
+            raise SchedulerBusy("deadline_exceeded", self.retry_after())
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # ได้สิทธิ์แล้วแต่ผู้เรียกถูกยกเลิก ต้องคืนสิทธิ์
+                self.release()
+            else:
+                self._discard(ticket)
+            raise
+
+    def try_acquire(self) -> bool:
+        """จองสิทธิ์ทันทีถ้ามี slot ว่างและไม่มีงานรอคิวอยู่ (ไม่รอ ไม่แซงคิว)"""
+        if self.active < self.max_concurrency and self._waiting == 0:
+            self.active += 1
+            return True
+        return False
+
+    def release(self, service_time: Optional[float] = None):
+        self.active -= 1
+        if service_time is not None:
+            self.completed += 1
+            self._avg_service_time = (
+                service_time if self._avg_service_time is None
+                else 0.8 * self._avg_service_time + 0.2 * service_time
+            )
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, client_id: str, priority: int = PRIORITY_LIVE):
+        """ใช้กับ async with เพื่อจองและคืนสิทธิ์อัตโนมัติ"""
+        await self.acquire(client_id, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def _discard(self, ticket: _Ticket):
+        clients = self._queues.get(ticket.priority, {})
+        tickets = clients.get(ticket.client_id)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            self._waiting -= 1
+            if not tickets:
+                del clients[ticket.client_id]
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            while clients:
+                # round-robin: หยิบ client แรกแล้วย้ายไปท้ายคิว
+                client_id, tickets = next(iter(clients.items()))
+                ticket = tickets.popleft()
+                self._waiting -= 1
+                if tickets:
+                    clients.move_to_end(client_id)
+                else:
+                    del clients[client_id]
+                if not ticket.future.done():
+                    return ticket
+        return None
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            self.active += 1
+            ticket.future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self._waiting,
+            "waiting_clients": sum(len(clients) for clients in self._queues.values()),
+            "avg_service_time": round(self._avg_service_time, 3) if self._avg_service_time is not None else None,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# นโยบายเมื่อคิวเต็ม
+DROP_OLDEST = "drop_oldest"  # ทิ้ง chunk ที่เก่าที่สุดในคิวแล้วรับ chunk ใหม่
+REJECT = "reject"  # ไม่รับ chunk ใหม่และแจ้ง client ให้ส่งช้าลง
+OVERFLOW_POLICIES = (DROP_OLDEST, REJECT)
+
+TranscriptFunc = Callable[[str], Awaitable[None]]
+ProcessFunc = Callable[[bytes, str, str, TranscriptFunc], Awaitable[Optional[dict]]]
+SendFunc = Callable[[dict], Awaitable[None]]
+
+
+class AudioChunk:
+    """chunk เสียงหนึ่งชิ้นพร้อมหมายเลขลำดับและภาษาที่ใช้ ณ ตอนที่ได้รับ"""
+
+    def __init__(self, seq: int, audio_data: bytes, source_lang: str, target_lang: str):
+        self.seq = seq
+        self.audio_data = audio_data
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.received_at = time.perf_counter()
+
+
+class ClientPipeline:
+    """แยกการรับข้อมูลจาก WebSocket ออกจากการประมวลผล: คิวจำกัดขนาดต่อ client,
+    ประมวลผลพร้อมกันได้หลาย chunk และส่งผลลัพธ์กลับตามลำดับ seq"""
+
+    def __init__(
+        self,
+        client_id: str,
+        process: ProcessFunc,
+        send: SendFunc,
+        max_queue: int = 4,
+        max_in_flight: int = 2,
+        overflow_policy: str = DROP_OLDEST,
+        max_in_flight_bytes: int = 0,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unsupported overflow policy: {overflow_policy}")
+        self.client_id = client_id
+        self.process = process
+        self.send = send
+        self.max_in_flight = max(1, max_in_flight)
+        self.overflow_policy = overflow_policy
+        self.max_in_flight_bytes = max_in_flight_bytes
+        # ขนาดเสียงที่รับเข้ามาแล้วแต่ยังประมวลผลไม่เสร็จ (ในคิว + กำลังประมวลผล)
+        self.in_flight_bytes = 0
+        # ส่วนของ in_flight_bytes ที่ยังรออยู่ในคิว (ทิ้งได้ด้วย drop_oldest)
+        self.queued_bytes = 0
+        self.queue: "asyncio.Queue[AudioChunk]" = asyncio.Queue(maxsize=max(1, max_queue))
+        self.next_seq = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._next_to_send = 0
+        self._ready: Dict[int, List[dict]] = {}
+        self._follow_ups: Dict[int, List[dict]] = {}
+        self._send_lock = asyncio.Lock()
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        for _ in range(self.max_in_flight):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    async def submit(self, audio_data: bytes, source_lang: str, target_lang: str) -> Optional[int]:
+        """รับ chunk ใหม่เข้าคิว คืนหมายเลข seq หรือ None ถ้าถูกปฏิเสธ
+        (chunk ที่ถูกปฏิเสธหรือทิ้งก็ได้ seq ของตัวเอง seq จึงตรงกับลำดับ chunk ที่ client ส่งเสมอ)"""
+        if self.queue.full() and self.overflow_policy == REJECT:
+            logger.warning(f"Queue full for client {self.client_id}, asking client to slow down")
+            await self._reject({
+                "status": "slow_down",
+                "message": "Server is busy, please send audio less frequently",
+                "queue_size": self.queue.qsize(),
+                "in_flight": self.max_in_flight
+            })
+            return None
+
+        # drop_oldest: ทิ้ง chunk เก่าในคิวจนกว่าคิวจะมีที่และขนาดรวมไม่เกินกำหนด
+        # (chunk ที่กำลังประมวลผลทิ้งไม่ได้ ถ้าทิ้งทั้งคิวแล้วยังเกินก็ปฏิเสธ chunk ใหม่โดยไม่ทิ้งอะไร)
+        if self.overflow_policy == DROP_OLDEST and not self._over_byte_limit(len(audio_data) - self.queued_bytes):
+            while not self.queue.empty() and (self.queue.full() or self._over_byte_limit(len(audio_data))):
+                await self._drop_oldest()
+
+        if self._over_byte_limit(len(audio_data)):
+            # จำกัดหน่วยความจำต่อ client ไม่ว่าจะใช้นโยบายคิวแบบไหน
+            logger.warning(f"Client {self.client_id} has {self.in_flight_bytes} bytes in flight, rejecting chunk")
+            await self._reject({
+                "status": "slow_down",
+                "message": "Too much audio waiting to be processed, please send audio less frequently",
+                "in_flight_bytes": self.in_flight_bytes,
+                "max_in_flight_bytes": self.max_in_flight_bytes
+            })
+            return None
+
+        chunk = AudioChunk(self.next_seq, audio_data, source_lang, target_lang)
+        self.next_seq += 1
+        self.in_flight_bytes += len(audio_data)
+        self.queued_bytes += len(audio_data)
+        self.queue.put_nowait(chunk)
+        return chunk.seq
+
+    def _over_byte_limit(self, nbytes: int) -> bool:
+        return bool(self.max_in_flight_bytes) and self.in_flight_bytes + nbytes > self.max_in_flight_bytes
+
+    async def _drop_oldest(self):
+        oldest = self.queue.get_nowait()
+        self.queue.task_done()
+        self.in_flight_bytes -= len(oldest.audio_data)
+        self.queued_bytes -= len(oldest.audio_data)
+        self.dropped += 1
+        logger.warning(f"Queue full for client {self.client_id}, dropped chunk seq={oldest.seq}")
+        await self._complete(oldest.seq, [{
+            "status": "dropped",
+            "seq": oldest.seq,
+            "message": "Audio chunk dropped because the server is busy"
+        }])
+
+    async def _reject(self, message: dict):
+        """ไม่รับ chunk: แจ้ง client ทันที (ไม่รอลำดับ) พร้อม seq ของ chunk นั้น แล้วข้าม seq นี้ในลำดับการส่งผล"""
+        seq = self.next_seq
+        self.next_seq += 1
+        self.rejected += 1
+        await self.send_message({**message, "seq": seq})
+        await self._complete(seq, [])
+
+    async def _worker(self):
+        while True:
+            chunk = await self.queue.get()
+            self.queued_bytes -= len(chunk.audio_data)
+            observe_stage("ws_queue_wait", time.perf_counter() - chunk.received_at)
+            transcript_sent = False
+
+            async def on_transcript(text: str, chunk: AudioChunk = chunk):
+                # ส่งข้อความต้นฉบับทันทีที่ Whisper ตอบ คำแปลจะตามมาด้วย segment_id เดียวกัน
+                nonlocal transcript_sent
+                transcript_sent = True
+                observe_stage("ws_time_to_transcript", time.perf_counter() - chunk.received_at)
+                await self._complete(chunk.seq, [{
+                    "type": "transcript",
+                    "segment_id": chunk.seq,
+                    "seq": chunk.seq,
+                    "text": text,
+                    "source_lang": chunk.source_lang,
+                    "target_lang": chunk.target_lang
+                }])
+
+            try:
+                result = await self.process(chunk.audio_data, chunk.source_lang, chunk.target_lang, on_transcript)
+                messages = build_result_messages(result, chunk.source_lang, chunk.target_lang)
+            except Exception as e:
+                logger.error(f"Error processing chunk seq={chunk.seq} for {self.client_id}: {str(e)}")
+                messages = [{
+                    "error": f"เกิดข้อผิดพลาด: {str(e)}",
+                    "source_lang": chunk.source_lang,
+                    "target_lang": chunk.target_lang
+                }]
+            finally:
+                self.queue.task_done()
+                self.in_flight_bytes -= len(chunk.audio_data)
+            for message in messages:
+                message["seq"] = chunk.seq
+            observe_stage("ws_time_to_result", time.perf_counter() - chunk.received_at)
+            if transcript_sent:
+                await self._follow_up(chunk.seq, [build_translation_message(message) for message in messages])
+            else:
+                await self._complete(chunk.seq, messages)
+
+    async def _complete(self, seq: int, messages: List[dict]):
+        """เก็บผลลัพธ์ไว้แล้วส่งออกไปเฉพาะส่วนที่เรียงลำดับต่อกันได้แล้ว"""
+        async with self._send_lock:
+            self._ready[seq] = messages
+            while self._next_to_send in self._ready:
+                pending = self._ready.pop(self._next_to_send)
+                pending.extend(self._follow_ups.pop(self._next_to_send, []))
+                self._next_to_send += 1
+                await self._send_all(pending)
+
+    async def _follow_up(self, seq: int, messages: List[dict]):
+        """ส่งข้อความที่ตามหลังผลส่วนแรกของ seq (เช่นคำแปล) โดยไม่ต้องรอ seq อื่น
+        ถ้าส่วนแรกยังติดลำดับอยู่จะรอส่งต่อท้ายส่วนแรกทันทีที่ส่วนแรกถูกส่ง"""
+        async with self._send_lock:
+            if seq >= self._next_to_send:
+                self._follow_ups.setdefault(seq, []).extend(messages)
+                return
+            await self._send_all(messages)
+
+    async def _send_all(self, messages: List[dict]):
+        for message in messages:
+            try:
+                await self.send(message)
+            except Exception as e:
+                logger.error(f"Error sending result to {self.client_id}: {str(e)}")
+
+    async def send_message(self, message: dict, timeout: Optional[float] = None):
+        """ส่งข้อความที่ไม่ขึ้นกับลำดับ seq (เช่น การยืนยันการตั้งค่า)
+        timeout จำกัดเฉพาะเวลาเขียนลง socket ไม่นับเวลาที่รอข้อความอื่นของ client เดียวกันส่งเสร็จ"""
+        async with self._send_lock:
+            if timeout:
+                await asyncio.wait_for(self.send(message), timeout)
+            else:
+                await self.send(message)
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._workers.clear()
+
+
+def build_result_messages(result: Optional[dict], source_lang: str, target_lang: str) -> List[dict]:
+    """แปลงผลของหนึ่ง chunk เป็นรายการข้อความที่ส่งให้ client (โหมด streaming อาจมีทั้ง final และ partial)"""
+    if result and result.get("streaming"):
+        messages = []
+        if result["final"]:
+            # มี key "text" และ "translated_text" เหมือนผลลัพธ์ปกติ client เดิมจึงแสดงผลได้ทันที
+            messages.append({
+                "type": "final",
+                **result["final"],
+                "source_lang": result["source_lang"],
+                "target_lang": result["target_lang"]
+            })
+        messages.append({
+            "type": "partial",
+            "partial_text": result["partial_text"],
+            "buffer_seconds": result["buffer_seconds"],
+            "source_lang": result["source_lang"],
+            "target_lang": result["target_lang"]
+        })
+        return messages
+    return [build_result_message(result, source_lang, target_lang)]
+
+
+def build_translation_message(message: dict) -> dict:
+    """แปลงผลลัพธ์ของ chunk ที่ส่งข้อความต้นฉบับไปแล้วเป็นข้อความ translation (ไม่ส่ง text ซ้ำ)"""
+    translation = {key: value for key, value in message.items() if key != "text"}
+    return {"type": "translation", "segment_id": message["seq"], **translation}
+
+
+def build_result_message(result: Optional[dict], source_lang: str, target_lang: str) -> dict:
+    """แปลงผลจาก process_audio_and_translate เป็นข้อความที่ส่งให้ client"""
+    if not result:
+        # กรณีไม่มีผลลัพธ์
+        return {
+            "error": "ไม่สามารถประมวลผลเสียงได้",
+            "source_lang": source_lang,
+            "target_lang": target_lang
+        }
+    if result.get("silence"):
+        # VAD ตรวจแล้วไม่มีเสียงพูด จึงไม่ได้ส่งไป Whisper
+        return {
+            "status": "silence",
+            "duration": result["duration"],
+            "source_lang": result["source_lang"],
+            "target_lang": result["target_lang"]
+        }
+    if result.get("busy"):
+        # Whisper มีงานค้างมาก แจ้งเวลาที่ควรลองใหม่
+        return {
+            "status": "busy",
+            "error": result["error"],
+            "retry_after": result["retry_after"],
+            "source_lang": result["source_lang"],
+            "target_lang": result["target_lang"]
+        }
+    if "error" in result:
+        # ส่งข้อความแจ้งข้อผิดพลาด
+        return {
+            "error": result["error"],
+            "source_lang": result["source_lang"],
+            "target_lang": result["target_lang"]
+        }
+    # ส่งข้อความต้นฉบับและข้อความที่แปลแล้ว
+    return {
+        "text": result["original_text"],
+        "translated_text": result["translated_text"],
+        "source_lang": result["source_lang"],
+        "target_lang": result["target_lang"]
+    }
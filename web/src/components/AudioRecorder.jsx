@@ -53,6 +53,9 @@ const AudioRecorder = () => {
   const analyser = useRef(null);
   const audioLevelInterval = useRef(null);
   const whisperStatusInterval = useRef(null);
+  // segment ที่แสดงข้อความต้นฉบับแล้วแต่ยังรอคำแปล (เรียงตาม segment_id) และคำแปลที่มาถึงก่อนลำดับ
+  const pendingSegments = useRef([]);
+  const arrivedTranslations = useRef({});
 
   useEffect(() => {
     // สร้าง session ID สำหรับบันทึก
@@ -282,6 +285,8 @@ const AudioRecorder = () => {
       ws.current.addEventListener('open', () => {
         console.log('WebSocket Connected! ReadyState:', ws.current?.readyState);
         clearTimeout(connectionTimeout);
+        // segment_id เริ่มนับใหม่ทุกการเชื่อมต่อ คำแปลที่ค้างจากการเชื่อมต่อเดิมจะไม่มาแล้ว
+        resetTranslationOrder();
         
         // เมื่อเชื่อมต่อ WebSocket สำเร็จ ให้ตรวจสอบสถานะ Whisper
         checkWhisperCapabilities().then(whisperReady => {
@@ -321,13 +326,84 @@ const AudioRecorder = () => {
     }
   };
 
+  // แปลงคำแปลที่ล้มเหลวเป็นข้อความแจ้งเตือน
+  const formatTranslation = (translatedText) => {
+    if (translatedText.includes("Translation failed") ||
+        translatedText.includes("Maximum retries exceeded") ||
+        translatedText.includes("การแปลล้มเหลว")) {
+      return "⚠️ การแปลล้มเหลว กรุณาลองอีกครั้ง";
+    }
+    return translatedText;
+  };
+
+  const appendTranslation = (text) => {
+    if (!text) return;
+    setTranslation(prev => {
+      if (!prev) return text;
+      // ข้อความแจ้งเตือนขึ้นบรรทัดใหม่ คำแปลปกติต่อท้ายด้วยช่องว่าง
+      return text.startsWith("⚠️") ? `${prev}\n${text}` : `${prev} ${text}`;
+    });
+  };
+
+  // แสดงคำแปลตามลำดับ segment: คำแปลที่มาก่อน segment ก่อนหน้าจะรอจนถึงคิวของตัวเอง
+  const handleSegmentTranslation = (segmentId, text) => {
+    if (!pendingSegments.current.includes(segmentId)) {
+      appendTranslation(text);
+      return;
+    }
+    arrivedTranslations.current[segmentId] = text;
+    while (pendingSegments.current.length > 0 && pendingSegments.current[0] in arrivedTranslations.current) {
+      const nextId = pendingSegments.current.shift();
+      appendTranslation(arrivedTranslations.current[nextId]);
+      delete arrivedTranslations.current[nextId];
+    }
+  };
+
+  // แสดงคำแปลที่มาถึงแล้วตามลำดับ และเลิกรอ segment ที่ยังไม่มีคำแปล
+  const resetTranslationOrder = () => {
+    pendingSegments.current.forEach(segmentId => {
+      if (segmentId in arrivedTranslations.current) {
+        appendTranslation(arrivedTranslations.current[segmentId]);
+      }
+    });
+    pendingSegments.current = [];
+    arrivedTranslations.current = {};
+  };
+
   const handleWebSocketMessage = (event) => {
     if (!event.data) return;
     try {
       const message = JSON.parse(event.data);
+
+      // ตอบ heartbeat ของ server เพื่อไม่ให้ถูกตัดว่าการเชื่อมต่อตาย
+      if (message.type === "ping") {
+        ws.current?.send(JSON.stringify({ type: "pong" }));
+        return;
+      }
       
       // หยุดการแสดงสถานะกำลังประมวลผล
       setIsProcessing(false);
+
+      // ผลแบบสองขั้น: ข้อความต้นฉบับมาก่อน คำแปลของ segment เดียวกันตามมาทีหลัง
+      // เมื่อประมวลผลหลาย chunk พร้อมกัน คำแปลอาจมาไม่ตรงลำดับ จึงเรียงตาม segment_id ก่อนแสดง
+      if (message.type === "transcript") {
+        pendingSegments.current.push(message.segment_id);
+        setTranscription(prev => {
+          const newText = message.text.trim();
+          return prev ? `${prev} ${newText}` : newText;
+        });
+        return;
+      }
+      if (message.type === "translation") {
+        if (message.error) {
+          // แปลไม่สำเร็จหลังส่งข้อความต้นฉบับไปแล้ว
+          console.error('Translation error:', message.error);
+          handleSegmentTranslation(message.segment_id, "⚠️ การแปลล้มเหลว กรุณาลองอีกครั้ง");
+        } else {
+          handleSegmentTranslation(message.segment_id, formatTranslation((message.translated_text || '').trim()));
+        }
+        return;
+      }
       
       // ตรวจสอบข้อความผิดพลาด
       if (message.error) {
@@ -363,21 +439,8 @@ const AudioRecorder = () => {
         
         // จัดการกับข้อความแปล
         if (message.translated_text) {
-          const translatedText = message.translated_text.trim();
-          
-          // ตรวจสอบว่าการแปลล้มเหลวหรือไม่
-          if (translatedText.includes("Translation failed") || 
-              translatedText.includes("Maximum retries exceeded")) {
-            setTranslation(prev => {
-              const errorMessage = "⚠️ การแปลล้มเหลว กรุณาลองอีกครั้ง";
-              return prev ? `${prev}\n${errorMessage}` : errorMessage;
-            });
-          } else {
-            // การแปลสำเร็จ
-            setTranslation(prev => {
-              return prev ? `${prev} ${translatedText}` : translatedText;
-            });
-          }
+          // คำแปลที่ล้มเหลวจะแสดงเป็นข้อความแจ้งเตือน
+          appendTranslation(formatTranslation(message.translated_text.trim()));
         }
       } else if (message.status === "ok" && message.message === "Language settings updated") {
         // การตั้งค่าภาษาสำเร็จ
@@ -582,6 +645,8 @@ const AudioRecorder = () => {
   };
 
   const clearText = () => {
+    pendingSegments.current = [];
+    arrivedTranslations.current = {};
     setTranscription('');
     setTranslation('');
   };
@@ -596,7 +661,8 @@ const AudioRecorder = () => {
     setIsSettingLanguage(true);
     const settings = {
       source_lang: sourceLanguage,
-      target_lang: targetLanguage
+      target_lang: targetLanguage,
+      two_phase: true
     };
     
     try {